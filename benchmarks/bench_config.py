@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from migrator.config_store import ConfigStore
+from migrator.utils import read_hosts_config, save_hosts_config
+
+
+READS = 20000
+WRITES = 500
+
+
+def bench_naive_read(json_path: Path) -> float:
+    def read():
+        with open(json_path, "r") as f:
+            json.load(f)
+
+    return timeit.timeit(read, number=READS) / READS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = Path(tmp_dir) / "config.json"
+        with open(Path(__file__).resolve().parent.parent / "config.json", "r") as f:
+            json_path.write_text(f.read())
+
+        store = ConfigStore(json_path)
+        naive_read = bench_naive_read(json_path)
+        store_read = timeit.timeit(store.read, number=READS) / READS
+        hosts_read = timeit.timeit(lambda: read_hosts_config(str(json_path)), number=READS) / READS
+        store_write = timeit.timeit(
+            lambda: store.update({"xml_folder": "/tmp"}), number=WRITES
+        ) / WRITES
+        with contextlib.redirect_stdout(io.StringIO()):
+            hosts_write = timeit.timeit(
+                lambda: save_hosts_config(xml_folder="/tmp", json_path=str(json_path)), number=WRITES
+            ) / WRITES
+
+    print(f"{'operation':<32}{'us/op':>12}")
+    for name, seconds in (
+        ("open + json.load", naive_read),
+        ("ConfigStore.read (cached)", store_read),
+        ("read_hosts_config", hosts_read),
+        ("ConfigStore.update", store_write),
+        ("save_hosts_config", hosts_write),
+    ):
+        print(f"{name:<32}{seconds * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.server
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from standins import install_shims, local_client_factory, shim_environment
+from migrator import image_store
+from migrator.image_store import ImageStore
+from migrator.ssh_pool import ssh_pool
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    delay = 0.0
+    fail_after = None
+    served = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404)
+            return None
+        size = path.stat().st_size
+        header = self.headers.get("Range")
+        if not header:
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            return open(path, "rb")
+
+        cls = type(self)
+        cls.served += 1
+        if cls.fail_after is not None and cls.served > cls.fail_after:
+            self.send_error(503)
+            return None
+        time.sleep(cls.delay)
+        start, _, end = header.removeprefix("bytes=").partition("-")
+        start, end = int(start), min(int(end), size - 1)
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "range_remaining", None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        outputfile.write(source.read(remaining))
+
+
+def serve(directory: Path) -> http.server.ThreadingHTTPServer:
+    handler = lambda *args, **kwargs: RangeHandler(*args, directory=str(directory), **kwargs)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(func) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the content-addressed image store against a local HTTP server.")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the served image")
+    parser.add_argument("--delay", type=float, default=0.02, help="Per-range server latency in seconds")
+    parser.add_argument("--streams", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    root = Path(tempfile.mkdtemp(prefix="migrator-images-"))
+    try:
+        install_shims(root / "bin")
+        (root / "state").mkdir()
+        os.environ.update(shim_environment(root / "bin", root / "state", SHIM_VM_NAME="bench-vm"))
+        served = root / "www"
+        served.mkdir()
+        image = served / "install.iso"
+        with open(image, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        (served / "copy.iso").write_bytes(image.read_bytes())
+        expected = image_store.hash_file(image)
+
+        server = serve(served)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        RangeHandler.delay = args.delay
+        rows = []
+
+        for streams in (1, args.streams):
+            nfs = root / f"nfs-{streams}"
+            seconds, path = timed(lambda: ImageStore(nfs).fetch(f"{base_url}/install.iso", "ubuntu", expected, streams))
+            assert image_store.hash_file(path) == expected
+            rows.append((f"cold download, {streams} stream(s)", seconds))
+
+        store = ImageStore(root / f"nfs-{args.streams}")
+        rows.append(("cache hit by name", timed(lambda: store.fetch(f"{base_url}/install.iso", "ubuntu"))[0]))
+        seconds, path = timed(lambda: store.fetch(f"{base_url}/copy.iso", "mirror", expected))
+        rows.append(("cache hit by checksum", seconds))
+        seconds, path = timed(lambda: store.fetch(f"{base_url}/copy.iso", "mirror-unverified"))
+        blobs = [p for p in store.blobs_dir.iterdir() if not p.name.startswith(".")]
+        assert len(blobs) == 1, blobs
+        rows.append(("same content under new url (dedup)", seconds))
+
+        resume_store = ImageStore(root / "nfs-resume")
+        chunks = -(-args.size_mb * 1024 * 1024 // image_store.CHUNK_SIZE)
+        RangeHandler.served, RangeHandler.fail_after = 0, chunks // 2
+        try:
+            resume_store.fetch(f"{base_url}/install.iso", "ubuntu", expected, args.streams)
+            raise AssertionError("interrupted download unexpectedly succeeded")
+        except Exception as e:
+            if isinstance(e, AssertionError):
+                raise
+        RangeHandler.served, RangeHandler.fail_after = 0, None
+        seconds, path = timed(lambda: resume_store.fetch(f"{base_url}/install.iso", "ubuntu", expected, args.streams))
+        assert image_store.hash_file(path) == expected
+        rows.append((f"resume after {chunks // 2}/{chunks} chunks ({RangeHandler.served} fetched)", seconds))
+
+        concurrent_store = ImageStore(root / "nfs-concurrent")
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(concurrent_store.fetch(f"{base_url}/install.iso", "ubuntu", expected, args.streams))
+            )
+            for _ in range(2)
+        ]
+        seconds = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 2 and results[0] == results[1], results
+        assert image_store.hash_file(results[0]) == expected
+        rows.append(("two concurrent fetches of one url", time.monotonic() - seconds))
+
+        budget_gb = args.size_mb * 1.5 / 1024
+        evict_store = ImageStore(root / f"nfs-{args.streams}", budget_gb, hosts=["10.0.0.2"], credentials=("bench", ""))
+        other = served / "other.iso"
+        other.write_bytes(os.urandom(args.size_mb * 1024 * 1024))
+        os.environ["SHIM_REMOTE_IMAGE"] = str(root / "unrelated.img")
+        # The other host mounts the export elsewhere and has the cached ISO attached.
+        remote_env = dict(os.environ, SHIM_REMOTE_IMAGE=f"/mnt/nfs/images/sha256/{evict_store.lookup('ubuntu').name}")
+        ssh_pool.client_factory = local_client_factory(remote_env)
+        evict_store.fetch(f"{base_url}/other.iso", "other")
+        assert evict_store.lookup("ubuntu") is not None, "evicted an image attached to a domain on another host"
+        ssh_pool.close_all()
+        ssh_pool.client_factory = local_client_factory(dict(os.environ))
+        evict_store.evict()
+        remaining = [p.name for p in evict_store.blobs_dir.iterdir() if not p.name.startswith(".")]
+        assert remaining == [f"{image_store.hash_file(other)}.iso"], remaining
+        assert evict_store.lookup("ubuntu") is None
+        rows.append(("lru eviction to budget", 0.0))
+        server.shutdown()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{'scenario':<48}{'seconds':>10}{'MiB/s':>10}")
+    for name, seconds in rows:
+        rate = args.size_mb / seconds if seconds > 0.01 else 0
+        print(f"{name:<48}{seconds:>10.3f}{rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
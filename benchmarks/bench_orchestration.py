@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import argparse
+import builtins
+import contextlib
+import getpass
+import io
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from standins import install_shims, local_client_factory, shim_environment
+
+
+VM_NAME = "bench-vm"
+TEMPLATE = "bench-base"
+DRAINED_HOST = "10.9.9.9"
+IMAGE_SIZE = 64 * 1024 * 1024
+HOST_COUNTS = (1, 10, 100)
+
+
+def host_ips(count: int) -> list[str]:
+    return [f"10.0.{index // 250}.{index % 250 + 1}" for index in range(count)]
+
+
+class Workspace:
+    def __init__(self, root: Path, latency: float, handshake: float):
+        self.root = root
+        self.bin_dir = root / "bin"
+        self.state_dir = root / "state"
+        self.nfs_dir = root / "nfs"
+        self.local_vm_dir = root / "vms"
+        self.remote_dir = root / "remote"
+        self.xml_dir = root / "xml"
+        for folder in (self.state_dir, self.nfs_dir, self.local_vm_dir, self.remote_dir, self.xml_dir):
+            folder.mkdir(parents=True)
+        install_shims(self.bin_dir)
+
+        self.remote_image = self.remote_dir / f"{VM_NAME}.img"
+        for image in (self.remote_image, self.nfs_dir / f"{VM_NAME}.img"):
+            with open(image, "wb") as f:
+                f.truncate(IMAGE_SIZE)
+                f.seek(IMAGE_SIZE // 4)
+                f.write(os.urandom(4 * 1024 * 1024))
+        (self.nfs_dir / "images").mkdir()
+        (self.nfs_dir / "images" / f"{TEMPLATE}.qcow2").write_bytes(b"\0" * 4096)
+        self.iso = self.root / "install.iso"
+        self.iso.write_bytes(b"\0" * 4096)
+        self.exports = self.root / "exports"
+
+        self.env = shim_environment(
+            self.bin_dir,
+            self.state_dir,
+            HOME=root,
+            SHIM_LATENCY=latency,
+            SHIM_VM_NAME=VM_NAME,
+            SHIM_REMOTE_IMAGE=self.remote_image,
+            MIGRATOR_SSH_PASSWORD="bench",
+        )
+        self.handshake = handshake
+
+    def reset(self, hosts: list[str]):
+        for entry in self.state_dir.iterdir():
+            entry.unlink()
+        self.exports.write_text("")
+        for image in self.local_vm_dir.glob("*"):
+            image.unlink()
+        for image in self.nfs_dir.glob("bench-new*.img"):
+            image.unlink()
+        config = {
+            "server_ip": "10.0.0.1",
+            "client_ips": hosts,
+            "nfs_path": str(self.nfs_dir),
+            "local_vm_path": str(self.local_vm_dir),
+            "xml_folder": str(self.xml_dir),
+            "vm_names": [VM_NAME],
+            "ssh_user": "bench",
+        }
+        (self.root / "config.json").write_text(json.dumps(config, indent=4))
+        self.env["SHIM_OWNER_HOST"] = hosts[-1]
+        os.environ["SHIM_OWNER_HOST"] = hosts[-1]
+
+
+def scenarios(workspace: Workspace, host_counts):
+    from migrator import advisor, batch, nfs_mount, registry, vm_manager, vm_runner
+
+    for count in host_counts:
+        yield "migrate-nfs", count, lambda: vm_runner.run_vm_nfs(f"{VM_NAME}.img", non_interactive=True)
+        yield "migrate-nfs (registered)", count, lambda count=count: (
+            registry.record(VM_NAME, host_ips(count)[-1], "running"),
+            vm_runner.run_vm_nfs(f"{VM_NAME}.img", non_interactive=True),
+        )
+        yield "create-nfs", count, lambda count=count: nfs_mount.create_nfs_localy(
+            str(workspace.nfs_dir), host_ips(count), export_file=str(workspace.exports)
+        )
+    yield "migrate-scp", 1, lambda: vm_runner.run_vm_scp("10.0.0.1", f"{VM_NAME}.img")
+    yield "migrate-scp --precopy", 1, lambda: vm_runner.run_vm_scp("10.0.0.1", f"{VM_NAME}.img", precopy=True)
+    yield "migrate-local-live", 1, lambda: vm_runner.migrate_live_local(VM_NAME, "10.0.0.1")
+    yield "migrate-nfs-live", 1, lambda: vm_runner.migrate_live_nfs(VM_NAME, "10.0.0.1")
+    yield "create-vm", 1, lambda: vm_manager.create_vm_on_nfs(
+        "bench-new", str(workspace.iso), "ubuntu20.04", 10, 1024
+    )
+    yield "create-vm-from-template", 1, lambda: vm_manager.create_vm_from_template("bench-new", TEMPLATE, 1024)
+    for count in host_counts:
+        yield "evacuate", count, lambda: batch.run_batch(
+            batch.evacuation_jobs(DRAINED_HOST, "bench", "bench", "nfs-live", target="auto"), "bench", "bench"
+        )
+    for count in host_counts:
+        yield "create-vms", count, lambda count=count: vm_manager.create_vms_from_template(
+            vm_manager.expand_vm_names("bench-new", count), TEMPLATE, 1024
+        )
+    yield "plan", 1, lambda: advisor.plan_migration(VM_NAME, "10.0.0.1", "bench", "bench", probe=False)
+    yield "mount", 1, lambda: nfs_mount.mount_nfs("10.0.0.1", "/srv/nfs", str(workspace.root / "mnt"))
+
+
+def run_scenario(workspace: Workspace, func, count: int, repeats: int) -> dict:
+    from migrator import tracing
+    from migrator.ssh_pool import ssh_pool
+
+    timings = []
+    for _ in range(repeats):
+        workspace.reset(host_ips(count))
+        tracing.reset()
+        ssh_pool.client_factory = local_client_factory(workspace.env, workspace.handshake)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        timings.append(time.perf_counter() - start)
+        ssh_pool.close_all()
+
+    breakdown = tracing.phase_breakdown()
+    external = sum(
+        phase["calls"] for name, phase in breakdown.items() if name in ("command", "virsh", "ssh_exec")
+    )
+    return {
+        "wall_ms": statistics.median(timings) * 1000,
+        "external_calls": external,
+        "handshakes": ssh_pool.client_factory.handshakes["count"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure migrator orchestration overhead against stand-in binaries.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Scripted latency of every stand-in binary in seconds")
+    parser.add_argument("--handshake", type=float, default=0.0, help="Simulated SSH handshake time in seconds")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--hosts", type=int, nargs="+", default=list(HOST_COUNTS))
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="migrator-bench-"))
+    try:
+        workspace = Workspace(root, args.latency, args.handshake)
+        os.environ.update(workspace.env)
+        os.chdir(root)
+
+        from migrator import advisor, live_migration, vm_runner
+
+        logging.getLogger().setLevel(logging.WARNING)
+        live_migration.POLL_INTERVAL = 0.01
+        advisor.DIRTY_SAMPLE_SECONDS = 1
+        vm_runner.get_local_ip = lambda: "127.0.0.1"
+        builtins.input = lambda prompt="": "bench"
+        getpass.getpass = lambda prompt="": "bench"
+
+        results = []
+        for name, count, func in scenarios(workspace, args.hosts):
+            result = run_scenario(workspace, func, count, args.repeats)
+            result.update(command=name, hosts=count)
+            results.append(result)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f"{'command':<24}{'hosts':>6}{'wall ms':>10}{'ms/host':>10}{'ext calls':>11}{'handshakes':>12}")
+    for result in results:
+        print(
+            f"{result['command']:<24}{result['hosts']:>6}{result['wall_ms']:>10.1f}"
+            f"{result['wall_ms'] / result['hosts']:>10.2f}{result['external_calls']:>11}{result['handshakes']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
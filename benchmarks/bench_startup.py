@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = (
+    "paramiko",
+    "cryptography",
+    "migrator.ssh_pool",
+    "migrator.vm_runner",
+    "migrator.nfs_mount",
+    "migrator.vm_manager",
+)
+
+
+def import_profile() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI cold-start import time.")
+    parser.add_argument("--budget-ms", type=float, default=350.0, help="Fail if importing main takes longer")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts to sample")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    best = min(profiles, key=lambda modules: modules["main"][1])
+    startup_ms = best["main"][1] / 1000
+
+    print(f"{'module':<40}{'self ms':>10}{'cumulative ms':>16}")
+    heaviest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    for name, (self_us, cumulative_us) in heaviest:
+        print(f"{name:<40}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}")
+    print(f"\nimport main: {startup_ms:.1f} ms (budget {args.budget_ms:.0f} ms, best of {args.runs})")
+
+    failures = []
+    eager = [name for name in best if name.split(".")[0] in HEAVY_MODULES or name in HEAVY_MODULES]
+    if eager:
+        failures.append(f"heavy modules imported at startup: {', '.join(sorted(eager))}")
+    if startup_ms > args.budget_ms:
+        failures.append(f"startup {startup_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
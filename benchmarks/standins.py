@@ -0,0 +1,259 @@
+import os
+import shutil
+import stat
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+
+SHIM_PRELUDE = """#!/bin/bash
+name=$(basename "$0")
+key=$(echo "$name" | tr 'a-z-' 'A-Z_')
+latency_var="SHIM_LATENCY_$key"
+fail_var="SHIM_FAIL_$key"
+latency=${!latency_var:-${SHIM_LATENCY:-0}}
+[ "$latency" != "0" ] && sleep "$latency"
+echo "$name $*" >> "$SHIM_STATE_DIR/calls.log"
+[ "${!fail_var:-0}" = "1" ] && { echo "$name: scripted failure" >&2; exit 1; }
+"""
+
+SHIMS = {
+    "sudo": """
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -S) shift ;;
+        -p) shift 2 ;;
+        *) break ;;
+    esac
+done
+exec "$@"
+""",
+    "virsh": """
+[ "$1" = "-c" ] && shift 2
+host=${SHIM_HOST:-local}
+case "$1" in
+    list) echo "$SHIM_VM_NAME" ;;
+    domblklist)
+        echo " Type   Device   Target   Source"
+        echo "-----------------------------------"
+        echo " file   disk     vda      $SHIM_REMOTE_IMAGE"
+        ;;
+    domstate)
+        if [ -e "$SHIM_STATE_DIR/shutdown_$host" ] || [ "$host" != "$SHIM_OWNER_HOST" ]; then
+            echo "shut off"
+        else
+            echo "running"
+        fi
+        ;;
+    shutdown|destroy) touch "$SHIM_STATE_DIR/shutdown_$host" ;;
+    dominfo)
+        [ -e "$SHIM_STATE_DIR/defined_$2" ] || exit 1
+        echo "Name:           $2"
+        echo "UUID:           $(cat "$SHIM_STATE_DIR/defined_$2")"
+        ;;
+    define) echo "uuid-$RANDOM$RANDOM" > "$SHIM_STATE_DIR/defined_$SHIM_VM_NAME" ;;
+    undefine) rm -f "$SHIM_STATE_DIR/defined_$2" ;;
+    dumpxml)
+        echo "<domain type='kvm'><name>$SHIM_VM_NAME</name><memory unit='KiB'>1048576</memory><devices>"
+        echo "<disk type='file' device='disk'><source file='$SHIM_REMOTE_IMAGE'/><target dev='vda'/></disk>"
+        echo "</devices></domain>"
+        ;;
+    domstats)
+        for vm in ${SHIM_VM_NAMES:-$SHIM_VM_NAME}; do
+            echo "Domain: '$vm'"
+            echo "  balloon.current=1048576"
+            echo "  block.count=1"
+            echo "  block.0.allocation=67108864"
+            echo "  dirtyrate.calc_status=2"
+            echo "  dirtyrate.megabytes_per_second=16"
+            echo
+        done
+        ;;
+    nodeinfo)
+        echo "CPU(s):              8"
+        echo "Memory size:         16777216 KiB"
+        ;;
+    nodememstats)
+        echo "total  :             16777216 KiB"
+        echo "free   :              8388608 KiB"
+        echo "buffers:               0 KiB"
+        echo "cached :               0 KiB"
+        ;;
+    domdirtyrate-calc) ;;
+    migrate) sleep "${SHIM_MIGRATE_SECONDS:-0}" ;;
+    domjobinfo)
+        echo "Job type:         Unbounded"
+        echo "Memory remaining: 512.000 MiB"
+        echo "Dirty rate:       0            pages/s"
+        echo "Memory bandwidth: 1.000 GiB/s"
+        echo "Expected downtime: 30          ms"
+        ;;
+esac
+exit 0
+""",
+    "fuser": """
+host=${SHIM_HOST:-local}
+if [ "$host" = "$SHIM_OWNER_HOST" ] && [ ! -e "$SHIM_STATE_DIR/shutdown_$host" ]; then
+    echo "$1: 1234"
+    exit 0
+fi
+exit 1
+""",
+    "ping": "exit 0\n",
+    "qemu-img": """
+if [ "$1" = "create" ]; then
+    if [[ "${@: -1}" =~ ^[0-9]+[KMGT]?$ ]]; then touch "${@: -2:1}"; else touch "${@: -1}"; fi
+fi
+exit 0
+""",
+    "virt-install": "exit 0\n",
+    "exportfs": "exit 0\n",
+    "mount": "exit 0\n",
+    "umount": "exit 0\n",
+    "mountpoint": "exit 1\n",
+    "chown": "exit 0\n",
+    "chmod": "exit 0\n",
+    "apt": "exit 0\n",
+    "dpkg": "exit 0\n",
+    "wget": "exit 0\n",
+    "sshpass": 'shift 2\nexec "$@"\n',
+    "scp": 'cp "${@: -2:1}" "${@: -1}"\n',
+}
+
+
+def install_shims(bin_dir: Path):
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, body in SHIMS.items():
+        path = bin_dir / name
+        path.write_text(SHIM_PRELUDE + body)
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+class _Transport:
+    def is_active(self) -> bool:
+        return True
+
+
+class _Channel:
+    def __init__(self, process: subprocess.Popen):
+        self._process = process
+
+    def shutdown_write(self):
+        if not self._process.stdin.closed:
+            self._process.stdin.close()
+
+    def exit_status_ready(self) -> bool:
+        return self._process.poll() is not None
+
+    def recv_exit_status(self) -> int:
+        return self._process.wait()
+
+    def recv_ready(self) -> bool:
+        return False
+
+    def recv_stderr_ready(self) -> bool:
+        return False
+
+
+class _Stream:
+    def __init__(self, stream, channel: _Channel):
+        self._stream = stream
+        self.channel = channel
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def write(self, data: str):
+        self._stream.write(data.encode())
+
+    def flush(self):
+        self._stream.flush()
+
+
+class _LocalFile:
+    def __init__(self, path: str, mode: str):
+        self._file = open(path, mode)
+
+    def readv(self, chunks):
+        for offset, length in chunks:
+            self._file.seek(offset)
+            yield self._file.read(length)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class _LocalSFTP:
+    def open(self, path: str, mode: str = "r"):
+        return _LocalFile(path, mode)
+
+    file = open
+
+    def get(self, remote_path: str, local_path: str):
+        shutil.copyfile(remote_path, local_path)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class LocalClient:
+    def __init__(self, host_ip: str, env: dict):
+        self.host_ip = host_ip
+        self._env = dict(env, SHIM_HOST=host_ip)
+
+    def get_transport(self):
+        return _Transport()
+
+    def exec_command(self, command: str, timeout: float = None):
+        process = subprocess.Popen(
+            ["bash", "-c", command],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self._env,
+        )
+        channel = _Channel(process)
+        return _Stream(process.stdin, channel), _Stream(process.stdout, channel), _Stream(process.stderr, channel)
+
+    def open_sftp(self):
+        return _LocalSFTP()
+
+    def close(self):
+        pass
+
+
+def local_client_factory(env: dict, handshake_seconds: float = 0.0):
+    lock = threading.Lock()
+    handshakes = {"count": 0}
+
+    def factory(host_ip: str, user: str, password: str, timeout: float):
+        with lock:
+            handshakes["count"] += 1
+        if handshake_seconds:
+            time.sleep(handshake_seconds)
+        return LocalClient(host_ip, env)
+
+    factory.handshakes = handshakes
+    return factory
+
+
+def shim_environment(bin_dir: Path, state_dir: Path, **settings) -> dict:
+    env = dict(os.environ)
+    env["PATH"] = f"{bin_dir}{os.pathsep}{env.get('PATH', '')}"
+    env["SHIM_STATE_DIR"] = str(state_dir)
+    for key, value in settings.items():
+        env[key] = str(value)
+    return env
@@ -1,24 +1,45 @@
 #!/usr/bin/env python3
 
+import atexit
 import typer
 from typing_extensions import Annotated
-from migrator.nfs_mount import (
-    create_nfs_localy,
-    mount_nfs,
-    create_nfs_remotely,
-    unmount_nfs,
-)
-from migrator.vm_runner import (
-    run_vm_nfs,
-    run_vm_scp,
-    migrate_live_local,
-    migrate_live_nfs,
-)
-from migrator.vm_manager import create_vm_on_nfs, delete_nfs_vm
+from migrator import tracing
 
 app = typer.Typer()
 
 
+@app.callback()
+def main(
+    timings: Annotated[
+        bool,
+        typer.Option("--timings", help="Print a per-phase timing breakdown at exit"),
+    ] = False,
+    trace_file: Annotated[
+        str,
+        typer.Option("--trace-file", help="Append JSON-lines spans to this file (default: $MIGRATOR_TRACE_FILE, off if unset)"),
+    ] = None,
+    metrics_file: Annotated[
+        str,
+        typer.Option("--metrics-file", help="Write a Prometheus textfile with phase metrics at exit"),
+    ] = None,
+):
+    tracing.configure(trace_file, metrics_file)
+    atexit.register(tracing.write_prometheus)
+    if timings:
+        atexit.register(tracing.print_profile)
+
+
+NFSProfileOption = Annotated[
+    str,
+    typer.Option(
+        "--profile",
+        "-p",
+        help="NFS profile: default, vm-disks, throughput, safe or one from nfs_profiles in config.json "
+        "(default: the profile last used)",
+    ),
+]
+
+
 @app.command(help="This command mounts an NFS share to a local directory.")
 def mount(
     host_ip: str = typer.Argument(help="IP address of the NFS server"),
@@ -28,8 +49,11 @@ def mount(
     local_folder: Annotated[
         str, typer.Option("--local-folder", "-lf", help="Local mount point directory")
     ] = "/mnt/nfs",
+    profile: NFSProfileOption = None,
 ):
-    mount_nfs(host_ip, host_folder, local_folder)
+    from migrator.nfs_mount import mount_nfs
+
+    mount_nfs(host_ip, host_folder, local_folder, profile)
 
 
 @app.command(help="This command unmounts an NFS share from a local directory.")
@@ -38,6 +62,8 @@ def unmount(
         str, typer.Argument(help="Local mount point directory")
     ] = "/mnt/nfs",
 ):
+    from migrator.nfs_mount import unmount_nfs
+
     unmount_nfs(local_folder)
 
 
@@ -55,20 +81,56 @@ def create_nfs(
     folder: Annotated[
         str, typer.Option("--folder", "-f", help="Folder path on the NFS server")
     ] = "/mnt/nfs",
+    profile: NFSProfileOption = None,
 ):
+    from migrator.nfs_mount import create_nfs_localy, create_nfs_remotely
+
     print(f"Creating NFS share on {host_ip} for clients: {client_ips}")
     print(f"Folder: {folder}")
     if host_ip == "127.0.0.1":
-        create_nfs_localy(folder, [client_ips])
+        create_nfs_localy(folder, client_ips, profile=profile)
     else:
-        create_nfs_remotely(host_ip, folder, client_ips)
+        create_nfs_remotely(host_ip, folder, client_ips, profile=profile)
+
+
+@app.command(help="Measure sequential and random 4k throughput and latency on the NFS share")
+def nfs_bench(
+    folder: Annotated[
+        str, typer.Option("--folder", "-f", help="Directory to test (default: nfs_path from config.json)")
+    ] = None,
+    size_mb: Annotated[int, typer.Option("--size-mb", help="Size of the test file in MiB")] = 256,
+    duration: Annotated[float, typer.Option("--duration", help="Seconds per random I/O test")] = 5.0,
+    json_output: Annotated[bool, typer.Option("--json", help="Print the results as JSON")] = False,
+):
+    import json
+    from migrator.nfs_bench import print_nfs_bench, run_nfs_bench
+    from migrator.utils import read_hosts_config
+
+    folder = folder or read_hosts_config().get("nfs_path")
+    if not folder:
+        raise typer.BadParameter("No folder given and no nfs_path in config.json")
+    report = run_nfs_bench(folder, size_mb, duration)
+    if json_output:
+        print(json.dumps(report, indent=4))
+    else:
+        print_nfs_bench(report)
 
 
 @app.command(help="Migrate a VM from a file located in NFS.")
 def migrate_nfs(
     img_name: Annotated[str, typer.Argument(help="Name of the file to run")],
+    non_interactive: Annotated[
+        bool,
+        typer.Option(
+            "--non-interactive",
+            "-n",
+            help="Probe all hosts in parallel using ssh_user from config and MIGRATOR_SSH_PASSWORD",
+        ),
+    ] = False,
 ):
-    run_vm_nfs(img_name)
+    from migrator.vm_runner import run_vm_nfs
+
+    run_vm_nfs(img_name, non_interactive)
 
 
 @app.command(help="Migrate a VM from a file located in another host.")
@@ -77,9 +139,56 @@ def migrate_scp(
         str, typer.Argument(help="IP address of the host from which to migrate a VM.")
     ],
     img_name: Annotated[str, typer.Argument(help="Name of the VM to run")],
+    full_search: Annotated[
+        bool,
+        typer.Option(
+            "--full-search",
+            help="Fall back to searching the whole remote filesystem if the image index has no match",
+        ),
+    ] = False,
+    delta: Annotated[
+        bool,
+        typer.Option(
+            "--delta",
+            help="Only transfer blocks that changed since the last copy in local_vm_path",
+        ),
+    ] = False,
+    precopy: Annotated[
+        bool,
+        typer.Option(
+            "--precopy",
+            help="Copy the image while the VM is running, then shut it down and sync only the dirtied blocks",
+        ),
+    ] = False,
+    streams: Annotated[
+        int,
+        typer.Option(
+            "--streams",
+            "-s",
+            help="Parallel SSH streams for the image copy, 0 picks a count from a throughput probe",
+        ),
+    ] = 1,
+    codec: Annotated[
+        str,
+        typer.Option(
+            "--codec",
+            "-c",
+            help="Compression for the image copy: none, zstd, lz4 or auto",
+        ),
+    ] = "none",
+    lanes: Annotated[
+        int,
+        typer.Option(
+            "--lanes",
+            "-l",
+            help="Disks and NVRAM files copied concurrently, largest first",
+        ),
+    ] = 2,
 ):
+    from migrator.vm_runner import run_vm_scp
+
     try:
-        run_vm_scp(host_ip, img_name)
+        run_vm_scp(host_ip, img_name, full_search, delta, precopy, streams, codec, lanes)
     except Exception as e:
         print(e)
 
@@ -102,25 +211,125 @@ def create_vm(
     ram_size: Annotated[
         int, typer.Option("--ram-size", "-r", help="RAM size in MB")
     ] = 1024,
+    sha256: Annotated[
+        str, typer.Option("--sha256", help="Expected SHA-256 of the downloaded image")
+    ] = None,
+):
+    from migrator.vm_manager import create_vm_on_nfs
+
+    create_vm_on_nfs(vm_name, image_path, img_name, disk_size, ram_size, sha256)
+
+
+@app.command(help="Create a golden qcow2 template from an existing VM disk on NFS")
+def create_template(
+    vm_name: Annotated[str, typer.Argument(help="Name of the (shut off) VM to capture")],
+    template: Annotated[str, typer.Argument(help="Name of the template")],
+    os_variant: Annotated[
+        str, typer.Option("--os-variant", "-o", help="OS variant recorded for VMs created from the template")
+    ] = "generic",
+):
+    from migrator.vm_manager import create_template as create_template_image
+
+    create_template_image(vm_name, template, os_variant)
+
+
+@app.command(help="Create a VM as a thin qcow2 overlay of a template")
+def create_vm_from_template(
+    template: Annotated[str, typer.Argument(help="Name of the template")],
+    vm_name: Annotated[str, typer.Argument(help="Name of the VM")],
+    ram_size: Annotated[
+        int, typer.Option("--ram-size", "-r", help="RAM size in MB")
+    ] = 1024,
+    os_variant: Annotated[
+        str, typer.Option("--os-variant", "-o", help="Override the OS variant stored with the template")
+    ] = None,
 ):
-    create_vm_on_nfs(vm_name, image_path, img_name, disk_size, ram_size)
+    from migrator.vm_manager import create_vm_from_template as create_from_template
+
+    create_from_template(vm_name, template, ram_size, os_variant)
+
+
+@app.command(help="Create a batch of VMs from a template concurrently")
+def create_vms(
+    template: Annotated[str, typer.Argument(help="Name of the template")],
+    vm_names: Annotated[
+        list[str], typer.Argument(help="Names of the VMs. If omitted, --count names are generated from --pattern")
+    ] = None,
+    count: Annotated[int, typer.Option("--count", "-c", help="Number of VMs to create")] = 0,
+    pattern: Annotated[
+        str, typer.Option("--pattern", "-p", help="Name pattern, {n} is replaced by the index (default: <template>-{n})")
+    ] = None,
+    start: Annotated[int, typer.Option("--start", help="First index used with --pattern")] = 1,
+    ram_size: Annotated[
+        int, typer.Option("--ram-size", "-r", help="RAM size in MB")
+    ] = 1024,
+    os_variant: Annotated[
+        str, typer.Option("--os-variant", "-o", help="Override the OS variant stored with the template")
+    ] = None,
+    workers: Annotated[int, typer.Option("--workers", "-w", help="Maximum concurrent provisions")] = 8,
+):
+    from migrator.vm_manager import create_vms_from_template, expand_vm_names
+
+    if not vm_names:
+        if count <= 0:
+            raise typer.BadParameter("Pass VM names or --count")
+        vm_names = expand_vm_names(pattern or f"{template}-{{n}}", count, start)
+    result = create_vms_from_template(vm_names, template, ram_size, os_variant, workers)
+    if result["failed"]:
+        raise typer.Exit(code=1)
 
 
 @app.command(help="Delete VM")
 def delete_vm(
     vm_name: Annotated[str, typer.Argument(help="Name of the VM to delete")],
 ):
+    from migrator.vm_manager import delete_nfs_vm
+
     delete_nfs_vm(vm_name)
 
 
+LiveProfileOption = Annotated[
+    str,
+    typer.Option(
+        "--profile",
+        "-p",
+        help="Migration profile: default, auto-converge, postcopy, multifd, multifd-zstd or xbzrle",
+    ),
+]
+LiveChannelsOption = Annotated[
+    int, typer.Option("--channels", help="Parallel connections for multifd profiles")
+]
+LiveMaxDowntimeOption = Annotated[
+    int, typer.Option("--max-downtime", help="Maximum tolerable downtime in ms")
+]
+LiveBandwidthOption = Annotated[
+    int, typer.Option("--bandwidth", help="Migration bandwidth cap in MiB/s")
+]
+LiveTargetOption = Annotated[
+    str,
+    typer.Option(
+        "--target",
+        "-t",
+        help="Destination host IP, or auto to let the placement engine choose (default: this host)",
+    ),
+]
+
+
 @app.command(help="Migrate lical VM live")
 def migrate_local_live(
     vm_name: Annotated[str, typer.Argument(help="Name of the VM to migrate")],
     host_ip: Annotated[
         str, typer.Argument(help="IP address of the host where vw is currently running")
     ],
+    profile: LiveProfileOption = "default",
+    channels: LiveChannelsOption = 4,
+    max_downtime: LiveMaxDowntimeOption = None,
+    bandwidth: LiveBandwidthOption = None,
+    target: LiveTargetOption = None,
 ):
-    migrate_live_local(vm_name, host_ip)
+    from migrator.vm_runner import migrate_live_local
+
+    migrate_live_local(vm_name, host_ip, profile, channels, max_downtime, bandwidth, target_ip=target)
 
 
 @app.command(help="Migrate lical VM live")
@@ -129,9 +338,245 @@ def migrate_nfs_live(
     host_ip: Annotated[
         str, typer.Argument(help="IP address of the host where vw is currently running")
     ],
-    host_nfs_path: Annotated[str, typer.Argument(help="NFS path on the host")],
+    profile: LiveProfileOption = "default",
+    channels: LiveChannelsOption = 4,
+    max_downtime: LiveMaxDowntimeOption = None,
+    bandwidth: LiveBandwidthOption = None,
+    target: LiveTargetOption = None,
+):
+    from migrator.vm_runner import migrate_live_nfs
+
+    migrate_live_nfs(vm_name, host_ip, profile, channels, max_downtime, bandwidth, target_ip=target)
+
+
+BatchStrategyOption = Annotated[
+    str, typer.Option("--strategy", help="Executor for each VM: nfs-live, local-live or scp")
+]
+PerSourceOption = Annotated[int, typer.Option("--per-source", help="Concurrent migrations out of one host")]
+PerTargetOption = Annotated[int, typer.Option("--per-target", help="Concurrent migrations into one host")]
+PerLinkOption = Annotated[int, typer.Option("--per-link", help="Concurrent migrations between one host pair")]
+RetriesOption = Annotated[int, typer.Option("--retries", help="Retries for transient failures")]
+ReportOption = Annotated[str, typer.Option("--report", help="Write the final report as JSON to this path")]
+PolicyOption = Annotated[
+    str, typer.Option("--policy", help="Placement policy: least-loaded or bin-pack (default from config)")
+]
+
+
+@app.command(help="Migrate every running VM off a host")
+def evacuate(
+    host_ip: Annotated[str, typer.Argument(help="IP address of the host to drain")],
+    strategy: BatchStrategyOption = "nfs-live",
+    profile: LiveProfileOption = "default",
+    target: LiveTargetOption = "auto",
+    policy: PolicyOption = None,
+    per_source: PerSourceOption = 2,
+    per_target: PerTargetOption = 2,
+    per_link: PerLinkOption = 1,
+    retries: RetriesOption = 2,
+    report: ReportOption = None,
+):
+    from migrator.batch import batch_credentials, evacuation_jobs, run_batch
+
+    ssh_user, password = batch_credentials()
+    jobs = evacuation_jobs(host_ip, ssh_user, password, strategy, profile=profile, target=target)
+    results = run_batch(
+        jobs, ssh_user, password, report, policy,
+        per_source=per_source, per_target=per_target, per_link=per_link, retries=retries,
+    )
+    if any(result["status"] != "success" for result in results):
+        raise typer.Exit(code=1)
+
+
+@app.command(help="Run the migrations listed in a JSON plan file")
+def migrate_batch(
+    plan_file: Annotated[
+        str, typer.Argument(help="JSON plan: a list of {vm, source, target, strategy, ...} entries")
+    ],
+    policy: PolicyOption = None,
+    per_source: PerSourceOption = 2,
+    per_target: PerTargetOption = 2,
+    per_link: PerLinkOption = 1,
+    retries: RetriesOption = 2,
+    report: ReportOption = None,
+):
+    from migrator.batch import batch_credentials, load_plan, run_batch
+
+    jobs = load_plan(plan_file)
+    ssh_user, password = batch_credentials()
+    results = run_batch(
+        jobs, ssh_user, password, report, policy,
+        per_source=per_source, per_target=per_target, per_link=per_link, retries=retries,
+    )
+    if any(result["status"] != "success" for result in results):
+        raise typer.Exit(code=1)
+
+
+@app.command(help="Propose, and optionally run, moves that even out memory use across client_ips")
+def rebalance(
+    threshold: Annotated[
+        float, typer.Option("--threshold", help="Largest tolerated memory utilisation gap between hosts (0-1)")
+    ] = 0.15,
+    max_moves: Annotated[int, typer.Option("--max-moves", help="Maximum number of migrations to propose")] = 10,
+    strategy: BatchStrategyOption = "nfs-live",
+    execute: Annotated[bool, typer.Option("--execute", help="Run the proposed moves")] = False,
+    per_source: PerSourceOption = 2,
+    per_target: PerTargetOption = 2,
+    per_link: PerLinkOption = 1,
+    retries: RetriesOption = 2,
+    report: ReportOption = None,
+):
+    from migrator.batch import batch_credentials, run_batch
+    from migrator.placement import host_stats, plan_rebalance, settings
+    from migrator.utils import read_hosts_config
+
+    ssh_user, password = batch_credentials()
+    stats = host_stats(read_hosts_config().get("client_ips", []), ssh_user, password, max_age=0)
+    moves = plan_rebalance(stats, threshold, settings()[1], max_moves)
+    if not moves:
+        print("Hosts are balanced, nothing to move.")
+        return
+    for move in moves:
+        print(f"{move['vm']:<24}{move['source']:<16}-> {move['target']:<16}{move['memory_bytes'] / 1024**3:>8.1f} GiB")
+    if not execute:
+        return
+    jobs = [{"vm": move["vm"], "source": move["source"], "target": move["target"], "strategy": strategy} for move in moves]
+    results = run_batch(
+        jobs, ssh_user, password, report,
+        per_source=per_source, per_target=per_target, per_link=per_link, retries=retries,
+    )
+    if any(result["status"] != "success" for result in results):
+        raise typer.Exit(code=1)
+
+
+@app.command(help="Estimate time and downtime of every strategy for one VM, recommend one and optionally run it")
+def plan(
+    vm_name: Annotated[str, typer.Argument(help="Name of the running VM")],
+    host_ip: Annotated[str, typer.Argument(help="IP address of the host where the VM is running")],
+    target: LiveTargetOption = None,
+    max_downtime: LiveMaxDowntimeOption = 300,
+    link_mbps: Annotated[
+        float, typer.Option("--link-mbps", help="Assume this link speed in Mbit/s instead of measuring it")
+    ] = None,
+    probe: Annotated[bool, typer.Option("--probe/--no-probe", help="Measure throughput to this host")] = True,
+    objective: Annotated[
+        str, typer.Option("--objective", help="What to minimise: downtime (within --max-downtime) or time")
+    ] = "downtime",
+    execute: Annotated[bool, typer.Option("--execute", help="Run the recommended strategy")] = False,
+):
+    from migrator.advisor import execute_plan, plan_migration, print_outcome, print_plan, record_history
+    from migrator.batch import batch_credentials
+
+    ssh_user, password = batch_credentials()
+    result = plan_migration(
+        vm_name, host_ip, ssh_user, password, target, link_mbps, probe, max_downtime / 1000, objective
+    )
+    print_plan(result)
+    if not execute:
+        record_history(result)
+        return
+    if result["recommended"] is None:
+        record_history(result)
+        raise typer.Exit(code=1)
+    try:
+        actual = execute_plan(result, ssh_user, password)
+    except Exception as e:
+        record_history(result, {"status": "failed", "error": str(e)})
+        raise
+    record_history(result, {"status": "success", **actual})
+    print_outcome(result, actual)
+
+
+@app.command(help="Compare recorded plan predictions with the measured migrations")
+def plan_history():
+    from migrator.advisor import load_history, print_history
+
+    print_history(load_history())
+
+
+registry_app = typer.Typer(help="Where every VM runs, as seen by the last sweep and lifecycle events.")
+app.add_typer(registry_app, name="registry")
+
+
+@registry_app.command("sweep", help="List the domains of every client host concurrently and update the registry")
+def registry_sweep():
+    from migrator.batch import batch_credentials
+    from migrator.registry import sweep
+    from migrator.utils import read_hosts_config
+
+    ssh_user, password = batch_credentials()
+    sweep(read_hosts_config().get("client_ips", []), ssh_user, password)
+    registry_show()
+
+
+@registry_app.command("show", help="Print the registered location of one or all VMs")
+def registry_show(
+    vm_name: Annotated[str, typer.Argument(help="Name of the VM (default: all)")] = None,
+):
+    import time
+    from migrator.registry import load_registry
+
+    registry = load_registry()
+    domains = registry["domains"]
+    if vm_name is not None:
+        domains = {vm_name: domains[vm_name]} if vm_name in domains else {}
+    print(f"{'vm':<24}{'host':<16}{'state':<12}{'age s':>8}  disks")
+    for name, entry in sorted(domains.items()):
+        print(
+            f"{name:<24}{entry['host'] or '-':<16}{entry['state'] or '-':<12}"
+            f"{time.time() - entry['seen']:>8.0f}  {', '.join(entry['disks'])}"
+        )
+    print(f"\nregistry version {registry['version']}")
+
+
+@registry_app.command("watch", help="Sweep, then follow lifecycle events from every client host until interrupted")
+def registry_watch():
+    from migrator.batch import batch_credentials
+    from migrator.registry import watch
+    from migrator.utils import read_hosts_config
+
+    ssh_user, password = batch_credentials()
+    try:
+        watch(read_hosts_config().get("client_ips", []), ssh_user, password)
+    except KeyboardInterrupt:
+        pass
+
+
+hosts_app = typer.Typer(help="Reachability of the configured NFS server and client hosts.")
+app.add_typer(hosts_app, name="hosts")
+
+
+@hosts_app.command("status", help="Probe ICMP and the SSH, libvirt and migration ports of every configured host at once")
+def hosts_status(
+    refresh: Annotated[bool, typer.Option("--refresh", help="Ignore cached results and probe again")] = False,
+    timeout: Annotated[float, typer.Option("--timeout", help="Seconds to wait for all probes")] = 1.0,
+):
+    from migrator.health import HEALTH_TTL, check_hosts, print_health
+    from migrator.utils import read_hosts_config
+
+    config = read_hosts_config()
+    hosts = [host for host in [config.get("server_ip")] + config.get("client_ips", []) if host]
+    if not hosts:
+        print("No hosts configured")
+        raise typer.Exit(code=1)
+    print_health(check_hosts(hosts, timeout=timeout, max_age=0 if refresh else HEALTH_TTL))
+
+
+@hosts_app.command("paths", help="List the networks a host can migrate over and the one migrations will use")
+def hosts_paths(
+    host_ip: Annotated[str, typer.Argument(help="Source host")],
+    target: Annotated[str, typer.Option("--target", help="Destination host (default: this host)")] = None,
+    probe: Annotated[bool, typer.Option("--probe", help="Measure throughput over every path (destination must be this host)")] = False,
 ):
-    migrate_live_nfs(vm_name, host_ip, host_nfs_path)
+    from migrator.batch import batch_credentials
+    from migrator.network import measure_paths, print_paths, remember_path
+
+    ssh_user, password = batch_credentials()
+    paths = measure_paths(host_ip, ssh_user, password, target, probe)
+    if not paths:
+        print(f"{host_ip} shares no network with {target or 'this host'}")
+        raise typer.Exit(code=1)
+    print_paths(paths)
+    remember_path(host_ip, target, paths[0], probe)
 
 
 if __name__ == "__main__":
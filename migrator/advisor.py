@@ -0,0 +1,265 @@
+from pathlib import Path
+from migrator import network, placement
+from migrator.batch import domain_costs, execute_job
+from migrator.placement import parse_domstats
+from migrator.ssh_pool import ssh_pool
+from migrator.utils import get_local_ip, read_hosts_config
+import json
+import logging
+import paramiko
+import time
+import uuid
+
+
+HISTORY_PATH = Path.home() / ".cache" / "nfs_migrator" / "plan_history.jsonl"
+DIRTY_SAMPLE_SECONDS = 3
+DEFAULT_BANDWIDTH_MBPS = 1000
+DEFAULT_MAX_DOWNTIME = 0.3  # libvirt's default allowed downtime
+SHUTDOWN_SECONDS = 10
+BOOT_SECONDS = 20
+POSTCOPY_SWITCHOVER = 0.05
+MAX_ITERATIONS = 30
+OBJECTIVES = ("downtime", "time")
+
+CANDIDATES = (
+    ("nfs-live", "default"),
+    ("nfs-live", "auto-converge"),
+    ("nfs-live", "postcopy"),
+    ("local-live", "default"),
+    ("local-live", "auto-converge"),
+    ("local-live", "postcopy"),
+    ("scp", None),
+)
+
+
+def sample_vm(vm_name: str, host_ip: str, ssh_user: str, password: str, seconds: int = None) -> dict:
+    seconds = seconds or DIRTY_SAMPLE_SECONDS
+    calc = ssh_pool.run(
+        host_ip, ssh_user, password, f"virsh -c qemu:///system domdirtyrate-calc {vm_name} --seconds {seconds}", sudo=True
+    )
+    if calc.returncode == 0:
+        # domdirtyrate-calc only starts the measurement; the result shows up in domstats afterwards.
+        time.sleep(seconds + 0.5)
+    else:
+        logging.warning(f"Dirty rate calculation is unavailable on {host_ip}: {calc.stderr.strip()}")
+    command = f"virsh -c qemu:///system domstats {vm_name} --balloon --block"
+    result = ssh_pool.run(host_ip, ssh_user, password, f"{command} --dirtyrate", sudo=True)
+    if result.returncode != 0:
+        result = ssh_pool.run(host_ip, ssh_user, password, command, sudo=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to read domain stats of {vm_name} on {host_ip}: {result.stderr.strip()}")
+    stats = parse_domstats(result.stdout).get(vm_name)
+    if stats is None:
+        raise RuntimeError(f"{vm_name} is not running on {host_ip}")
+    sample = domain_costs(stats)
+    sample["dirty_rate_measured"] = calc.returncode == 0 and stats.get("dirtyrate.calc_status") == "2"
+    return sample
+
+
+def measure_bandwidth(host_ip: str, ssh_user: str, password: str, target_ip: str = None, probe: bool = True) -> dict:
+    try:
+        paths = network.measure_paths(host_ip, ssh_user, password, target_ip, probe)
+    except (RuntimeError, OSError, ValueError, paramiko.SSHException) as e:
+        logging.warning(f"Could not measure the link from {host_ip}: {e}")
+        paths = []
+    if paths:
+        network.remember_path(host_ip, target_ip, paths[0], probe)
+        path = paths[0]
+        if path["measured_mbps"]:
+            return {"mbps": path["measured_mbps"], "method": "probe", "path": path}
+        if path["link_mbps"] > 0:
+            return {"mbps": path["link_mbps"], "method": "link speed", "path": path}
+    return {"mbps": DEFAULT_BANDWIDTH_MBPS, "method": "default", "path": paths[0] if paths else None}
+
+
+def precopy(memory: int, dirty_rate: float, bandwidth: float, max_downtime: float, auto_converge: bool = False):
+    """Iterate pre-copy rounds; returns (seconds, downtime, throttle) or None when it never converges."""
+    remaining = memory
+    elapsed = 0.0
+    throttle = 0.0
+    for iteration in range(MAX_ITERATIONS):
+        round_seconds = remaining / bandwidth
+        if round_seconds <= max_downtime:
+            return elapsed + round_seconds, round_seconds, throttle
+        elapsed += round_seconds
+        dirtied = min(memory, dirty_rate * (1 - throttle) * round_seconds)
+        if auto_converge and iteration > 0 and dirtied >= remaining * 0.5:
+            # QEMU starts throttling the vCPUs at 20% and adds 10% per round that fails to converge.
+            throttle = min(0.99, throttle + 0.1 if throttle else 0.2)
+        remaining = dirtied
+    return None
+
+
+def predict(
+    strategy: str, profile: str | None, sample: dict, bandwidth: float, max_downtime: float = DEFAULT_MAX_DOWNTIME
+) -> dict:
+    memory = sample.get("memory_bytes", 0)
+    dirty_rate = sample.get("dirty_bytes_per_second", 0)
+    disk = sample.get("disk_bytes", 0)
+    prediction = {"strategy": strategy, "profile": profile, "seconds": None, "downtime_seconds": None, "note": ""}
+
+    if strategy == "scp":
+        seconds = SHUTDOWN_SECONDS + disk / bandwidth + BOOT_SECONDS
+        prediction.update(seconds=seconds, downtime_seconds=seconds, note="cold: VM is off for the whole copy")
+        return prediction
+
+    storage_seconds = disk / bandwidth if strategy == "local-live" else 0.0
+    if profile == "postcopy":
+        first_pass = memory / bandwidth
+        dirtied = min(memory, dirty_rate * first_pass)
+        prediction.update(
+            seconds=storage_seconds + first_pass + dirtied / bandwidth,
+            downtime_seconds=POSTCOPY_SWITCHOVER,
+            note=f"guest runs on remote page faults for ~{dirtied / bandwidth:.1f}s; a link failure then loses it",
+        )
+        return prediction
+
+    result = precopy(memory, dirty_rate, bandwidth, max_downtime, auto_converge=profile == "auto-converge")
+    if result is None:
+        prediction["note"] = f"dirty rate outpaces the link, pre-copy does not converge in {MAX_ITERATIONS} rounds"
+        return prediction
+    seconds, downtime, throttle = result
+    prediction.update(seconds=storage_seconds + seconds, downtime_seconds=downtime)
+    if throttle:
+        prediction["note"] = f"converges by throttling the guest vCPUs by {throttle:.0%}"
+    return prediction
+
+
+def _feasible(strategy: str, vm_name: str, target_ip: str | None) -> str | None:
+    if strategy == "nfs-live":
+        nfs_path = read_hosts_config().get("nfs_path")
+        if not nfs_path or not (Path(nfs_path) / f"{vm_name}.img").exists():
+            return "disk is not on the NFS share"
+    if strategy == "scp" and target_ip not in (None, get_local_ip()):
+        return "scp can only migrate to this host"
+    return None
+
+
+def recommend(
+    predictions: list[dict], objective: str = "downtime", max_downtime: float = DEFAULT_MAX_DOWNTIME
+) -> dict | None:
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective '{objective}', expected one of {', '.join(OBJECTIVES)}")
+    usable = [prediction for prediction in predictions if prediction["seconds"] is not None and not prediction.get("blocked")]
+    if not usable:
+        return None
+    if objective == "time":
+        return min(usable, key=lambda prediction: (prediction["seconds"], prediction["downtime_seconds"]))
+    # Post-copy only wins when pre-copy cannot meet the downtime target: it gives up rollback on link failure.
+    safe = [prediction for prediction in usable if prediction["profile"] != "postcopy"]
+    within = [prediction for prediction in safe if prediction["downtime_seconds"] <= max_downtime * 1.01]
+    if within:
+        return min(within, key=lambda prediction: (prediction["seconds"], prediction["downtime_seconds"]))
+    return min(usable, key=lambda prediction: (prediction["downtime_seconds"], prediction["seconds"]))
+
+
+def plan_migration(
+    vm_name: str, host_ip: str, ssh_user: str, password: str, target_ip: str = None,
+    bandwidth_mbps: float = None, probe: bool = True, max_downtime: float = DEFAULT_MAX_DOWNTIME,
+    objective: str = "downtime",
+) -> dict:
+    if target_ip == "auto":
+        target_ip = placement.place_vm(vm_name, host_ip, ssh_user, password)
+    sample = sample_vm(vm_name, host_ip, ssh_user, password)
+    if bandwidth_mbps:
+        bandwidth = {"mbps": bandwidth_mbps, "method": "given", "path": None}
+    else:
+        bandwidth = measure_bandwidth(host_ip, ssh_user, password, target_ip, probe)
+    bytes_per_second = bandwidth["mbps"] * 1e6 / 8
+    predictions = []
+    for strategy, profile in CANDIDATES:
+        prediction = predict(strategy, profile, sample, bytes_per_second, max_downtime)
+        blocked = _feasible(strategy, vm_name, target_ip)
+        if blocked:
+            prediction.update(blocked=True, note=blocked)
+        predictions.append(prediction)
+    return {
+        "id": uuid.uuid4().hex,
+        "time": time.time(),
+        "vm": vm_name,
+        "source": host_ip,
+        "target": target_ip or get_local_ip(),
+        "sample": sample,
+        "bandwidth": bandwidth,
+        "objective": objective,
+        "max_downtime": max_downtime,
+        "predictions": predictions,
+        "recommended": recommend(predictions, objective, max_downtime),
+    }
+
+
+def execute_plan(plan: dict, ssh_user: str, password: str) -> dict:
+    choice = plan["recommended"]
+    job = {"vm": plan["vm"], "source": plan["source"], "target": plan["target"], "strategy": choice["strategy"]}
+    if choice["profile"]:
+        job["profile"] = choice["profile"]
+        job["max_downtime"] = round(plan["max_downtime"] * 1000)
+    return execute_job(job, ssh_user, password)
+
+
+def record_history(plan: dict, actual: dict = None):
+    HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    entry = {**plan, "actual": actual}
+    with open(HISTORY_PATH, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def load_history() -> list[dict]:
+    if not HISTORY_PATH.exists():
+        return []
+    with open(HISTORY_PATH, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _format_seconds(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds:.2f}" if seconds < 10 else f"{seconds:.0f}"
+
+
+def print_plan(plan: dict):
+    sample = plan["sample"]
+    bandwidth = plan["bandwidth"]
+    dirty = f"{sample['dirty_bytes_per_second'] / 1024**2:.1f} MiB/s" + ("" if sample["dirty_rate_measured"] else " (not measured)")
+    print(f"{plan['vm']} on {plan['source']} -> {plan['target']}")
+    print(
+        f"memory {sample['memory_bytes'] / 1024**3:.1f} GiB, disk {sample['disk_bytes'] / 1024**3:.1f} GiB, "
+        f"dirty rate {dirty}, link {bandwidth['mbps']:.0f} Mbit/s ({bandwidth['method']})"
+    )
+    print(f"\n{'strategy':<12}{'profile':<15}{'total s':>10}{'downtime s':>12}  note")
+    for prediction in plan["predictions"]:
+        marker = "*" if prediction == plan["recommended"] else " "
+        print(
+            f"{marker}{prediction['strategy']:<11}{prediction['profile'] or '-':<15}"
+            f"{_format_seconds(prediction['seconds']):>10}{_format_seconds(prediction['downtime_seconds']):>12}  {prediction['note']}"
+        )
+    if plan["recommended"] is None:
+        print("\nNo strategy is expected to complete")
+
+
+def print_outcome(plan: dict, actual: dict):
+    choice = plan["recommended"]
+    print(
+        f"\n{choice['strategy']} ({choice['profile'] or '-'}) took {_format_seconds(actual.get('seconds'))}s "
+        f"with {_format_seconds(actual.get('downtime_seconds'))}s downtime, predicted "
+        f"{_format_seconds(choice['seconds'])}s with {_format_seconds(choice['downtime_seconds'])}s"
+    )
+
+
+def print_history(entries: list[dict]):
+    print(f"{'vm':<20}{'strategy':<12}{'profile':<15}{'pred s':>8}{'actual s':>10}{'pred down':>11}{'actual down':>13}")
+    errors = []
+    for entry in entries:
+        actual = entry.get("actual")
+        choice = entry.get("recommended")
+        if not actual or not choice:
+            continue
+        print(
+            f"{entry['vm']:<20}{choice['strategy']:<12}{choice['profile'] or '-':<15}"
+            f"{_format_seconds(choice['seconds']):>8}{_format_seconds(actual.get('seconds')):>10}"
+            f"{_format_seconds(choice['downtime_seconds']):>11}{_format_seconds(actual.get('downtime_seconds')):>13}"
+        )
+        if actual.get("seconds"):
+            errors.append(abs(choice["seconds"] - actual["seconds"]) / actual["seconds"])
+    if errors:
+        print(f"\nmean total-time error {sum(errors) / len(errors):.0%} over {len(errors)} migration(s)")
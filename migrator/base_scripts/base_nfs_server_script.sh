@@ -8,9 +8,12 @@ sudo chmod 755 $SHARED_DIR
 sudo chown -R 64055:109 $SHARED_DIR
 
 for IP in "${CLIENT_IPS[@]}"; do
-    EXPORT_LINE="$SHARED_DIR $IP(rw,sync,no_subtree_check,no_root_squash)"
+    EXPORT_LINE="$SHARED_DIR $IP($EXPORT_OPTIONS)"
 
     if ! grep -Fxq "$EXPORT_LINE" "$EXPORTS_FILE"; then
+        # Escape the path and address so dots in 10.0.0.1 do not also match 10.0.0.11's line.
+        PATTERN=$(printf '%s' "$SHARED_DIR $IP(" | sed 's/[][\\.*^$|]/\\&/g')
+        sudo sed -i "\\|^$PATTERN|d" "$EXPORTS_FILE"
         echo "$EXPORT_LINE" | sudo tee -a "$EXPORTS_FILE" > /dev/null
     else
         echo "Export for $IP already exists"
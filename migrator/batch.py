@@ -0,0 +1,272 @@
+from concurrent.futures import ThreadPoolExecutor
+from migrator import placement
+from migrator.live_migration import LOCAL_MIGRATE_PORT, NFS_MIGRATE_PORT
+from migrator.placement import parse_domstats
+from migrator.ssh_pool import ssh_pool
+from migrator.tracing import span
+from migrator.utils import get_local_ip, read_hosts_config
+import json
+import logging
+import paramiko
+import threading
+import time
+
+
+STRATEGIES = ("nfs-live", "local-live", "scp")
+COPIES_STORAGE = ("local-live", "scp")
+DIRTY_WINDOW_SECONDS = 10
+RETRY_DELAY = 5.0
+MIGRATE_PORTS = {"nfs-live": NFS_MIGRATE_PORT, "local-live": LOCAL_MIGRATE_PORT}
+
+
+def domain_costs(stats: dict) -> dict:
+    memory = int(stats.get("balloon.current", stats.get("balloon.maximum", 0))) * 1024
+    disk = sum(
+        int(stats.get(f"block.{index}.allocation", 0)) for index in range(int(stats.get("block.count", 0)))
+    )
+    dirty_rate = int(stats.get("dirtyrate.megabytes_per_second", 0)) * 1024 * 1024
+    return {"memory_bytes": memory, "disk_bytes": disk, "dirty_bytes_per_second": dirty_rate}
+
+
+def sample_domains(host_ip: str, ssh_user: str, password: str, running_only: bool = True) -> dict:
+    scope = "--list-running" if running_only else ""
+    command = f"virsh -c qemu:///system domstats {scope} --balloon --block"
+    result = ssh_pool.run(host_ip, ssh_user, password, f"{command} --dirtyrate", sudo=True)
+    if result.returncode != 0:
+        result = ssh_pool.run(host_ip, ssh_user, password, command, sudo=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to read domain stats on {host_ip}: {result.stderr.strip()}")
+    return {name: domain_costs(stats) for name, stats in parse_domstats(result.stdout).items()}
+
+
+def estimate_cost(job: dict) -> int:
+    sample = job.get("sample") or {}
+    cost = sample.get("memory_bytes", 0) + sample.get("dirty_bytes_per_second", 0) * DIRTY_WINDOW_SECONDS
+    if job["strategy"] in COPIES_STORAGE:
+        cost += sample.get("disk_bytes", 0)
+    return cost
+
+
+def load_plan(plan_path: str) -> list[dict]:
+    with open(plan_path, "r") as f:
+        plan = json.load(f)
+    if isinstance(plan, list):
+        plan = {"migrations": plan}
+    defaults = plan.get("defaults", {})
+    jobs = []
+    for entry in plan.get("migrations", []):
+        job = {**defaults, **entry}
+        if "vm" not in job or "source" not in job:
+            raise ValueError(f"Plan entry {entry} needs at least 'vm' and 'source'")
+        job.setdefault("strategy", "nfs-live")
+        if job["strategy"] not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{job['strategy']}' for {job['vm']}, expected one of {', '.join(STRATEGIES)}")
+        jobs.append(job)
+    return jobs
+
+
+def evacuation_jobs(host_ip: str, ssh_user: str, password: str, strategy: str, **options) -> list[dict]:
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {', '.join(STRATEGIES)}")
+    samples = sample_domains(host_ip, ssh_user, password)
+    return [
+        {"vm": vm_name, "source": host_ip, "strategy": strategy, "sample": sample, **options}
+        for vm_name, sample in samples.items()
+    ]
+
+
+def attach_samples(jobs: list[dict], ssh_user: str, password: str):
+    sources = {job["source"] for job in jobs if "sample" not in job}
+    samples = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(sources)))) as executor:
+        futures = {source: executor.submit(sample_domains, source, ssh_user, password) for source in sources}
+        for source, future in futures.items():
+            try:
+                samples[source] = future.result()
+            except (RuntimeError, OSError, paramiko.SSHException) as e:
+                logging.warning(f"Could not sample {source}, ordering its VMs without cost data: {e}")
+                samples[source] = {}
+    for job in jobs:
+        job.setdefault("sample", samples.get(job["source"], {}).get(job["vm"], {}))
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (FileNotFoundError, ValueError)):
+        return False
+    return "authentication failed" not in str(error).lower()
+
+
+def execute_job(job: dict, ssh_user: str, password: str) -> dict:
+    from migrator.vm_runner import migrate_live_local, migrate_live_nfs, run_vm_scp
+
+    live_options = {key: job[key] for key in ("profile", "channels", "max_downtime", "bandwidth") if key in job}
+    live_options.update(target_ip=job["target"], ssh_user=ssh_user, password=password)
+    if job["strategy"] == "nfs-live":
+        summary = migrate_live_nfs(job["vm"], job["source"], **live_options)
+    elif job["strategy"] == "local-live":
+        summary = migrate_live_local(job["vm"], job["source"], **live_options)
+    else:
+        if job["target"] != get_local_ip():
+            raise ValueError(f"The scp strategy can only migrate {job['vm']} to this host")
+        return run_vm_scp(job["source"], f"{job['vm']}.img", ssh_user=ssh_user, password=password)
+    downtime = summary.get("completed_job", {}).get("Total downtime", "").split()
+    return {
+        "seconds": summary.get("seconds"),
+        "downtime_seconds": int(downtime[0]) / 1000 if downtime and downtime[0].isdigit() else None,
+    }
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        per_source: int = 2,
+        per_target: int = 2,
+        per_link: int = 1,
+        max_workers: int = 8,
+        retries: int = 2,
+        retry_delay: float = RETRY_DELAY,
+        execute=execute_job,
+    ):
+        self.limits = {
+            "source": max(1, per_source), "target": max(1, per_target), "link": max(1, per_link), "port": 1,
+        }
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.execute = execute
+        self._cond = threading.Condition()
+        self._running = {"source": {}, "target": {}, "link": {}, "port": {}}
+
+    def _keys(self, job: dict) -> dict:
+        keys = {"source": job["source"], "target": job["target"], "link": (job["source"], job["target"])}
+        if job["strategy"] in MIGRATE_PORTS:
+            # Live migrations into one target share its fixed incoming port.
+            keys["port"] = (job["target"], MIGRATE_PORTS[job["strategy"]])
+        return keys
+
+    def _allowed(self, job: dict) -> bool:
+        return all(
+            self._running[kind].get(key, 0) < self.limits[kind] for kind, key in self._keys(job).items()
+        )
+
+    def _adjust(self, job: dict, delta: int):
+        for kind, key in self._keys(job).items():
+            self._running[kind][key] = self._running[kind].get(key, 0) + delta
+
+    def run(self, jobs: list[dict], ssh_user: str, password: str) -> list[dict]:
+        local_ip = get_local_ip()
+        pending = []
+        for job in jobs:
+            job.setdefault("target", local_ip)
+            job["cost"] = estimate_cost(job)
+            job["attempts"] = 0
+            job["not_before"] = 0.0
+            pending.append(job)
+        pending.sort(key=lambda job: job["cost"])
+        results = []
+        in_flight = 0
+
+        def worker(job: dict):
+            nonlocal in_flight
+            start = time.monotonic()
+            result = {key: job.get(key) for key in ("vm", "source", "target", "strategy")}
+            try:
+                with span("batch_job", vm=job["vm"], attempt=job["attempts"]):
+                    outcome = self.execute(job, ssh_user, password) or {}
+                result.update(status="success", attempts=job["attempts"], **outcome)
+                result.setdefault("seconds", time.monotonic() - start)
+            except Exception as e:
+                retry = is_transient(e) and job["attempts"] <= self.retries
+                logging.warning(
+                    f"Migration of {job['vm']} failed (attempt {job['attempts']}): {e}"
+                    + (", retrying" if retry else "")
+                )
+                if retry:
+                    job["not_before"] = time.monotonic() + self.retry_delay * job["attempts"]
+                    result = None
+                else:
+                    result.update(status="failed", attempts=job["attempts"], error=str(e).strip(),
+                                  seconds=time.monotonic() - start)
+            with self._cond:
+                self._adjust(job, -1)
+                in_flight -= 1
+                if result is None:
+                    pending.append(job)
+                    pending.sort(key=lambda job: job["cost"])
+                else:
+                    results.append(result)
+                self._cond.notify_all()
+
+        with ssh_pool.hold(), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            with self._cond:
+                while pending or in_flight:
+                    now = time.monotonic()
+                    job = next(
+                        (job for job in pending if job["not_before"] <= now and self._allowed(job)), None
+                    )
+                    if job is None or in_flight >= self.max_workers:
+                        self._cond.wait(timeout=0.5)
+                        continue
+                    pending.remove(job)
+                    job["attempts"] += 1
+                    self._adjust(job, 1)
+                    in_flight += 1
+                    executor.submit(worker, job)
+        return results
+
+
+def print_report(results: list[dict], wall_seconds: float):
+    print(f"{'vm':<24}{'source':<16}{'target':<16}{'strategy':<12}{'status':<9}{'tries':>6}{'seconds':>10}{'downtime':>10}")
+    for result in sorted(results, key=lambda result: result["vm"]):
+        downtime = result.get("downtime_seconds")
+        print(
+            f"{result['vm']:<24}{result['source']:<16}{result['target']:<16}{result['strategy']:<12}"
+            f"{result['status']:<9}{result['attempts']:>6}{result['seconds']:>10.2f}"
+            f"{'-' if downtime is None else f'{downtime:.3f}':>10}"
+        )
+    failed = [result for result in results if result["status"] != "success"]
+    print(f"\n{len(results) - len(failed)}/{len(results)} migrated in {wall_seconds:.2f}s")
+    for result in failed:
+        print(f"{result['vm']}: {result['error']}")
+
+
+def batch_credentials():
+    from migrator.vm_runner import load_credentials, prompt_credentials
+
+    try:
+        return load_credentials()
+    except RuntimeError:
+        return prompt_credentials("all hosts in the batch")
+
+
+def run_batch(
+    jobs: list[dict],
+    ssh_user: str,
+    password: str,
+    report_path: str = None,
+    policy: str = None,
+    headroom: float = None,
+    **limits,
+) -> list[dict]:
+    start = time.monotonic()
+    if not jobs:
+        print("Nothing to migrate.")
+        return []
+    attach_samples(jobs, ssh_user, password)
+    for job in jobs:
+        if job["strategy"] == "scp" and job.get("target") == "auto":
+            job["target"] = get_local_ip()
+    if any(job.get("target") == "auto" for job in jobs):
+        default_policy, default_headroom = placement.settings()
+        policy, headroom = policy or default_policy, default_headroom if headroom is None else headroom
+        hosts = read_hosts_config().get("client_ips", [])
+        stats = placement.host_stats(hosts, ssh_user, password)
+        placement.assign_targets(jobs, stats, policy, headroom)
+    results = BatchScheduler(**limits).run(jobs, ssh_user, password)
+    placement.invalidate(list({job["source"] for job in jobs} | {job["target"] for job in jobs}))
+    wall_seconds = time.monotonic() - start
+    print_report(results, wall_seconds)
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump({"seconds": wall_seconds, "migrations": results}, f, indent=4)
+    return results
@@ -0,0 +1,101 @@
+from pathlib import Path
+import copy
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+
+LIST_FIELDS = ("client_ips", "vm_names")
+
+
+def _dedupe(values: list) -> list:
+    return list(dict.fromkeys(values))
+
+
+def _copy(data: dict) -> dict:
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, list) and not any(isinstance(item, (list, dict)) for item in value):
+            value = list(value)
+        elif isinstance(value, (list, dict)):
+            value = copy.deepcopy(value)
+        result[key] = value
+    return result
+
+
+class ConfigStore:
+    def __init__(self, json_path: str):
+        self.json_path = Path(json_path)
+        self.lock_path = self.json_path.with_name(self.json_path.name + ".lock")
+        self._lock = threading.Lock()
+        self._data = None
+        self._signature = None
+
+    def _stat_signature(self):
+        st = os.stat(self.json_path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load(self) -> dict:
+        with open(self.json_path, "r") as f:
+            return json.load(f)
+
+    def read(self) -> dict:
+        signature = self._stat_signature()
+        with self._lock:
+            if self._data is None or signature != self._signature:
+                self._data = self._load()
+                self._signature = signature
+            return _copy(self._data)
+
+    def update(self, fields: dict) -> dict:
+        return self.modify(lambda data: data.update(fields))
+
+    def modify(self, func) -> dict:
+        self.json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                data = {}
+                if self.json_path.exists():
+                    try:
+                        data = self._load()
+                    except json.JSONDecodeError:
+                        print(f"Warning: {self.json_path} is not valid JSON. Overwriting.")
+                func(data)
+                for key in LIST_FIELDS:
+                    if isinstance(data.get(key), list):
+                        data[key] = _dedupe(data[key])
+                self._write(data)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return data
+
+    def _write(self, data: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.json_path.parent, prefix=f".{self.json_path.name}.")
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.json_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._data = _copy(data)
+            self._signature = self._stat_signature()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(json_path: str = "config.json") -> ConfigStore:
+    key = os.path.abspath(json_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ConfigStore(key)
+        return _stores[key]
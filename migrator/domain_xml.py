@@ -0,0 +1,104 @@
+from pathlib import Path
+from migrator.config_store import get_store
+import hashlib
+import time
+import xml.etree.ElementTree as ET
+
+
+HASH_CACHE_PATH = Path.home() / ".cache" / "nfs_migrator" / "domain_hashes.json"
+
+# Attributes libvirt fills in at runtime or generates per host; they differ between
+# a running domain's dumpxml and the persistent definition without being a real change.
+VOLATILE_ATTRIBUTES = {
+    "domain": ("id",),
+    "graphics": ("port", "websocket"),
+    "channel/target": ("state",),
+}
+VOLATILE_ELEMENTS = (
+    (None, "alias"),
+    ("interface", "target"),
+    ("interface", "mac"),
+    ("seclabel", "label"),
+    ("seclabel", "imagelabel"),
+    ("console", "source"),
+    ("serial", "source"),
+)
+
+
+def _strip_volatile(root: ET.Element):
+    for path, attributes in VOLATILE_ATTRIBUTES.items():
+        elements = [root] if path == root.tag else root.iterfind(f".//{path}")
+        for element in elements:
+            if path == "graphics" and element.get("autoport") != "yes":
+                continue
+            for attribute in attributes:
+                element.attrib.pop(attribute, None)
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if (None, child.tag) in VOLATILE_ELEMENTS or (parent.tag, child.tag) in VOLATILE_ELEMENTS:
+                parent.remove(child)
+
+
+def canonical_xml(xml_text: str) -> str:
+    root = ET.fromstring(xml_text)
+    _strip_volatile(root)
+    return ET.canonicalize(ET.tostring(root, encoding="unicode"), strip_text=True)
+
+
+def domain_hash(xml_text: str) -> str:
+    return hashlib.sha256(canonical_xml(xml_text).encode()).hexdigest()
+
+
+def _store():
+    return get_store(str(HASH_CACHE_PATH))
+
+
+def cached_hash(vm_name: str) -> dict | None:
+    store = _store()
+    if not store.json_path.exists():
+        return None
+    return store.read().get(vm_name)
+
+
+def remember_hash(vm_name: str, digest: str, define_seconds: float = None):
+    def update(hashes: dict):
+        entry = hashes.setdefault(vm_name, {})
+        entry["hash"] = digest
+        entry["updated"] = time.time()
+        if define_seconds is not None:
+            entry["define_seconds"] = define_seconds
+
+    _store().modify(update)
+
+
+def forget_hash(vm_name: str):
+    store = _store()
+    if store.json_path.exists():
+        store.modify(lambda hashes: hashes.pop(vm_name, None))
+
+
+def domain_files(xml_text: str) -> list[dict]:
+    root = ET.fromstring(xml_text)
+    files = []
+    for disk in root.iterfind("devices/disk"):
+        source = disk.find("source")
+        if disk.get("type") != "file" or disk.get("device") not in (None, "disk") or source is None:
+            continue
+        if source.get("file"):
+            target = disk.find("target")
+            files.append({"kind": "disk", "path": source.get("file"), "target": target.get("dev") if target is not None else None})
+    nvram = root.find("os/nvram")
+    if nvram is not None and (nvram.text or "").strip():
+        files.append({"kind": "nvram", "path": nvram.text.strip(), "target": "nvram"})
+    return files
+
+
+def rewrite_paths(xml_text: str, mapping: dict) -> str:
+    root = ET.fromstring(xml_text)
+    for source in root.iterfind("devices/disk/source"):
+        if source.get("file") in mapping:
+            source.set("file", str(mapping[source.get("file")]))
+    nvram = root.find("os/nvram")
+    if nvram is not None and (nvram.text or "").strip() in mapping:
+        nvram.text = str(mapping[nvram.text.strip()])
+    return ET.tostring(root, encoding="unicode")
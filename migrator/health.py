@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from migrator.config_store import get_store
+import errno
+import logging
+import os
+import selectors
+import shutil
+import socket
+import struct
+import subprocess
+import time
+
+
+HEALTH_PATH = Path.home() / ".cache" / "nfs_migrator" / "health.json"
+HEALTH_TTL = 15
+PROBE_TIMEOUT = 1.0
+PORTS = {
+    "ssh": 22,
+    "nfs": 2049,
+    "libvirt": 16509,
+    "migrate-nfs": 49152,
+    "migrate-local": 49153,
+}
+# The migrate-* ports only listen while QEMU receives a migration, so an idle host reports them closed.
+DEFAULT_PORTS = ("ssh", "libvirt")
+
+
+def _tcp_probes(selector, targets: list[tuple[str, str]]) -> dict:
+    results = {}
+    for host_ip, name in targets:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        code = sock.connect_ex((host_ip, PORTS[name]))
+        if code in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            selector.register(sock, selectors.EVENT_WRITE, ("tcp", host_ip, name))
+        else:
+            results[(host_ip, name)] = "closed" if code == errno.ECONNREFUSED else "unreachable"
+            sock.close()
+    return results
+
+
+def _icmp_packet(sequence: int) -> bytes:
+    header = struct.pack("!BBHHH", 8, 0, 0, os.getpid() & 0xFFFF, sequence)
+    checksum = 0
+    for index in range(0, len(header), 2):
+        checksum += (header[index] << 8) + header[index + 1]
+    checksum = (checksum >> 16) + (checksum & 0xFFFF)
+    checksum = ~(checksum + (checksum >> 16)) & 0xFFFF
+    return struct.pack("!BBHHH", 8, 0, checksum, os.getpid() & 0xFFFF, sequence)
+
+
+def _icmp_socket(selector, host_ips: list[str]):
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except (PermissionError, OSError):
+        return None
+    sock.setblocking(False)
+    sent = {}
+    for sequence, host_ip in enumerate(host_ips):
+        try:
+            sock.sendto(_icmp_packet(sequence), (host_ip, 0))
+            sent[host_ip] = time.monotonic()
+        except OSError:
+            pass
+    selector.register(sock, selectors.EVENT_READ, ("icmp", sent))
+    return sock
+
+
+def _ping_processes(host_ips: list[str], timeout: float) -> dict:
+    if shutil.which("ping") is None:
+        return {}
+    wait = str(max(1, round(timeout)))
+    return {
+        host_ip: subprocess.Popen(
+            ["ping", "-c", "1", "-W", wait, host_ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for host_ip in host_ips
+    }
+
+
+def _resolve(host: str) -> str | None:
+    try:
+        return socket.gethostbyname(host)
+    except (socket.gaierror, UnicodeError):
+        return None
+
+
+def _probe_addresses(host_ips: list[str], ports, timeout: float) -> dict:
+    selector = selectors.DefaultSelector()
+    results = {
+        host_ip: {"host": host_ip, "icmp": None, "icmp_ms": None, "ports": {}, "checked": time.time()}
+        for host_ip in host_ips
+    }
+    immediate = _tcp_probes(selector, [(host_ip, name) for host_ip in host_ips for name in ports])
+    for (host_ip, name), state in immediate.items():
+        results[host_ip]["ports"][name] = state
+    icmp_sock = _icmp_socket(selector, host_ips)
+    pings = _ping_processes(host_ips, timeout) if icmp_sock is None else {}
+
+    deadline = time.monotonic() + timeout
+    while selector.get_map() and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=max(0.0, deadline - time.monotonic())):
+            kind = key.data[0]
+            if kind == "tcp":
+                _, host_ip, name = key.data
+                code = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[host_ip]["ports"][name] = "open" if code == 0 else (
+                    "closed" if code == errno.ECONNREFUSED else "unreachable"
+                )
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+            else:
+                sent = key.data[1]
+                try:
+                    _, (address, _) = key.fileobj.recvfrom(1024)
+                except OSError:
+                    continue
+                if address in sent and results[address]["icmp"] is None:
+                    results[address]["icmp"] = True
+                    results[address]["icmp_ms"] = round((time.monotonic() - sent[address]) * 1000, 3)
+                if all(results[host_ip]["icmp"] for host_ip in sent):
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+
+    for key in list(selector.get_map().values()):
+        if key.data[0] == "tcp":
+            results[key.data[1]]["ports"][key.data[2]] = "timeout"
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+    selector.close()
+
+    for host_ip, process in pings.items():
+        try:
+            returncode = process.wait(timeout=max(0.0, deadline + 1 - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            returncode = 1
+        results[host_ip]["icmp"] = returncode == 0
+    if icmp_sock is not None:
+        for result in results.values():
+            result["icmp"] = bool(result["icmp"])
+    return results
+
+
+def probe_hosts(host_ips: list[str], ports=DEFAULT_PORTS, timeout: float = PROBE_TIMEOUT) -> dict:
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(host_ips)))) as executor:
+        addresses = dict(zip(host_ips, executor.map(_resolve, host_ips)))
+    probed = _probe_addresses(sorted({address for address in addresses.values() if address}), ports, timeout)
+    results = {}
+    for host, address in addresses.items():
+        if address is None:
+            results[host] = {
+                "host": host, "icmp": False, "icmp_ms": None,
+                "ports": {name: "unreachable" for name in ports}, "checked": time.time(),
+            }
+        else:
+            results[host] = {**probed[address], "host": host, "ports": dict(probed[address]["ports"])}
+    logging.info(f"Probed {len(host_ips)} host(s) in {time.monotonic() - start:.3f}s")
+    return results
+
+
+def _store():
+    return get_store(str(HEALTH_PATH))
+
+
+def check_hosts(
+    host_ips: list[str], ports=DEFAULT_PORTS, timeout: float = PROBE_TIMEOUT, max_age: float = HEALTH_TTL
+) -> dict:
+    store = _store()
+    cached = store.read() if store.json_path.exists() else {}
+    now = time.time()
+    results = {
+        host_ip: cached[host_ip]
+        for host_ip in host_ips
+        if host_ip in cached
+        and now - cached[host_ip]["checked"] < max_age
+        and all(name in cached[host_ip]["ports"] for name in ports)
+    }
+    stale = [host_ip for host_ip in dict.fromkeys(host_ips) if host_ip not in results]
+    if stale:
+        fresh = probe_hosts(stale, ports, timeout)
+        store.update(fresh)
+        results.update(fresh)
+    return results
+
+
+def is_up(status: dict) -> bool:
+    # Without ICMP a refused connection still proves the host answered.
+    if status["icmp"]:
+        return True
+    return any(state in ("open", "closed") for state in status["ports"].values())
+
+
+def host_reachable(host_ip: str, required=("ssh",), timeout: float = PROBE_TIMEOUT) -> bool:
+    status = check_hosts([host_ip], required or ("ssh",), timeout)[host_ip]
+    blocked = [f"{name} ({PORTS[name]}): {status['ports'][name]}" for name in required if status["ports"][name] != "open"]
+    if not required and not is_up(status):
+        blocked.append("no reply to ICMP or TCP")
+    if blocked:
+        print(f"{host_ip} is not reachable: {', '.join(blocked)}")
+        return False
+    return True
+
+
+def print_health(results: dict, ports=DEFAULT_PORTS):
+    print(f"{'host':<16}{'icmp':>10}" + "".join(f"{name:>15}" for name in ports) + f"{'age s':>8}")
+    for host_ip, status in results.items():
+        if status["icmp_ms"] is not None:
+            icmp = f"{status['icmp_ms']:.1f}ms"
+        else:
+            icmp = {True: "up", False: "down", None: "n/a"}[status["icmp"]]
+        print(
+            f"{host_ip:<16}{icmp:>10}"
+            + "".join(f"{status['ports'].get(name, '-'):>15}" for name in ports)
+            + f"{time.time() - status['checked']:>8.0f}"
+        )
@@ -0,0 +1,139 @@
+from pathlib import Path
+from migrator.ssh_pool import ssh_pool
+from migrator.utils import read_hosts_config
+import json
+import logging
+import os
+import shlex
+import tempfile
+import time
+
+
+INDEX_PATH = Path.home() / ".cache" / "nfs_migrator" / "image_index.json"
+INDEX_TTL = 300
+DEFAULT_STORAGE_DIRS = ["/var/lib/libvirt/images"]
+
+DOMAIN_DISKS_COMMAND = (
+    "for d in $(virsh -c qemu:///system list --all --name); do "
+    "virsh -c qemu:///system domblklist \"$d\" --details | "
+    "awk '$2 == \"disk\" && $4 != \"-\" {print $4}'; done"
+)
+
+
+def load_index(index_path: Path = INDEX_PATH) -> dict:
+    try:
+        with open(index_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_index(index: dict, index_path: Path = INDEX_PATH):
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, prefix=f".{index_path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def storage_dirs() -> list[str]:
+    config = read_hosts_config()
+    dirs = [config[key] for key in ("local_vm_path", "nfs_path") if config.get(key)]
+    return list(dict.fromkeys(dirs + DEFAULT_STORAGE_DIRS))
+
+
+def _remote_dir_mtimes(host_ip: str, ssh_user: str, password: str, dirs: list[str]) -> dict:
+    quoted = " ".join(shlex.quote(d) for d in dirs)
+    result = ssh_pool.run(host_ip, ssh_user, password, f"stat -c '%Y %n' {quoted} 2>/dev/null", sudo=True)
+    mtimes = {}
+    for line in result.stdout.splitlines():
+        mtime, _, path = line.partition(" ")
+        if mtime.isdigit():
+            mtimes[path] = int(mtime)
+    return mtimes
+
+
+def _remote_dir_files(host_ip: str, ssh_user: str, password: str, folder: str) -> list[str]:
+    result = ssh_pool.run(
+        host_ip, ssh_user, password,
+        f"find {shlex.quote(folder)} -maxdepth 1 -type f 2>/dev/null", sudo=True
+    )
+    return result.stdout.splitlines()
+
+
+def _remote_domain_disks(host_ip: str, ssh_user: str, password: str) -> list[str]:
+    result = ssh_pool.run(host_ip, ssh_user, password, DOMAIN_DISKS_COMMAND, sudo=False)
+    if result.returncode != 0:
+        logging.warning(f"Failed to list libvirt disks on {host_ip}: {result.stderr.strip()}")
+    return result.stdout.splitlines()
+
+
+def _empty_entry() -> dict:
+    return {"domains": {"built_at": 0, "disks": []}, "dirs": {}, "found": {}}
+
+
+def refresh_host(index: dict, host_ip: str, ssh_user: str, password: str) -> dict:
+    entry = index.setdefault(host_ip, _empty_entry())
+    entry["domains"] = {"built_at": time.time(), "disks": _remote_domain_disks(host_ip, ssh_user, password)}
+
+    dirs = storage_dirs()
+    mtimes = _remote_dir_mtimes(host_ip, ssh_user, password, dirs)
+    for folder in dirs:
+        cached = entry["dirs"].get(folder)
+        if folder not in mtimes:
+            entry["dirs"].pop(folder, None)
+        elif cached is None or cached["mtime"] != mtimes[folder]:
+            logging.info(f"Indexing {folder} on {host_ip}...")
+            entry["dirs"][folder] = {
+                "mtime": mtimes[folder],
+                "files": _remote_dir_files(host_ip, ssh_user, password, folder),
+            }
+    return entry
+
+
+def _candidates(entry: dict, img_name: str) -> list[str]:
+    paths = list(entry["domains"]["disks"])
+    for folder in entry["dirs"].values():
+        paths.extend(folder["files"])
+    if img_name in entry["found"]:
+        paths.append(entry["found"][img_name])
+    return list(dict.fromkeys(path for path in paths if Path(path).name == img_name))
+
+
+def _remote_file_exists(host_ip: str, ssh_user: str, password: str, path: str) -> bool:
+    return ssh_pool.run(host_ip, ssh_user, password, f"test -f {shlex.quote(path)}", sudo=True).returncode == 0
+
+
+def _first_existing(host_ip: str, ssh_user: str, password: str, entry: dict, img_name: str):
+    for path in _candidates(entry, img_name):
+        if _remote_file_exists(host_ip, ssh_user, password, path):
+            return path
+    return None
+
+
+def lookup_image(host_ip: str, img_name: str, ssh_user: str, password: str):
+    index = load_index()
+    entry = index.get(host_ip)
+    if entry is not None and time.time() - entry["domains"]["built_at"] <= INDEX_TTL:
+        path = _first_existing(host_ip, ssh_user, password, entry, img_name)
+        if path is not None:
+            logging.info(f"Found {img_name} on {host_ip} in image index: {path}")
+            return path
+
+    entry = refresh_host(index, host_ip, ssh_user, password)
+    save_index(index)
+    path = _first_existing(host_ip, ssh_user, password, entry, img_name)
+    if path is not None:
+        logging.info(f"Found {img_name} on {host_ip} after refreshing image index: {path}")
+    return path
+
+
+def remember_image(host_ip: str, img_name: str, path: str):
+    index = load_index()
+    entry = index.setdefault(host_ip, _empty_entry())
+    entry["found"][img_name] = path
+    save_index(index)
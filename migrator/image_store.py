@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+from migrator.config_store import get_store
+from migrator.ssh_pool import ssh_pool
+from migrator.tracing import span, traced_run
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import paramiko
+import shlex
+import time
+import urllib.error
+import urllib.request
+
+
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+DEFAULT_STREAMS = 4
+DEFAULT_BUDGET_GB = 50
+REQUEST_TIMEOUT = 30
+ATTACHED_COMMAND = "sh -c " + shlex.quote(
+    "names=$(virsh -c qemu:///system list --all --name) || exit 1; "
+    "for d in $names; do virsh -c qemu:///system domblklist \"$d\" --details || exit 1; done"
+)
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def _probe(url: str) -> tuple[int, bool]:
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            size = int(response.headers.get("Content-Length") or 0)
+            ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return size, ranges and size > 0
+    except (urllib.error.URLError, ValueError):
+        return 0, False
+
+
+def _fetch_range(url: str, path: Path, start: int, end: int) -> bytes:
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        if response.status != 206:
+            raise RuntimeError(f"Server ignored range request for {url}")
+        data = response.read()
+    if len(data) != end - start:
+        raise RuntimeError(f"Short read for {url} range {start}-{end}: got {len(data)} bytes")
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, start)
+    finally:
+        os.close(fd)
+    return data
+
+
+def _load_progress(progress_path: Path, url: str, size: int) -> set:
+    try:
+        with open(progress_path, "r") as f:
+            progress = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+    if progress.get("url") != url or progress.get("size") != size:
+        return set()
+    return set(progress.get("done", []))
+
+
+def _save_progress(progress_path: Path, url: str, size: int, done: set):
+    tmp_path = progress_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"url": url, "size": size, "done": sorted(done)}, f)
+    os.replace(tmp_path, progress_path)
+
+
+def _download_ranges(url: str, partial: Path, size: int, streams: int) -> str:
+    progress_path = partial.with_name(partial.name + ".json")
+    done = _load_progress(progress_path, url, size)
+    if not partial.exists() or partial.stat().st_size != size:
+        done = set()
+        with open(partial, "wb") as f:
+            f.truncate(size)
+    if done:
+        logging.info(f"Resuming {url}: {len(done)} chunk(s) already downloaded")
+
+    offsets = list(range(0, size, CHUNK_SIZE))
+    digest = hashlib.sha256()
+    window = max(1, streams) * 2
+    with ThreadPoolExecutor(max_workers=max(1, streams)) as executor, open(partial, "rb") as existing:
+        pending = {}
+        next_submit = 0
+
+        def submit_until(limit: int):
+            nonlocal next_submit
+            while next_submit < min(limit, len(offsets)):
+                offset = offsets[next_submit]
+                if offset not in done:
+                    pending[offset] = executor.submit(
+                        _fetch_range, url, partial, offset, min(offset + CHUNK_SIZE, size)
+                    )
+                next_submit += 1
+
+        for index, offset in enumerate(offsets):
+            submit_until(index + window)
+            if offset in done:
+                existing.seek(offset)
+                data = existing.read(min(CHUNK_SIZE, size - offset))
+            else:
+                data = pending.pop(offset).result()
+                done.add(offset)
+                _save_progress(progress_path, url, size, done)
+            digest.update(data)
+    progress_path.unlink(missing_ok=True)
+    return digest.hexdigest()
+
+
+def _download_stream(url: str, partial: Path) -> str:
+    digest = hashlib.sha256()
+    with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response, open(partial, "wb") as f:
+        while True:
+            data = response.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            f.write(data)
+    return digest.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _attached_names(output: str) -> set[str]:
+    # Hosts mount the export at different paths, so blobs are matched by their content-addressed name.
+    names = set()
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) >= 4 and fields[3].startswith("/"):
+            names.add(Path(fields[3]).name)
+    return names
+
+
+class ImageStore:
+    def __init__(
+        self, nfs_path: str, budget_gb: float = DEFAULT_BUDGET_GB, hosts: list[str] = None, credentials: tuple = None,
+    ):
+        self.nfs_path = Path(nfs_path)
+        self.hosts = hosts or []
+        self.credentials = credentials
+        self.images_dir = self.nfs_path / "images"
+        self.blobs_dir = self.images_dir / "sha256"
+        self.budget = int(budget_gb * 1024**3)
+        self.store = get_store(str(self.images_dir / "config.json"))
+
+    def _read(self) -> dict:
+        if not self.store.json_path.exists():
+            return {}
+        return self.store.read()
+
+    def _absolute(self, image_path: str) -> Path:
+        return self.nfs_path / image_path.lstrip("/")
+
+    def blob_path(self, sha256: str, url: str) -> Path:
+        suffix = Path(urlparse(url).path).suffix or ".img"
+        return self.blobs_dir / f"{sha256}{suffix}"
+
+    def _find(self, image_name: str, url: str = None, sha256: str = None) -> dict | None:
+        images = self._read()
+        candidates = [images.get(image_name)]
+        if sha256:
+            candidates += [entry for entry in images.values() if entry.get("sha256") == sha256]
+        if url:
+            candidates += [entry for entry in images.values() if entry.get("image_url") == url and entry.get("sha256")]
+        for entry in candidates:
+            if not entry or not self._absolute(entry.get("image_path", "")).exists():
+                continue
+            if sha256 and (entry.get("sha256") or "").lower() != sha256.lower():
+                continue
+            return entry
+        return None
+
+    def lookup(self, image_name: str, sha256: str = None) -> Path | None:
+        entry = self._find(image_name, sha256=sha256)
+        return self._absolute(entry["image_path"]) if entry else None
+
+    def _touch(self, image_name: str, fields: dict = None):
+        def update(images: dict):
+            entry = images.setdefault(image_name, {})
+            entry.update(fields or {})
+            entry["last_used"] = time.time()
+
+        self.store.modify(update)
+
+    def fetch(self, url: str, image_name: str, sha256: str = None, streams: int = DEFAULT_STREAMS) -> Path:
+        entry = self._find(image_name, url, sha256)
+        if entry is not None:
+            self._touch(image_name, {key: value for key, value in entry.items() if key != "last_used"})
+            return self._absolute(entry["image_path"])
+
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        partial = self.blobs_dir / f".partial-{_url_key(url)}"
+        # Fetches of one URL share its partial file; a second fetch waits and then finds the blob.
+        with open(partial.with_name(partial.name + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entry = self._find(image_name, url, sha256)
+                if entry is not None:
+                    self._touch(image_name, {key: value for key, value in entry.items() if key != "last_used"})
+                    return self._absolute(entry["image_path"])
+                blob = self._download(url, image_name, partial, sha256, streams)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.evict(keep=blob)
+        return blob
+
+    def _download(self, url: str, image_name: str, partial: Path, sha256: str, streams: int) -> Path:
+        size, ranges = _probe(url)
+        start = time.monotonic()
+        with span("image_download", url=url) as record:
+            if ranges:
+                digest = _download_ranges(url, partial, size, streams)
+            else:
+                digest = _download_stream(url, partial)
+            size = partial.stat().st_size
+            record["bytes"] = size
+        elapsed = time.monotonic() - start
+        logging.info(f"Downloaded {url}: {size / 1024**2:.1f} MiB in {elapsed:.2f}s")
+
+        if sha256 and digest != sha256.lower():
+            partial.unlink()
+            raise RuntimeError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+        blob = self.blob_path(digest, url)
+        if blob.exists():
+            logging.info(f"{url} has the same content as {blob.name}, keeping one copy")
+            partial.unlink()
+        else:
+            os.replace(partial, blob)
+        self._touch(
+            image_name,
+            {
+                "image_path": "/" + str(blob.relative_to(self.nfs_path)),
+                "image_url": url,
+                "sha256": digest,
+                "size": size,
+            },
+        )
+        return blob
+
+    def _remote_attached(self, host_ip: str) -> set[str]:
+        ssh_user, password = self.credentials
+        result = ssh_pool.run(host_ip, ssh_user, password, ATTACHED_COMMAND, sudo=True, timeout=30)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to list domain disks on {host_ip}: {result.stderr.strip()}")
+        return _attached_names(result.stdout)
+
+    def _attached(self) -> set[str] | None:
+        # The blobs live on the shared export, so a domain on any host can be using one.
+        result = traced_run("virsh", "sudo " + ATTACHED_COMMAND, shell=True, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        names = _attached_names(result.stdout)
+        if not self.hosts:
+            return names
+        if self.credentials is None:
+            from migrator.batch import batch_credentials
+
+            self.credentials = batch_credentials()
+        try:
+            with ThreadPoolExecutor(max_workers=min(16, len(self.hosts))) as executor:
+                for remote in executor.map(self._remote_attached, self.hosts):
+                    names |= remote
+        except (RuntimeError, OSError, paramiko.SSHException) as e:
+            logging.warning(str(e))
+            return None
+        return names
+
+    def evict(self, keep: Path = None) -> list[Path]:
+        blobs = {}
+        for entry in self._read().values():
+            path = self._absolute(entry.get("image_path", ""))
+            if path.parent != self.blobs_dir or not path.exists():
+                continue
+            last_used = max(entry.get("last_used", 0), blobs.get(path, 0))
+            blobs[path] = last_used
+        total = sum(path.stat().st_size for path in blobs)
+        evicted = []
+        if total <= self.budget:
+            return evicted
+        # Removing an ISO still attached to a defined domain breaks its next boot.
+        attached = self._attached()
+        if attached is None:
+            logging.warning("Could not list the disks of defined domains on every host, skipping image cache eviction")
+            return evicted
+        for path, _ in sorted(blobs.items(), key=lambda item: item[1]):
+            if total <= self.budget:
+                break
+            if path == keep or path.name in attached:
+                continue
+            total -= path.stat().st_size
+            path.unlink()
+            evicted.append(path)
+            logging.info(f"Evicted {path.name} from the image cache")
+        if evicted:
+            evicted_paths = {"/" + str(path.relative_to(self.nfs_path)) for path in evicted}
+
+            def forget(images: dict):
+                for name in [name for name, entry in images.items() if entry.get("image_path") in evicted_paths]:
+                    del images[name]
+
+            self.store.modify(forget)
+        return evicted
@@ -0,0 +1,129 @@
+from migrator.ssh_pool import ssh_pool
+from migrator.tracing import traced
+import json
+import logging
+import time
+
+
+PROFILES = {
+    "default": [],
+    "auto-converge": ["--auto-converge"],
+    "postcopy": ["--postcopy", "--postcopy-after-precopy"],
+    "multifd": ["--parallel", "--parallel-connections", "{channels}"],
+    "multifd-zstd": ["--parallel", "--parallel-connections", "{channels}", "--compressed", "--comp-methods", "zstd"],
+    "xbzrle": ["--compressed", "--comp-methods", "xbzrle"],
+}
+
+PROGRESS_FIELDS = {
+    "Memory remaining": "memory_remaining",
+    "Data remaining": "data_remaining",
+    "Dirty rate": "dirty_rate",
+    "Memory bandwidth": "memory_bandwidth",
+    "Expected downtime": "expected_downtime",
+    "Iteration": "iteration",
+}
+
+POLL_INTERVAL = 1.0
+
+# Incoming QEMU ports on the destination; one migration at a time can listen on each.
+NFS_MIGRATE_PORT = 49152
+LOCAL_MIGRATE_PORT = 49153
+
+
+def build_migrate_flags(profile: str, channels: int = 4, bandwidth: int = None) -> list[str]:
+    if profile not in PROFILES:
+        raise RuntimeError(f"Unknown migration profile '{profile}', expected one of: {', '.join(PROFILES)}")
+    flags = [flag.format(channels=channels) for flag in PROFILES[profile]]
+    if bandwidth:
+        flags += ["--bandwidth", str(bandwidth)]
+    return flags
+
+
+def parse_jobinfo(output: str) -> dict:
+    info = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            info[key.strip()] = " ".join(value.split())
+    return info
+
+
+def _drain(channel, errors: list):
+    while channel.recv_stderr_ready():
+        errors.append(channel.recv_stderr(65536))
+    while channel.recv_ready():
+        channel.recv(65536)
+
+
+@traced("migrate")
+def run_live_migration(
+    vm_name: str,
+    host_ip: str,
+    ssh_user: str,
+    password: str,
+    dest_uri: str,
+    migrate_uri: str,
+    base_flags: list[str],
+    profile: str = "default",
+    channels: int = 4,
+    max_downtime: int = None,
+    bandwidth: int = None,
+) -> dict:
+    flags = base_flags + build_migrate_flags(profile, channels, bandwidth)
+    command = " ".join(["virsh", "migrate", *flags, vm_name, dest_uri, "--migrateuri", migrate_uri])
+    summary = {
+        "vm": vm_name,
+        "source": host_ip,
+        "destination": dest_uri,
+        "profile": profile,
+        "flags": flags,
+        "max_downtime_ms": max_downtime,
+        "status": "failed",
+        "samples": [],
+    }
+
+    logging.info(f"Starting live migration of {vm_name} with profile '{profile}'...")
+    start = time.monotonic()
+    try:
+        stdout, stderr = ssh_pool.start(host_ip, ssh_user, password, command, slot=1, sudo=True)
+        channel = stdout.channel
+        downtime_set = max_downtime is None
+        errors = []
+        while not channel.exit_status_ready():
+            time.sleep(POLL_INTERVAL)
+            _drain(channel, errors)
+            jobinfo = parse_jobinfo(
+                ssh_pool.run(host_ip, ssh_user, password, f"virsh domjobinfo {vm_name}", sudo=True, timeout=10).stdout
+            )
+            if jobinfo.get("Job type", "None") == "None":
+                continue
+            if not downtime_set:
+                ssh_pool.run(host_ip, ssh_user, password, f"virsh migrate-setmaxdowntime {vm_name} {max_downtime}", sudo=True)
+                downtime_set = True
+            sample = {"elapsed": round(time.monotonic() - start, 3)}
+            sample.update({name: jobinfo[field] for field, name in PROGRESS_FIELDS.items() if field in jobinfo})
+            summary["samples"].append(sample)
+            logging.info(
+                f"Migration progress: remaining {sample.get('memory_remaining', '?')}, "
+                f"dirty rate {sample.get('dirty_rate', '?')}, "
+                f"transfer rate {sample.get('memory_bandwidth', '?')}, "
+                f"expected downtime {sample.get('expected_downtime', '?')}"
+            )
+
+        errors.append(stderr.read())
+        err = b"".join(errors).decode(errors="replace")
+        stdout.read()
+        returncode = channel.recv_exit_status()
+        summary["seconds"] = round(time.monotonic() - start, 3)
+        summary["completed_job"] = parse_jobinfo(
+            ssh_pool.run(host_ip, ssh_user, password, f"virsh domjobinfo {vm_name} --completed", sudo=True, timeout=10).stdout
+        )
+        if returncode != 0:
+            summary["error"] = err.strip()
+            raise RuntimeError(f"Failed to migrate VM:\n{err}")
+        summary["status"] = "success"
+        logging.info("Machine migrated successfully.")
+        return summary
+    finally:
+        summary.setdefault("seconds", round(time.monotonic() - start, 3))
+        print(json.dumps(summary, indent=4))
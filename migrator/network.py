@@ -0,0 +1,191 @@
+from pathlib import Path
+from migrator.config_store import get_store
+from migrator.ssh_pool import ssh_pool
+from migrator.utils import get_local_ip, local_addresses, parse_ip_addr, read_hosts_config
+import ipaddress
+import logging
+import paramiko
+import socket
+import time
+
+
+PATHS_PATH = Path.home() / ".cache" / "nfs_migrator" / "network_paths.json"
+PATHS_TTL = 600
+PROBE_BYTES = 256 * 1024 * 1024
+PROBE_SECONDS = 5
+
+ADDRESS_COMMAND = (
+    "ip -j addr show up; echo @@; "
+    "for i in /sys/class/net/*; do echo \"${i##*/} $(cat $i/speed 2>/dev/null || echo -1)\"; done"
+)
+
+
+def _link_speed(ifname: str) -> int:
+    try:
+        return int((Path("/sys/class/net") / ifname / "speed").read_text())
+    except (OSError, ValueError):
+        return -1
+
+
+def parse_addresses(output: str) -> list[dict]:
+    addr_output, _, speed_output = output.partition("@@")
+    speeds = {}
+    for line in speed_output.splitlines():
+        name, _, speed = line.strip().partition(" ")
+        if name:
+            speeds[name] = int(speed) if speed.lstrip("-").isdigit() else -1
+    return [{**entry, "speed": speeds.get(entry["ifname"], -1)} for entry in parse_ip_addr(addr_output)]
+
+
+def interfaces(host_ip: str = None, ssh_user: str = None, password: str = None) -> list[dict]:
+    if host_ip is None:
+        return [{**entry, "speed": _link_speed(entry["ifname"])} for entry in local_addresses()]
+    result = ssh_pool.run(host_ip, ssh_user, password, ADDRESS_COMMAND, timeout=15)
+    if result.returncode != 0 and "@@" not in result.stdout:
+        raise RuntimeError(f"Failed to list addresses on {host_ip}: {result.stderr.strip()}")
+    return parse_addresses(result.stdout)
+
+
+def preferred_networks(config: dict = None) -> list[tuple[str, ipaddress.IPv4Network]]:
+    config = read_hosts_config() if config is None else config
+    named = config.get("networks", {})
+    order = config.get("migration_networks", list(named))
+    networks = []
+    for name in order:
+        cidrs = named.get(name, name)
+        for cidr in [cidrs] if isinstance(cidrs, str) else cidrs:
+            try:
+                networks.append((name, ipaddress.ip_network(cidr, strict=False)))
+            except ValueError:
+                raise ValueError(f"Migration network '{name}' is neither a configured network nor a CIDR")
+    return networks
+
+
+def candidate_paths(source: list[dict], destination: list[dict], networks: list) -> list[dict]:
+    paths = []
+    for src in source:
+        src_net = ipaddress.ip_interface(f"{src['address']}/{src['prefixlen']}").network
+        for dst in destination:
+            if ipaddress.ip_address(dst["address"]) not in src_net:
+                continue
+            rank = next(
+                (index for index, (_, net) in enumerate(networks) if ipaddress.ip_address(dst["address"]) in net),
+                len(networks),
+            )
+            paths.append({
+                "source": src["address"],
+                "destination": dst["address"],
+                "network": networks[rank][0] if rank < len(networks) else str(src_net),
+                "rank": rank,
+                "link_mbps": min(src["speed"], dst["speed"]),
+                "measured_mbps": None,
+            })
+    return paths
+
+
+def probe_throughput(
+    source_ip: str, ssh_user: str, password: str, destination_address: str,
+    size: int = PROBE_BYTES, seconds: float = PROBE_SECONDS,
+) -> float | None:
+    # The receiving end runs in this process, so the destination must be a local address.
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind((destination_address, 0))
+        listener.listen(1)
+        listener.settimeout(seconds)
+        port = listener.getsockname()[1]
+        command = (
+            f"timeout {seconds} bash -c "
+            f"'head -c {size} /dev/zero > /dev/tcp/{destination_address}/{port}'"
+        )
+        stdout, _ = ssh_pool.start(source_ip, ssh_user, password, command, slot=3)
+        channel = stdout.channel
+        try:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                return None
+            received = 0
+            start = time.monotonic()
+            with connection:
+                connection.settimeout(seconds)
+                try:
+                    while chunk := connection.recv(1024 * 1024):
+                        received += len(chunk)
+                except socket.timeout:
+                    pass
+            elapsed = time.monotonic() - start
+        finally:
+            # The sender is bounded by its own timeout; wait for it so the next probe gets slot 3 to itself.
+            channel.recv_exit_status()
+            channel.close()
+    return received * 8 / 1e6 / max(elapsed, 1e-9) if received else None
+
+
+def _rank(path: dict) -> tuple:
+    # A measured throughput beats the configured order, which in turn beats the reported link speed.
+    return -(path["measured_mbps"] or 0), path["rank"], -path["link_mbps"]
+
+
+def measure_paths(source_ip: str, ssh_user: str, password: str, target_ip: str = None, probe: bool = False) -> list[dict]:
+    local = target_ip is None or target_ip == get_local_ip()
+    paths = candidate_paths(
+        interfaces(source_ip, ssh_user, password),
+        interfaces() if local else interfaces(target_ip, ssh_user, password),
+        preferred_networks(),
+    )
+    if probe and not local:
+        logging.info("Throughput probing needs this host as the destination, ranking by link speed instead")
+    elif probe:
+        for path in paths:
+            path["measured_mbps"] = probe_throughput(source_ip, ssh_user, password, path["destination"])
+            logging.info(f"{path['source']} -> {path['destination']} ({path['network']}): {path['measured_mbps'] or 0:.0f} Mbit/s")
+    return sorted(paths, key=_rank)
+
+
+def _path_key(source_ip: str, target_ip: str = None) -> str:
+    return f"{source_ip}>{target_ip or 'local'}"
+
+
+def remember_path(source_ip: str, target_ip: str, path: dict | None, probed: bool):
+    get_store(str(PATHS_PATH)).update({_path_key(source_ip, target_ip): {"path": path, "checked": time.time(), "probed": probed}})
+
+
+def choose_path(
+    source_ip: str, ssh_user: str, password: str, target_ip: str = None, probe: bool = None,
+    max_age: float = PATHS_TTL,
+) -> dict | None:
+    probe = read_hosts_config().get("probe_network", False) if probe is None else probe
+    key = _path_key(source_ip, target_ip)
+    store = get_store(str(PATHS_PATH))
+    cached = store.read() if store.json_path.exists() else {}
+    if key in cached and time.time() - cached[key]["checked"] < max_age and (cached[key]["probed"] or not probe):
+        return cached[key]["path"]
+
+    try:
+        paths = measure_paths(source_ip, ssh_user, password, target_ip, probe)
+    except (RuntimeError, OSError, ValueError, paramiko.SSHException) as e:
+        logging.warning(f"Could not list the interfaces of {source_ip} and {target_ip or 'this host'}: {e}")
+        return None
+    path = paths[0] if paths else None
+    remember_path(source_ip, target_ip, path, probe)
+    if path is not None:
+        logging.info(f"Using the {path['network']} network: {path['source']} -> {path['destination']}")
+    return path
+
+
+def print_paths(paths: list[dict]):
+    print(f"{'source':<18}{'destination':<18}{'network':<20}{'link Mbit/s':>12}{'measured':>10}")
+    for path in paths:
+        measured = f"{path['measured_mbps']:.0f}" if path["measured_mbps"] else "-"
+        link = str(path["link_mbps"]) if path["link_mbps"] > 0 else "?"
+        print(f"{path['source']:<18}{path['destination']:<18}{path['network']:<20}{link:>12}{measured:>10}")
+
+
+def migration_address(source_ip: str, ssh_user: str, password: str, target_ip: str = None) -> str:
+    path = choose_path(source_ip, ssh_user, password, target_ip)
+    return path["destination"] if path else (target_ip or get_local_ip())
+
+
+def transfer_address(source_ip: str, ssh_user: str, password: str) -> str:
+    path = choose_path(source_ip, ssh_user, password)
+    return path["source"] if path else source_ip
@@ -0,0 +1,102 @@
+from pathlib import Path
+from migrator.nfs_mount import mount_options
+import errno
+import mmap
+import os
+import random
+import statistics
+import time
+
+
+SEQ_BLOCK = 1024 * 1024
+RANDOM_BLOCK = 4096
+
+
+def _open(path: Path, flags: int) -> tuple[int, bool]:
+    try:
+        return os.open(path, flags | getattr(os, "O_DIRECT", 0)), True
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+    return os.open(path, flags), False
+
+
+def _result(name: str, latencies: list[float], block: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "test": name,
+        "ops": len(latencies),
+        "mib_per_second": len(latencies) * block / 1024**2 / max(seconds, 1e-9),
+        "iops": len(latencies) / max(seconds, 1e-9),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def _sequential(path: Path, size: int, write: bool) -> dict:
+    fd, _ = _open(path, os.O_WRONLY | os.O_CREAT if write else os.O_RDONLY)
+    buffer = mmap.mmap(-1, SEQ_BLOCK)
+    if write:
+        buffer.write(os.urandom(SEQ_BLOCK))
+    latencies = []
+    start = time.perf_counter()
+    try:
+        for offset in range(0, size, SEQ_BLOCK):
+            op_start = time.perf_counter()
+            if write:
+                os.pwrite(fd, buffer, offset)
+            else:
+                os.preadv(fd, [buffer], offset)
+            latencies.append(time.perf_counter() - op_start)
+        if write:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    return _result(f"seq {'write' if write else 'read'} 1M", latencies, SEQ_BLOCK, time.perf_counter() - start)
+
+
+def _random(path: Path, size: int, write: bool, duration: float) -> dict:
+    fd, direct = _open(path, os.O_RDWR if write else os.O_RDONLY)
+    buffer = mmap.mmap(-1, RANDOM_BLOCK)
+    buffer.write(os.urandom(RANDOM_BLOCK))
+    blocks = size // RANDOM_BLOCK
+    latencies = []
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < duration:
+            offset = random.randrange(blocks) * RANDOM_BLOCK
+            op_start = time.perf_counter()
+            if write:
+                os.pwrite(fd, buffer, offset)
+                if not direct:
+                    os.fdatasync(fd)
+            else:
+                os.preadv(fd, [buffer], offset)
+            latencies.append(time.perf_counter() - op_start)
+    finally:
+        os.close(fd)
+    return _result(f"rand {'write' if write else 'read'} 4k", latencies, RANDOM_BLOCK, time.perf_counter() - start)
+
+
+def run_nfs_bench(folder: str, size_mb: int = 256, duration: float = 5.0) -> dict:
+    size = size_mb * 1024 * 1024
+    path = Path(folder) / f".nfs_bench_{os.getpid()}"
+    results = []
+    try:
+        results.append(_sequential(path, size, write=True))
+        results.append(_sequential(path, size, write=False))
+        results.append(_random(path, size, write=True, duration=duration))
+        results.append(_random(path, size, write=False, duration=duration))
+    finally:
+        path.unlink(missing_ok=True)
+    return {"folder": folder, "mount_options": mount_options(folder), "size_mb": size_mb, "results": results}
+
+
+def print_nfs_bench(report: dict):
+    print(f"{report['folder']} ({report['mount_options'] or 'not an NFS mount point'})")
+    print(f"{'test':<16}{'MiB/s':>10}{'IOPS':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in report["results"]:
+        print(
+            f"{result['test']:<16}{result['mib_per_second']:>10.1f}{result['iops']:>10.0f}"
+            f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+        )
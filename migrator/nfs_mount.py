@@ -1,15 +1,18 @@
 from pathlib import Path
-from migrator.utils import save_hosts_config, is_host_available, run_command
-import subprocess
+from migrator.utils import save_hosts_config, run_command
+from migrator.health import host_reachable
+from migrator.nfs_profiles import resolve_profile
 import os
 import pwd
 import grp
-import paramiko
+import tempfile
+from migrator.tracing import span, traced_run
 
 
 def create_nfs_localy(
-    folder: str, client_ips: list[str], export_file: str = "/etc/exports"
+    folder: str, client_ips: list[str], export_file: str = "/etc/exports", profile: str = None
 ):
+    profile, options = resolve_profile(profile)
     username = pwd.getpwuid(os.getuid()).pw_name
     primary_group = grp.getgrgid(os.getgid()).gr_name
     Path(folder).mkdir(parents=True, exist_ok=True)
@@ -18,32 +21,41 @@ def create_nfs_localy(
     run_command(f"sudo chmod 755 {folder}")
     run_command("sudo chown -R 64055:109 {}".format(folder))
 
-    for ip in client_ips:
-        export_line = f"{folder} {ip}(rw,sync,no_subtree_check,no_root_squash)"
+    with open(export_file, "r") as f:
+        exports = f.read().splitlines()
+    wanted = [f"{folder} {ip}({options['export']})" for ip in client_ips]
+    prefixes = tuple(f"{folder} {ip}(" for ip in client_ips)
+    updated = [line for line in exports if not line.startswith(prefixes) or line in wanted]
+    updated += [line for line in wanted if line not in updated]
 
-        with open(export_file, "r") as f:
-            exports = f.read().splitlines()
+    if updated != exports:
+        with tempfile.NamedTemporaryFile("w", suffix=".exports") as staged:
+            staged.write("\n".join(updated) + "\n")
+            staged.flush()
+            run_command(f"sudo tee {export_file} < {staged.name} > /dev/null")
 
-        if export_line not in exports:
-            run_command(f"echo '{export_line}' | sudo tee -a {export_file} > /dev/null")
-
-    run_command("sudo exportfs -ra")
-    save_hosts_config(client_ips=client_ips)
+    with span("exportfs"):
+        run_command("sudo exportfs -ra")
+    save_hosts_config(client_ips=client_ips, nfs_profile=profile)
 
 
 def create_nfs_remotely(
-    host_ip: str, folder: str, client_ips: list[str], export_file: str = "/etc/exports"
+    host_ip: str, folder: str, client_ips: list[str], export_file: str = "/etc/exports", profile: str = None
 ):
+    profile, options = resolve_profile(profile)
     username = input("Enter SSH username: ").strip()
 
     print(f"Copying SSH key to {username}@{host_ip} ...")
-    subprocess.run(
+    traced_run(
+        "ssh_copy_id",
         f"ssh-copy-id -i ~/.ssh/id_rsa.pub {username}@{host_ip}", shell=True, check=True
     )
 
     with open("migrator/base_scripts/base_nfs_server_script.sh", "r") as f:
         script_content = f.read()
 
+    import paramiko
+
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
@@ -55,6 +67,7 @@ def create_nfs_remotely(
         CLIENT_IPS=({" ".join(f'"{ip}"' for ip in client_ips)})
         SHARED_DIR={folder}
         EXPORTS_FILE={export_file}
+        EXPORT_OPTIONS="{options['export']}"
 
         """
     sftp = ssh_client.open_sftp()
@@ -63,23 +76,44 @@ def create_nfs_remotely(
         remote_file.chmod(0o755)
     sftp.close()
 
-    ssh_client.exec_command("sudo bash /tmp/nfs_migrator/nfs_start.sh")
+    with span("exportfs", host=host_ip):
+        _, stdout, _ = ssh_client.exec_command("sudo bash /tmp/nfs_migrator/nfs_start.sh")
+        stdout.channel.recv_exit_status()
     ssh_client.close()
-    save_hosts_config(server_ip=host_ip, client_ips=client_ips)
+    save_hosts_config(server_ip=host_ip, client_ips=client_ips, nfs_profile=profile)
+
+
+def ensure_nfs_client():
+    if run_command("dpkg -s nfs-common", check=False).returncode != 0:
+        run_command("sudo apt install -y nfs-common")
+
+
+def mount_options(mount_point: str) -> str | None:
+    mount_point = os.path.realpath(mount_point)
+    with open("/proc/mounts", "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 4 and fields[1] == mount_point:
+                return fields[3]
+    return None
 
 
-def mount_nfs(host_ip: str, host_folder: str, local_folder: str):
-    if not is_host_available(host_ip):
+def mount_nfs(host_ip: str, host_folder: str, local_folder: str, profile: str = None):
+    profile, options = resolve_profile(profile)
+    if not host_reachable(host_ip, required=("nfs",)):
         raise RuntimeError(f"Host {host_ip} is not reachable")
 
-    run_command("sudo apt install nfs-common")
+    ensure_nfs_client()
     Path(local_folder).mkdir(parents=True, exist_ok=True)
     is_mounted = run_command(f"mountpoint -q {local_folder}", check=False)
     if is_mounted.returncode != 0:
-        run_command(f"sudo mount -t nfs {host_ip}:{host_folder} {local_folder}")
+        mount_flags = f"-o {options['mount']} " if options["mount"] else ""
+        with span("mount", host=host_ip, profile=profile):
+            run_command(f"sudo mount -t nfs {mount_flags}{host_ip}:{host_folder} {local_folder}")
     else:
-        print(f"{local_folder} is already mounted")
-    save_hosts_config(nfs_path=local_folder)
+        print(f"{local_folder} is already mounted with {mount_options(local_folder) or 'unknown options'}")
+        print(f"Unmount it first to apply the '{profile}' profile")
+    save_hosts_config(nfs_path=local_folder, nfs_profile=profile)
 
 
 def unmount_nfs(local_folder: str):
@@ -0,0 +1,37 @@
+from migrator.utils import read_hosts_config
+
+
+# "default" keeps the historical behaviour: sync export, kernel-default mount options.
+PROFILES = {
+    "default": {
+        "export": "rw,sync,no_subtree_check,no_root_squash",
+        "mount": "",
+    },
+    "vm-disks": {
+        "export": "rw,sync,no_subtree_check,no_root_squash",
+        "mount": "vers=4.2,proto=tcp,hard,nconnect=4,rsize=1048576,wsize=1048576,noatime,actimeo=3",
+    },
+    "throughput": {
+        "export": "rw,async,no_subtree_check,no_root_squash",
+        "mount": "vers=4.2,proto=tcp,hard,nconnect=8,rsize=1048576,wsize=1048576,noatime",
+    },
+    "safe": {
+        "export": "rw,sync,no_subtree_check,no_root_squash",
+        "mount": "vers=4.2,proto=tcp,hard,rsize=1048576,wsize=1048576,actimeo=0",
+    },
+}
+
+
+def available_profiles() -> dict:
+    profiles = {name: dict(profile) for name, profile in PROFILES.items()}
+    for name, profile in read_hosts_config().get("nfs_profiles", {}).items():
+        profiles[name] = {**profiles.get(name, PROFILES["default"]), **profile}
+    return profiles
+
+
+def resolve_profile(name: str = None) -> tuple[str, dict]:
+    name = name or read_hosts_config().get("nfs_profile") or "default"
+    profiles = available_profiles()
+    if name not in profiles:
+        raise ValueError(f"Unknown NFS profile '{name}', expected one of {', '.join(profiles)}")
+    return name, profiles[name]
@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from migrator.config_store import get_store
+from migrator.ssh_pool import ssh_pool
+from migrator.utils import read_hosts_config
+import logging
+import paramiko
+import shlex
+import time
+
+
+STATS_PATH = Path.home() / ".cache" / "nfs_migrator" / "host_stats.json"
+STATS_TTL = 30
+DEFAULT_HEADROOM = 0.1
+POLICIES = ("least-loaded", "bin-pack")
+
+# Run as one "sudo sh -c" so every virsh in the chain is privileged; any failure fails the sample.
+SAMPLE_COMMAND = "sh -c " + shlex.quote(
+    "virsh -c qemu:///system nodeinfo && echo @@ && "
+    "virsh -c qemu:///system nodememstats && echo @@ && "
+    "cat /proc/loadavg && echo @@ && "
+    "virsh -c qemu:///system domstats --list-running --balloon"
+)
+
+
+def parse_domstats(output: str) -> dict:
+    domains = {}
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("Domain:"):
+            current = domains.setdefault(line.partition(":")[2].strip().strip("'"), {})
+        elif current is not None and "=" in line:
+            key, _, value = line.partition("=")
+            current[key] = value
+    return domains
+
+
+def _parse_fields(output: str) -> dict:
+    fields = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            fields[key.strip()] = value.split()[0] if value.split() else ""
+    return fields
+
+
+def parse_host_sample(host_ip: str, output: str) -> dict:
+    nodeinfo, memstats, loadavg, domstats = (output.split("@@") + ["", "", "", ""])[:4]
+    nodeinfo = _parse_fields(nodeinfo)
+    memstats = _parse_fields(memstats)
+    memory_total = int(nodeinfo.get("Memory size", memstats.get("total", 0))) * 1024
+    memory_free = sum(int(memstats.get(key, 0)) for key in ("free", "buffers", "cached")) * 1024
+    domains = {
+        name: int(stats.get("balloon.current", stats.get("balloon.maximum", 0))) * 1024
+        for name, stats in parse_domstats(domstats).items()
+    }
+    return {
+        "host": host_ip,
+        "cpus": int(nodeinfo.get("CPU(s)", 1)),
+        "memory_total": memory_total,
+        "memory_free": memory_free,
+        "load": float(loadavg.split()[0]) if loadavg.split() else 0.0,
+        "domains": domains,
+        "sampled": time.time(),
+    }
+
+
+def sample_host(host_ip: str, ssh_user: str, password: str) -> dict:
+    result = ssh_pool.run(host_ip, ssh_user, password, SAMPLE_COMMAND, sudo=True, timeout=15)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to sample {host_ip}: {result.stderr.strip()}")
+    return parse_host_sample(host_ip, result.stdout)
+
+
+def _store():
+    return get_store(str(STATS_PATH))
+
+
+def host_stats(host_ips: list[str], ssh_user: str, password: str, max_age: float = STATS_TTL) -> dict:
+    store = _store()
+    cached = store.read() if store.json_path.exists() else {}
+    now = time.time()
+    stats = {host: cached[host] for host in host_ips if host in cached and now - cached[host]["sampled"] < max_age}
+    stale = [host for host in host_ips if host not in stats]
+    if not stale:
+        return stats
+
+    start = time.monotonic()
+    fresh = {}
+    with ThreadPoolExecutor(max_workers=min(16, len(stale))) as executor:
+        futures = {host: executor.submit(sample_host, host, ssh_user, password) for host in stale}
+        for host, future in futures.items():
+            try:
+                fresh[host] = future.result()
+            except (RuntimeError, OSError, ValueError, paramiko.SSHException) as e:
+                logging.warning(f"Could not sample {host}, leaving it out of placement: {e}")
+    logging.info(f"Sampled {len(stale)} host(s) in {time.monotonic() - start:.3f}s")
+    if fresh:
+        store.update(fresh)
+    stats.update(fresh)
+    return stats
+
+
+def invalidate(host_ips: list[str]):
+    store = _store()
+    if not store.json_path.exists():
+        return
+
+    def drop(stats: dict):
+        for host in host_ips:
+            stats.pop(host, None)
+
+    store.modify(drop)
+
+
+def _fits(host: dict, memory: int, headroom: float) -> bool:
+    return host["memory_free"] - memory >= host["memory_total"] * headroom
+
+
+def _score(host: dict, memory: int, policy: str) -> float:
+    free_after = (host["memory_free"] - memory) / max(host["memory_total"], 1)
+    if policy == "bin-pack":
+        return -free_after
+    return free_after - host["load"] / max(host["cpus"], 1)
+
+
+def choose_target(
+    stats: dict, memory: int, policy: str = "least-loaded", headroom: float = DEFAULT_HEADROOM, exclude=()
+) -> str | None:
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown placement policy '{policy}', expected one of {', '.join(POLICIES)}")
+    candidates = [host for name, host in stats.items() if name not in exclude and _fits(host, memory, headroom)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda host: _score(host, memory, policy))["host"]
+
+
+def reserve(stats: dict, source: str, target: str, vm_name: str, memory: int):
+    if target in stats:
+        stats[target]["memory_free"] -= memory
+        stats[target]["domains"][vm_name] = memory
+    if source in stats and vm_name in stats[source]["domains"]:
+        stats[source]["memory_free"] += stats[source]["domains"].pop(vm_name)
+
+
+def assign_targets(
+    jobs: list[dict], stats: dict, policy: str = "least-loaded", headroom: float = DEFAULT_HEADROOM
+):
+    for job in sorted(jobs, key=lambda job: job.get("sample", {}).get("memory_bytes", 0), reverse=True):
+        if job.get("target") not in (None, "auto"):
+            continue
+        memory = job.get("sample", {}).get("memory_bytes") or stats.get(job["source"], {}).get("domains", {}).get(job["vm"], 0)
+        target = choose_target(stats, memory, policy, headroom, exclude=(job["source"],))
+        if target is None:
+            raise RuntimeError(f"No host has {memory / 1024**3:.1f} GiB free with {headroom:.0%} headroom for {job['vm']}")
+        reserve(stats, job["source"], target, job["vm"], memory)
+        job["target"] = target
+        logging.info(f"Placing {job['vm']} on {target} ({policy})")
+
+
+def settings() -> tuple[str, float]:
+    config = read_hosts_config()
+    return config.get("placement_policy", "least-loaded"), config.get("memory_headroom", DEFAULT_HEADROOM)
+
+
+def place_vm(vm_name: str, source: str, ssh_user: str, password: str) -> str:
+    policy, headroom = settings()
+    hosts = list(dict.fromkeys(read_hosts_config().get("client_ips", []) + [source]))
+    stats = host_stats(hosts, ssh_user, password)
+    memory = stats.get(source, {}).get("domains", {}).get(vm_name, 0)
+    target = choose_target(stats, memory, policy, headroom, exclude=(source,))
+    if target is None:
+        raise RuntimeError(f"No host has {memory / 1024**3:.1f} GiB free with {headroom:.0%} headroom for {vm_name}")
+    logging.info(f"Placing {vm_name} on {target} ({policy})")
+    invalidate([source, target])
+    return target
+
+
+def _utilisation(host: dict) -> float:
+    return 1 - host["memory_free"] / max(host["memory_total"], 1)
+
+
+def plan_rebalance(
+    stats: dict, threshold: float = 0.15, headroom: float = DEFAULT_HEADROOM, max_moves: int = 10
+) -> list[dict]:
+    stats = {name: {**host, "domains": dict(host["domains"])} for name, host in stats.items()}
+    moves = []
+    while len(moves) < max_moves and len(stats) > 1:
+        busiest = max(stats.values(), key=_utilisation)
+        idlest = min(stats.values(), key=_utilisation)
+        gap = _utilisation(busiest) - _utilisation(idlest)
+        if gap <= threshold:
+            break
+        best = None
+        for vm_name, memory in busiest["domains"].items():
+            if not memory or not _fits(idlest, memory, headroom):
+                continue
+            shift = memory / max(busiest["memory_total"], 1) + memory / max(idlest["memory_total"], 1)
+            new_gap = abs(gap - shift)
+            if new_gap < gap and (best is None or new_gap < best[0]):
+                best = (new_gap, vm_name, memory)
+        if best is None:
+            break
+        _, vm_name, memory = best
+        moves.append({"vm": vm_name, "source": busiest["host"], "target": idlest["host"], "memory_bytes": memory})
+        reserve(stats, busiest["host"], idlest["host"], vm_name, memory)
+    return moves
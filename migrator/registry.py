@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from migrator.config_store import get_store
+from migrator.ssh_pool import ssh_pool
+import logging
+import paramiko
+import shlex
+import threading
+import time
+
+
+REGISTRY_PATH = Path.home() / ".cache" / "nfs_migrator" / "vm_registry.json"
+REGISTRY_TTL = 300
+SCHEMA = 1
+
+# One "sudo sh -c" so every virsh runs privileged; a failed listing must not read as "no domains".
+SWEEP_COMMAND = "sh -c " + shlex.quote(
+    "names=$(virsh -c qemu:///system list --all --name) || exit 1; "
+    "for d in $names; do "
+    "echo \"@@ $d|$(virsh -c qemu:///system domstate \"$d\" | head -n 1)\"; "
+    "virsh -c qemu:///system domblklist \"$d\" --details | "
+    "awk '$2 == \"disk\" && $4 != \"-\" {print $4}'; done"
+)
+EVENT_COMMAND = "virsh -c qemu:///system event --all --loop --event lifecycle"
+
+# virsh event prints e.g. "event 'lifecycle' for domain 'vm1': Stopped Shutdown"
+EVENT_STATES = {
+    "Started": "running",
+    "Resumed": "running",
+    "Suspended": "paused",
+    "Stopped": "shut off",
+    "Shutdown": "shut off",
+    "Crashed": "crashed",
+    "Undefined": None,
+}
+
+
+def _empty() -> dict:
+    return {"schema": SCHEMA, "version": 0, "domains": {}}
+
+
+def _store():
+    return get_store(str(REGISTRY_PATH))
+
+
+def load_registry() -> dict:
+    store = _store()
+    if not store.json_path.exists():
+        return _empty()
+    registry = store.read()
+    if registry.get("schema") != SCHEMA:
+        return _empty()
+    return registry
+
+
+def _modify(func):
+    def apply(registry: dict):
+        if registry.get("schema") != SCHEMA:
+            registry.clear()
+            registry.update(_empty())
+        if func(registry) is not False:
+            registry["version"] += 1
+
+    return _store().modify(apply)
+
+
+def _set_host_state(registry: dict, vm_name: str, host_ip: str, state: str | None, disks: list = None):
+    now = time.time()
+    entry = registry["domains"].setdefault(vm_name, {"host": None, "state": None, "disks": [], "hosts": {}})
+    if state is None:
+        entry["hosts"].pop(host_ip, None)
+    else:
+        entry["hosts"][host_ip] = state
+    if disks is not None:
+        entry["disks"] = disks
+    if state == "running":
+        entry["host"] = host_ip
+    elif entry["host"] == host_ip or entry["host"] not in entry["hosts"]:
+        running = [host for host, host_state in entry["hosts"].items() if host_state == "running"]
+        if running:
+            entry["host"] = running[0]
+        elif state is not None:
+            entry["host"] = host_ip
+        else:
+            entry["host"] = next(iter(entry["hosts"]), None)
+    entry["state"] = entry["hosts"].get(entry["host"])
+    entry["seen"] = now
+    entry["version"] = registry["version"] + 1
+    if not entry["hosts"]:
+        del registry["domains"][vm_name]
+
+
+def record(vm_name: str, host_ip: str, state: str | None, disks: list = None):
+    _modify(lambda registry: _set_host_state(registry, vm_name, host_ip, state, disks))
+
+
+def lookup(vm_name: str, max_age: float = REGISTRY_TTL) -> dict | None:
+    entry = load_registry()["domains"].get(vm_name)
+    if entry is None or time.time() - entry.get("seen", 0) > max_age:
+        return None
+    return entry
+
+
+def parse_sweep(output: str) -> dict:
+    domains = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith("@@ "):
+            name, _, state = line[3:].partition("|")
+            current = domains.setdefault(name.strip(), {"state": state.strip(), "disks": []})
+        elif current is not None and line.strip():
+            current["disks"].append(line.strip())
+    return domains
+
+
+def sweep_host(host_ip: str, ssh_user: str, password: str) -> dict:
+    result = ssh_pool.run(host_ip, ssh_user, password, SWEEP_COMMAND, sudo=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to list domains on {host_ip}: {result.stderr.strip()}")
+    return parse_sweep(result.stdout)
+
+
+def sweep(host_ips: list[str], ssh_user: str, password: str, max_workers: int = 16) -> dict:
+    start = time.monotonic()
+    found = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(host_ips)))) as executor:
+        futures = {host_ip: executor.submit(sweep_host, host_ip, ssh_user, password) for host_ip in host_ips}
+        for host_ip, future in futures.items():
+            try:
+                found[host_ip] = future.result()
+            except (RuntimeError, OSError, paramiko.SSHException) as e:
+                logging.warning(f"Could not sweep {host_ip}, keeping its previous registry entries: {e}")
+
+    def apply(registry: dict):
+        for vm_name, entry in list(registry["domains"].items()):
+            for host_ip in found:
+                if host_ip in entry["hosts"] and vm_name not in found[host_ip]:
+                    _set_host_state(registry, vm_name, host_ip, None)
+        for host_ip, domains in found.items():
+            for vm_name, domain in domains.items():
+                _set_host_state(registry, vm_name, host_ip, domain["state"], domain["disks"])
+
+    registry = _modify(apply)
+    logging.info(
+        f"Swept {len(found)}/{len(host_ips)} host(s) in {time.monotonic() - start:.3f}s, "
+        f"{len(registry['domains'])} domain(s) registered (version {registry['version']})"
+    )
+    return registry
+
+
+def parse_event(line: str) -> tuple[str, str | None] | None:
+    if "for domain '" not in line or "':" not in line:
+        return None
+    vm_name = line.split("for domain '", 1)[1].split("'", 1)[0]
+    words = line.rsplit("':", 1)[1].split()
+    if not words or words[0] not in EVENT_STATES:
+        return None
+    return vm_name, EVENT_STATES[words[0]]
+
+
+def _follow_events(host_ip: str, ssh_user: str, password: str, stop: threading.Event):
+    stdout, _ = ssh_pool.start(host_ip, ssh_user, password, EVENT_COMMAND, slot=2, sudo=True)
+    while not stop.is_set():
+        raw = stdout.readline()
+        if not raw:
+            break
+        event = parse_event(raw if isinstance(raw, str) else raw.decode(errors="replace"))
+        if event is not None:
+            vm_name, state = event
+            record(vm_name, host_ip, state)
+            logging.info(f"{vm_name} on {host_ip}: {state or 'undefined'}")
+
+
+def watch(host_ips: list[str], ssh_user: str, password: str, stop: threading.Event = None):
+    stop = stop or threading.Event()
+    sweep(host_ips, ssh_user, password)
+    threads = [
+        threading.Thread(target=_follow_events, args=(host_ip, ssh_user, password, stop), daemon=True)
+        for host_ip in host_ips
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while not stop.is_set() and any(thread.is_alive() for thread in threads):
+            stop.wait(1)
+    finally:
+        stop.set()
@@ -0,0 +1,185 @@
+import contextlib
+import logging
+import subprocess
+import threading
+import time
+import paramiko
+from migrator.tracing import span
+
+
+def connect_client(host_ip: str, user: str, password: str, timeout: float) -> paramiko.SSHClient:
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        hostname=host_ip,
+        username=user,
+        password=password,
+        timeout=timeout,
+        allow_agent=False,
+        look_for_keys=False,
+    )
+    client.get_transport().set_keepalive(30)
+    return client
+
+
+class SSHPool:
+    def __init__(self, connect_timeout: float = 10, client_factory=connect_client):
+        self.connect_timeout = connect_timeout
+        self.client_factory = client_factory
+        self._clients = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._holds = 0
+        self._busy = {}
+        self._retired = set()
+
+    def _host_lock(self, key):
+        with self._lock:
+            return self._host_locks.setdefault(key, threading.Lock())
+
+    def _record(self, host_ip: str, kind: str, seconds: float):
+        with self._lock:
+            host_stats = self._stats.setdefault(
+                host_ip,
+                {
+                    "handshakes": 0,
+                    "handshake_seconds": 0.0,
+                    "commands": 0,
+                    "command_seconds": 0.0,
+                    "transfers": 0,
+                    "transfer_seconds": 0.0,
+                },
+            )
+            host_stats[f"{kind}s"] += 1
+            host_stats[f"{kind}_seconds"] += seconds
+
+    def get_client(self, host_ip: str, user: str, password: str, slot: int = 0) -> paramiko.SSHClient:
+        key = (host_ip, user, slot)
+        with self._host_lock(key):
+            client = self._clients.get(key)
+            transport = client.get_transport() if client is not None else None
+            if transport is not None and transport.is_active():
+                return client
+
+            start = time.monotonic()
+            try:
+                with span("ssh_handshake", host=host_ip):
+                    client = self.client_factory(host_ip, user, password, self.connect_timeout)
+            except paramiko.AuthenticationException as e:
+                raise RuntimeError(f"SSH authentication failed for {user}@{host_ip}: {e}")
+            finally:
+                self._record(host_ip, "handshake", time.monotonic() - start)
+            self._clients[key] = client
+            logging.info(f"Opened SSH session to {user}@{host_ip}")
+            return client
+
+    @contextlib.contextmanager
+    def _lease(self, host_ip: str, user: str, password: str, slot: int = 0):
+        key = (host_ip, user, slot)
+        while True:
+            client = self.get_client(host_ip, user, password, slot)
+            with self._lock:
+                if self._clients.get(key) is client:
+                    self._busy[client] = self._busy.get(client, 0) + 1
+                    break
+        try:
+            yield client
+        finally:
+            retired = False
+            with self._lock:
+                self._busy[client] -= 1
+                if not self._busy[client]:
+                    del self._busy[client]
+                    retired = client in self._retired
+                    self._retired.discard(client)
+            if retired:
+                client.close()
+
+    def run(
+        self,
+        host_ip: str,
+        user: str,
+        password: str,
+        command: str,
+        sudo: bool = False,
+        timeout: float = None,
+    ) -> subprocess.CompletedProcess:
+        if sudo:
+            command = f"sudo -S -p '' {command}"
+        start = time.monotonic()
+        try:
+            with self._lease(host_ip, user, password) as client, span("ssh_exec", host=host_ip, command=command) as record:
+                stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                if sudo:
+                    stdin.write(password + "\n")
+                    stdin.flush()
+                stdin.channel.shutdown_write()
+                out = stdout.read().decode(errors="replace")
+                err = stderr.read().decode(errors="replace")
+                returncode = stdout.channel.recv_exit_status()
+                record["exit_status"] = returncode
+        finally:
+            self._record(host_ip, "command", time.monotonic() - start)
+        return subprocess.CompletedProcess(command, returncode, out, err)
+
+    def start(self, host_ip: str, user: str, password: str, command: str, slot: int = 0, sudo: bool = False):
+        client = self.get_client(host_ip, user, password, slot)
+        if sudo:
+            command = f"sudo -S -p '' {command}"
+        stdin, stdout, stderr = client.exec_command(command)
+        if sudo:
+            stdin.write(password + "\n")
+            stdin.flush()
+        stdin.channel.shutdown_write()
+        return stdout, stderr
+
+    def open_sftp(self, host_ip: str, user: str, password: str) -> paramiko.SFTPClient:
+        return self.get_client(host_ip, user, password).open_sftp()
+
+    def get_file(self, host_ip: str, user: str, password: str, remote_path: str, local_path: str):
+        start = time.monotonic()
+        try:
+            with self.open_sftp(host_ip, user, password) as sftp:
+                sftp.get(remote_path, str(local_path))
+        finally:
+            self._record(host_ip, "transfer", time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: dict(values) for host, values in self._stats.items()}
+
+    def log_timings(self):
+        for host_ip, host_stats in self.stats().items():
+            logging.info(
+                f"SSH timings for {host_ip}: "
+                f"{host_stats['handshakes']} handshake(s) {host_stats['handshake_seconds']:.3f}s, "
+                f"{host_stats['commands']} command(s) {host_stats['command_seconds']:.3f}s, "
+                f"{host_stats['transfers']} transfer(s) {host_stats['transfer_seconds']:.3f}s"
+            )
+
+    @contextlib.contextmanager
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._holds -= 1
+            self.close_all()
+
+    def close_all(self):
+        with self._lock:
+            if self._holds:
+                return
+            clients = list(self._clients.values())
+            self._clients.clear()
+            # A client still running a command is closed by that command once it finishes.
+            self._retired.update(client for client in clients if client in self._busy)
+            clients = [client for client in clients if client not in self._busy]
+        for client in clients:
+            client.close()
+
+
+ssh_pool = SSHPool()
@@ -0,0 +1,152 @@
+from contextlib import contextmanager
+from pathlib import Path
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+
+# Span files are opt-in: --trace-file or MIGRATOR_TRACE_FILE.
+TRACE_ENV = "MIGRATOR_TRACE_FILE"
+
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_settings = {"trace_path": Path(os.environ[TRACE_ENV]) if os.environ.get(TRACE_ENV) else None, "metrics_path": None}
+_trace_file = {"path": None, "handle": None}
+
+
+def configure(trace_path: str = None, metrics_path: str = None):
+    if trace_path is not None:
+        _settings["trace_path"] = Path(trace_path)
+    if metrics_path is not None:
+        _settings["metrics_path"] = Path(metrics_path)
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+
+
+def _write_span(record: dict):
+    trace_path = _settings["trace_path"]
+    if trace_path is None:
+        return
+    line = json.dumps(record) + "\n"
+    with _lock:
+        try:
+            if _trace_file["path"] != trace_path:
+                if _trace_file["handle"] is not None:
+                    _trace_file["handle"].close()
+                trace_path.parent.mkdir(parents=True, exist_ok=True)
+                _trace_file.update(path=trace_path, handle=open(trace_path, "a"))
+            _trace_file["handle"].write(line)
+            _trace_file["handle"].flush()
+        except OSError:
+            pass
+
+
+@contextmanager
+def span(name: str, **attrs):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    record = {
+        "name": name,
+        "parent": stack[-1]["name"] if stack else None,
+        "pid": os.getpid(),
+        "start": time.time(),
+        "status": "ok",
+        "bytes": 0,
+        **attrs,
+    }
+    stack.append(record)
+    start = time.monotonic()
+    try:
+        yield record
+    except BaseException as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        raise
+    finally:
+        record["duration"] = time.monotonic() - start
+        stack.pop()
+        with _lock:
+            _spans.append(record)
+        _write_span(record)
+
+
+def traced(phase: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(phase, function=func.__name__) as record:
+                result = func(*args, **kwargs)
+                if isinstance(result, dict) and "bytes_on_wire" in result:
+                    record["bytes"] = result["bytes_on_wire"]
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def traced_run(phase: str, command, **kwargs) -> subprocess.CompletedProcess:
+    with span(phase, command=command if isinstance(command, str) else " ".join(command)) as record:
+        result = subprocess.run(command, **kwargs)
+        record["exit_status"] = result.returncode
+        if result.returncode != 0:
+            record["status"] = "failed"
+        return result
+
+
+def phase_breakdown() -> dict:
+    breakdown = {}
+    with _lock:
+        spans = list(_spans)
+    for record in spans:
+        phase = breakdown.setdefault(record["name"], {"calls": 0, "seconds": 0.0, "bytes": 0, "errors": 0})
+        phase["calls"] += 1
+        phase["seconds"] += record["duration"]
+        phase["bytes"] += record.get("bytes", 0)
+        if record["status"] != "ok":
+            phase["errors"] += 1
+    return breakdown
+
+
+def print_profile():
+    breakdown = phase_breakdown()
+    if not breakdown:
+        return
+    print(f"\n{'phase':<16}{'calls':>8}{'seconds':>12}{'bytes':>16}{'errors':>8}")
+    for name, phase in sorted(breakdown.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        print(f"{name:<16}{phase['calls']:>8}{phase['seconds']:>12.3f}{phase['bytes']:>16}{phase['errors']:>8}")
+
+
+def write_prometheus(metrics_path: Path = None):
+    metrics_path = metrics_path or _settings["metrics_path"]
+    if metrics_path is None:
+        return
+    lines = [
+        "# HELP migrator_phase_seconds_total Time spent in each migrator phase.",
+        "# TYPE migrator_phase_seconds_total counter",
+    ]
+    breakdown = phase_breakdown()
+    for name, phase in breakdown.items():
+        lines.append(f'migrator_phase_seconds_total{{phase="{name}"}} {phase["seconds"]:.6f}')
+    for metric, key, help_text in (
+        ("migrator_phase_calls_total", "calls", "Number of times each phase ran."),
+        ("migrator_phase_bytes_total", "bytes", "Bytes moved by each phase."),
+        ("migrator_phase_errors_total", "errors", "Failed runs of each phase."),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for name, phase in breakdown.items():
+            lines.append(f'{metric}{{phase="{name}"}} {phase[key]}')
+    metrics_path = Path(metrics_path)
+    metrics_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = metrics_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, metrics_path)
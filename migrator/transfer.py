@@ -0,0 +1,369 @@
+from pathlib import Path
+from migrator.ssh_pool import ssh_pool
+import hashlib
+import json
+import logging
+import os
+import shlex
+import tempfile
+import time
+
+
+CHUNK_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+EXTENTS_SCRIPT = """
+import errno, json, os, sys
+fd = os.open(sys.argv[1], os.O_RDONLY)
+st = os.fstat(fd)
+extents = []
+try:
+    offset = 0
+    while offset < st.st_size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            break
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        extents.append([start, end - start])
+        offset = end
+except (AttributeError, OSError):
+    extents = [[0, st.st_size]]
+print(json.dumps({"size": st.st_size, "mtime": st.st_mtime, "extents": extents}))
+"""
+
+
+SIGNATURE_SCRIPT = """
+import hashlib, json, os, sys
+block_size = int(sys.argv[2])
+hashes = []
+with open(sys.argv[1], "rb", buffering=0) as f:
+    st = os.fstat(f.fileno())
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        hashes.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+print(json.dumps({"size": st.st_size, "mtime": st.st_mtime, "block_size": block_size, "hashes": hashes}))
+"""
+
+
+DIFF_SCRIPT = """
+import hashlib, json, os, sys
+block_size = int(sys.argv[2])
+with open(sys.argv[3]) as f:
+    known = json.load(f)
+os.unlink(sys.argv[3])
+changed = []
+with open(sys.argv[1], "rb", buffering=0) as f:
+    st = os.fstat(f.fileno())
+    index = 0
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        block_hash = hashlib.blake2b(block, digest_size=16).hexdigest()
+        if index >= len(known) or known[index] != block_hash:
+            changed.append([index, block_hash])
+        index += 1
+print(json.dumps({"size": st.st_size, "block_size": block_size, "changed": changed}))
+"""
+
+
+def remote_extent_map(host_ip: str, ssh_user: str, password: str, remote_path: str) -> dict:
+    result = ssh_pool.run(
+        host_ip, ssh_user, password,
+        f"python3 -c {shlex.quote(EXTENTS_SCRIPT)} {shlex.quote(remote_path)}"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to read extent map of {remote_path} on {host_ip}:\n{result.stderr}")
+    return json.loads(result.stdout)
+
+
+def split_extents(extents: list, chunk_size: int = CHUNK_SIZE) -> list[tuple[int, int]]:
+    pieces = []
+    for start, length in extents:
+        end = start + length
+        offset = start
+        while offset < end:
+            piece_end = min(end, (offset // chunk_size + 1) * chunk_size)
+            pieces.append((offset, piece_end - offset))
+            offset = piece_end
+    return pieces
+
+
+def checkpoint_path(local_dest: Path) -> Path:
+    return local_dest.with_name(local_dest.name + ".partial.json")
+
+
+def load_checkpoint(local_dest: Path, source: dict):
+    try:
+        with open(checkpoint_path(local_dest), "r") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if (
+        checkpoint.get("source") != source["path"]
+        or checkpoint.get("size") != source["size"]
+        or checkpoint.get("mtime") != source["mtime"]
+        or checkpoint.get("chunk_size") != CHUNK_SIZE
+    ):
+        return None
+    return set(checkpoint["done"])
+
+
+def _write_json(path: Path, data):
+    # A unique temp name per writer, so concurrent migrations never share one.
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_checkpoint(local_dest: Path, source: dict, done: set):
+    _write_json(
+        checkpoint_path(local_dest),
+        {
+            "source": source["path"],
+            "size": source["size"],
+            "mtime": source["mtime"],
+            "chunk_size": CHUNK_SIZE,
+            "done": sorted(done),
+        },
+    )
+
+
+def transfer_image(host_ip: str, ssh_user: str, password: str, remote_path: str, local_dest: Path) -> dict:
+    local_dest = Path(local_dest)
+    start = time.monotonic()
+    source = remote_extent_map(host_ip, ssh_user, password, remote_path)
+    source["path"] = remote_path
+    pieces = split_extents(source["extents"])
+
+    done = load_checkpoint(local_dest, source)
+    fd = os.open(local_dest, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if done is None:
+            done = set()
+            os.ftruncate(fd, 0)
+        else:
+            logging.info(f"Resuming transfer of {remote_path}: {len(done)}/{len(pieces)} chunk(s) already copied.")
+        os.ftruncate(fd, source["size"])
+
+        bytes_on_wire = 0
+        with ssh_pool.open_sftp(host_ip, ssh_user, password) as sftp:
+            with sftp.open(remote_path, "rb") as remote_file:
+                for offset, length in pieces:
+                    if offset in done:
+                        continue
+                    data = b"".join(remote_file.readv([(offset, length)]))
+                    if len(data) != length:
+                        raise RuntimeError(f"Short read from {remote_path} at offset {offset}")
+                    bytes_on_wire += length
+                    if data.count(0) != length:
+                        os.pwrite(fd, data, offset)
+                    os.fdatasync(fd)
+                    done.add(offset)
+                    save_checkpoint(local_dest, source, done)
+    finally:
+        os.close(fd)
+
+    checkpoint_path(local_dest).unlink(missing_ok=True)
+    elapsed = time.monotonic() - start
+    data_bytes = sum(length for _, length in source["extents"])
+    stats = {
+        "source": remote_path,
+        "destination": str(local_dest),
+        "size": source["size"],
+        "data_bytes": data_bytes,
+        "bytes_on_wire": bytes_on_wire,
+        "seconds": elapsed,
+    }
+    logging.info(
+        f"Copied {remote_path} to {local_dest}: {bytes_on_wire} bytes on the wire "
+        f"({data_bytes} data / {source['size']} apparent) in {elapsed:.2f}s "
+        f"({bytes_on_wire / max(elapsed, 1e-9) / 2**20:.1f} MiB/s)"
+    )
+    return stats
+
+
+def signature_path(local_dest: Path) -> Path:
+    return local_dest.with_name(local_dest.name + ".sig.json")
+
+
+def local_signature(local_dest: Path, block_size: int = BLOCK_SIZE) -> list[str]:
+    hashes = []
+    with open(local_dest, "rb", buffering=0) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            hashes.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+    return hashes
+
+
+def load_signature(local_dest: Path, block_size: int = BLOCK_SIZE) -> list[str]:
+    st = local_dest.stat()
+    try:
+        with open(signature_path(local_dest), "r") as f:
+            signature = json.load(f)
+        if (
+            signature["block_size"] == block_size
+            and signature["size"] == st.st_size
+            and signature["mtime"] == st.st_mtime
+        ):
+            return signature["hashes"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    logging.info(f"Signature for {local_dest} is missing or stale, rehashing local copy...")
+    return local_signature(local_dest, block_size)
+
+
+def save_signature(local_dest: Path, hashes: list[str], block_size: int = BLOCK_SIZE):
+    st = local_dest.stat()
+    _write_json(
+        signature_path(local_dest),
+        {"block_size": block_size, "size": st.st_size, "mtime": st.st_mtime, "hashes": hashes},
+    )
+
+
+def remote_signature(host_ip: str, ssh_user: str, password: str, remote_path: str, block_size: int = BLOCK_SIZE) -> dict:
+    result = ssh_pool.run(
+        host_ip, ssh_user, password,
+        f"python3 -c {shlex.quote(SIGNATURE_SCRIPT)} {shlex.quote(remote_path)} {block_size}"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to compute block signature of {remote_path} on {host_ip}:\n{result.stderr}")
+    return json.loads(result.stdout)
+
+
+def changed_ranges(remote_hashes: list[str], local_hashes: list[str], block_size: int, size: int) -> list[tuple[int, int]]:
+    changed = [
+        index for index, block_hash in enumerate(remote_hashes)
+        if index >= len(local_hashes) or local_hashes[index] != block_hash
+    ]
+    return block_ranges(changed, block_size, size)
+
+
+def block_ranges(indices: list[int], block_size: int, size: int) -> list[tuple[int, int]]:
+    ranges = []
+    for index in indices:
+        offset = index * block_size
+        length = min(block_size, size - offset)
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset and ranges[-1][1] + length <= CHUNK_SIZE:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+def _fetch_ranges(
+    host_ip: str, ssh_user: str, password: str, remote_path: str, local_dest: Path, size: int, ranges: list
+) -> int:
+    bytes_on_wire = 0
+    fd = os.open(local_dest, os.O_RDWR)
+    try:
+        os.ftruncate(fd, size)
+        if ranges:
+            with ssh_pool.open_sftp(host_ip, ssh_user, password) as sftp:
+                with sftp.open(remote_path, "rb") as remote_file:
+                    for offset, length in ranges:
+                        data = b"".join(remote_file.readv([(offset, length)]))
+                        if len(data) != length:
+                            raise RuntimeError(f"Short read from {remote_path} at offset {offset}")
+                        os.pwrite(fd, data, offset)
+                        bytes_on_wire += length
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return bytes_on_wire
+
+
+def delta_sync_image(host_ip: str, ssh_user: str, password: str, remote_path: str, local_dest: Path) -> dict:
+    local_dest = Path(local_dest)
+    if not local_dest.exists():
+        logging.info(f"No local copy of {remote_path} at {local_dest}, doing a full transfer first.")
+        stats = transfer_image(host_ip, ssh_user, password, remote_path, local_dest)
+        save_signature(local_dest, local_signature(local_dest))
+        return stats
+
+    start = time.monotonic()
+    local_hashes = load_signature(local_dest)
+    remote = remote_signature(host_ip, ssh_user, password, remote_path)
+    ranges = changed_ranges(remote["hashes"], local_hashes, remote["block_size"], remote["size"])
+    bytes_on_wire = _fetch_ranges(host_ip, ssh_user, password, remote_path, local_dest, remote["size"], ranges)
+    save_signature(local_dest, remote["hashes"], remote["block_size"])
+
+    elapsed = time.monotonic() - start
+    stats = {
+        "source": remote_path,
+        "destination": str(local_dest),
+        "size": remote["size"],
+        "changed_blocks": -(-sum(length for _, length in ranges) // remote["block_size"]),
+        "bytes_on_wire": bytes_on_wire,
+        "seconds": elapsed,
+    }
+    logging.info(
+        f"Delta-synced {remote_path} to {local_dest}: {bytes_on_wire} of {remote['size']} bytes changed "
+        f"in {len(ranges)} range(s), {elapsed:.2f}s"
+    )
+    return stats
+
+
+def stage_signature(host_ip: str, ssh_user: str, password: str, local_dest: Path, block_size: int = BLOCK_SIZE) -> str:
+    # Hash and upload the local copy ahead of time so final_sync_image only has to diff on the source.
+    local_dest = Path(local_dest)
+    hashes = load_signature(local_dest, block_size)
+    save_signature(local_dest, hashes, block_size)
+    remote_sig = f"/tmp/{local_dest.name}.{os.getpid()}.sig.json"
+    with ssh_pool.open_sftp(host_ip, ssh_user, password) as sftp:
+        with sftp.open(remote_sig, "w") as f:
+            f.write(json.dumps(hashes))
+    return remote_sig
+
+
+def final_sync_image(
+    host_ip: str, ssh_user: str, password: str, remote_path: str, local_dest: Path, remote_sig: str,
+    block_size: int = BLOCK_SIZE,
+) -> dict:
+    local_dest = Path(local_dest)
+    start = time.monotonic()
+    # Read the staged hashes before writing, which would leave the saved signature stale.
+    hashes = load_signature(local_dest, block_size)
+    result = ssh_pool.run(
+        host_ip, ssh_user, password,
+        f"python3 -c {shlex.quote(DIFF_SCRIPT)} {shlex.quote(remote_path)} {block_size} {shlex.quote(remote_sig)}"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to diff {remote_path} on {host_ip} against the staged signature:\n{result.stderr}")
+    remote = json.loads(result.stdout)
+    changed = dict(remote["changed"])
+    ranges = block_ranges(sorted(changed), block_size, remote["size"])
+    bytes_on_wire = _fetch_ranges(host_ip, ssh_user, password, remote_path, local_dest, remote["size"], ranges)
+
+    blocks = -(-remote["size"] // block_size)
+    hashes = hashes[:blocks] + [None] * (blocks - len(hashes))
+    for index, block_hash in changed.items():
+        hashes[index] = block_hash
+    save_signature(local_dest, hashes, block_size)
+
+    elapsed = time.monotonic() - start
+    stats = {
+        "source": remote_path,
+        "destination": str(local_dest),
+        "size": remote["size"],
+        "changed_blocks": len(changed),
+        "bytes_on_wire": bytes_on_wire,
+        "seconds": elapsed,
+    }
+    logging.info(
+        f"Final pass for {remote_path}: {len(changed)} changed block(s), {bytes_on_wire} bytes "
+        f"in {len(ranges)} range(s), {elapsed:.2f}s"
+    )
+    return stats
@@ -0,0 +1,243 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from migrator.ssh_pool import ssh_pool
+from migrator.transfer import EXTENTS_SCRIPT, split_extents
+import hashlib
+import json
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+READ_SIZE = 1024 * 1024
+MIN_RANGE_SIZE = 64 * 1024 * 1024
+PROBE_SIZE = 16 * 1024 * 1024
+STREAM_COUNTS = [1, 2, 4, 8, 16]
+
+
+class _Identity:
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _Lz4Decompressor:
+    def __init__(self):
+        self._decompressor = lz4.frame.LZ4FrameDecompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = {
+    "none": {"binary": None, "command": "cat", "decompressor": _Identity, "available": True},
+    "zstd": {"binary": "zstd", "command": "zstd -1 -T1 -q -c", "decompressor": _zstd_decompressor, "available": zstandard is not None},
+    "lz4": {"binary": "lz4", "command": "lz4 -1 -q -c", "decompressor": _Lz4Decompressor, "available": lz4 is not None},
+}
+
+
+class SSHShell:
+    def __init__(self, host_ip: str, ssh_user: str, password: str):
+        self.host_ip = host_ip
+        self.ssh_user = ssh_user
+        self.password = password
+
+    def run(self, command: str) -> subprocess.CompletedProcess:
+        return ssh_pool.run(self.host_ip, self.ssh_user, self.password, command)
+
+    def stream(self, command: str, slot: int):
+        stdout, stderr = ssh_pool.start(self.host_ip, self.ssh_user, self.password, command, slot=slot)
+
+        def finish():
+            err = stderr.read().decode(errors="replace")
+            return stdout.channel.recv_exit_status(), err
+
+        return stdout, finish
+
+
+class LocalShell:
+    def run(self, command: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["bash", "-c", command], capture_output=True, text=True)
+
+    def stream(self, command: str, slot: int):
+        process = subprocess.Popen(["bash", "-c", command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def finish():
+            err = process.stderr.read().decode(errors="replace")
+            return process.wait(), err
+
+        return process.stdout, finish
+
+
+def available_codecs(shell) -> list[str]:
+    codecs = ["none"]
+    for name, codec in CODECS.items():
+        if codec["binary"] and codec["available"]:
+            if shell.run(f"command -v {codec['binary']}").returncode == 0:
+                codecs.append(name)
+    return codecs
+
+
+def _range_command(remote_path: str, offset: int, length: int, codec: str) -> str:
+    # sha256sum reads a fifo as an explicit background job so the shell can wait for its checksum.
+    pipeline = (
+        f"set -o pipefail; dir=$(mktemp -d) || exit 1; trap 'rm -rf \"$dir\"' EXIT; "
+        f"mkfifo \"$dir/sum\" || exit 1; sha256sum < \"$dir/sum\" >&2 & sum=$!; "
+        f"dd if={shlex.quote(remote_path)} bs=1M iflag=skip_bytes,count_bytes skip={offset} count={length} status=none "
+        f"| tee \"$dir/sum\" | {CODECS[codec]['command']}; status=$?; wait $sum || status=1; exit $status"
+    )
+    return f"bash -c {shlex.quote(pipeline)}"
+
+
+def _receive_range(shell, remote_path: str, offset: int, length: int, codec: str, slot: int, fd: int = None) -> int:
+    stdout, finish = shell.stream(_range_command(remote_path, offset, length, codec), slot)
+    decompressor = CODECS[codec]["decompressor"]()
+    digest = hashlib.sha256()
+    wire_bytes = 0
+    position = offset
+
+    def write(data: bytes):
+        nonlocal position
+        if not data:
+            return
+        digest.update(data)
+        if fd is not None and data.count(0) != len(data):
+            os.pwrite(fd, data, position)
+        position += len(data)
+
+    while True:
+        compressed = stdout.read(READ_SIZE)
+        if not compressed:
+            break
+        wire_bytes += len(compressed)
+        write(decompressor.decompress(compressed))
+    write(decompressor.flush())
+
+    returncode, err = finish()
+    if returncode != 0:
+        raise RuntimeError(f"Range {offset}+{length} of {remote_path} failed:\n{err}")
+    if position - offset != length:
+        raise RuntimeError(f"Range {offset}+{length} of {remote_path} returned {position - offset} bytes")
+    remote_digest = err.split()[0] if err.split() else ""
+    if remote_digest != digest.hexdigest():
+        raise RuntimeError(f"Checksum mismatch for range {offset}+{length} of {remote_path}")
+    return wire_bytes
+
+
+def _probe_rate(shell, remote_path: str, sample: tuple[int, int], codec: str, streams: int) -> float:
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+        futures = [
+            executor.submit(_receive_range, shell, remote_path, sample[0], sample[1], codec, slot)
+            for slot in range(streams)
+        ]
+        for future in futures:
+            future.result()
+    return streams * sample[1] / max(time.monotonic() - start, 1e-9)
+
+
+def choose_settings(shell, remote_path: str, extents: list, max_streams: int, codec: str = "auto", streams: int = 0):
+    data_bytes = sum(length for _, length in extents)
+    if not extents or data_bytes < 2 * PROBE_SIZE:
+        return ("none" if codec == "auto" else codec), max(streams, 1)
+    sample = (extents[0][0], min(PROBE_SIZE, extents[0][1]))
+
+    if codec == "auto":
+        rates = {name: _probe_rate(shell, remote_path, sample, name, 1) for name in available_codecs(shell)}
+        codec = max(rates, key=rates.get)
+        logging.info("Codec probe: " + ", ".join(f"{name} {rate / 2**20:.1f} MiB/s" for name, rate in rates.items()))
+
+    if streams <= 0:
+        streams, best_rate = 1, _probe_rate(shell, remote_path, sample, codec, 1)
+        for count in STREAM_COUNTS[1:]:
+            if count > max_streams:
+                break
+            rate = _probe_rate(shell, remote_path, sample, codec, count)
+            logging.info(f"Stream probe: {count} stream(s) {rate / 2**20:.1f} MiB/s")
+            if rate < best_rate * 1.1:
+                break
+            streams, best_rate = count, rate
+    logging.info(f"Using codec '{codec}' with {streams} stream(s)")
+    return codec, streams
+
+
+def parallel_transfer(
+    shell, remote_path: str, local_dest: Path, streams: int = 0, codec: str = "auto", max_streams: int = 8
+) -> dict:
+    local_dest = Path(local_dest)
+    if codec != "auto" and codec not in CODECS:
+        raise RuntimeError(f"Unknown codec '{codec}', expected one of: auto, {', '.join(CODECS)}")
+    if codec != "auto" and not CODECS[codec]["available"]:
+        raise RuntimeError(f"Codec '{codec}' needs the {codec} Python package installed locally")
+
+    start = time.monotonic()
+    result = shell.run(f"python3 -c {shlex.quote(EXTENTS_SCRIPT)} {shlex.quote(remote_path)}")
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to read extent map of {remote_path}:\n{result.stderr}")
+    source = json.loads(result.stdout)
+    codec, streams = choose_settings(shell, remote_path, source["extents"], max_streams, codec, streams)
+
+    data_bytes = sum(length for _, length in source["extents"])
+    range_size = max(MIN_RANGE_SIZE, -(-data_bytes // (streams * 4)))
+    ranges = queue.Queue()
+    for piece in split_extents(source["extents"], range_size):
+        ranges.put(piece)
+
+    fd = os.open(local_dest, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, source["size"])
+
+        def worker(slot: int) -> int:
+            wire_bytes = 0
+            while True:
+                try:
+                    offset, length = ranges.get_nowait()
+                except queue.Empty:
+                    return wire_bytes
+                wire_bytes += _receive_range(shell, remote_path, offset, length, codec, slot, fd)
+
+        with ThreadPoolExecutor(max_workers=streams) as executor:
+            bytes_on_wire = sum(executor.map(worker, range(streams)))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    elapsed = time.monotonic() - start
+    stats = {
+        "source": remote_path,
+        "destination": str(local_dest),
+        "size": source["size"],
+        "data_bytes": data_bytes,
+        "bytes_on_wire": bytes_on_wire,
+        "codec": codec,
+        "streams": streams,
+        "seconds": elapsed,
+    }
+    logging.info(
+        f"Copied {remote_path} to {local_dest} over {streams} stream(s) with codec '{codec}': "
+        f"{bytes_on_wire} bytes on the wire for {data_bytes} data bytes in {elapsed:.2f}s "
+        f"({data_bytes / max(elapsed, 1e-9) / 2**20:.1f} MiB/s effective)"
+    )
+    return stats
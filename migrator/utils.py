@@ -1,8 +1,8 @@
-import json
-from pathlib import Path
 from typing import List
-import socket
-import subprocess
+from functools import lru_cache
+import json
+from migrator.config_store import get_store
+from migrator.tracing import traced_run
 
 
 def save_hosts_config(
@@ -13,38 +13,37 @@ def save_hosts_config(
     xml_folder: str = "",
     json_path: str = "config.json",
     vm_names: List[str] = [],
+    ssh_user: str = "",
+    nfs_profile: str = "",
 ):
-    data = {}
-
-    if Path(json_path).exists():
-        with open(json_path, "r") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: {json_path} is not valid JSON. Overwriting.")
-
-    if server_ip:
-        data["server_ip"] = server_ip
-    if client_ips:
-        data["client_ips"] = client_ips
-    if nfs_path:
-        data["nfs_path"] = nfs_path
-    if local_vm_path:
-        data["local_vm_path"] = local_vm_path
-    if xml_folder:
-        data["xml_folder"] = xml_folder
-    if vm_names:
-        data["vm_names"] = vm_names
-
-    with open(json_path, "w") as f:
-        json.dump(data, f, indent=4)
+    fields = {
+        "server_ip": server_ip,
+        "client_ips": client_ips,
+        "nfs_path": nfs_path,
+        "local_vm_path": local_vm_path,
+        "xml_folder": xml_folder,
+        "vm_names": vm_names,
+        "ssh_user": ssh_user,
+        "nfs_profile": nfs_profile,
+    }
+    get_store(json_path).update({key: value for key, value in fields.items() if value})
     print(f"Saved host configuration to {json_path}")
 
 
+def add_vm_names(vm_names: List[str], json_path: str = "config.json"):
+    get_store(json_path).modify(lambda data: data.setdefault("vm_names", []).extend(vm_names))
+
+
+def remove_vm_names(vm_names: List[str], json_path: str = "config.json"):
+    def remove(data):
+        data["vm_names"] = [name for name in data.get("vm_names", []) if name not in vm_names]
+
+    get_store(json_path).modify(remove)
+
+
 def read_hosts_config(json_path="config.json"):
     try:
-        with open(json_path, "r") as f:
-            data = json.load(f)
+        data = get_store(json_path).read()
         result = {}
         expected_keys = [
             "server_ip",
@@ -53,6 +52,17 @@ def read_hosts_config(json_path="config.json"):
             "local_vm_path",
             "xml_folder",
             "vm_names",
+            "ssh_user",
+            "shutdown_timeout",
+            "shutdown_escalate",
+            "image_cache_gb",
+            "placement_policy",
+            "memory_headroom",
+            "nfs_profile",
+            "nfs_profiles",
+            "networks",
+            "migration_networks",
+            "probe_network",
         ]
         for key in expected_keys:
             if key in data:
@@ -62,32 +72,52 @@ def read_hosts_config(json_path="config.json"):
         raise RuntimeError(f"Failed to read {json_path}: {e}")
 
 
+def parse_ip_addr(output: str) -> list[dict]:
+    addresses = []
+    for link in json.loads(output.strip() or "[]"):
+        for info in link.get("addr_info", []):
+            if info.get("family") == "inet" and info.get("scope") == "global":
+                addresses.append({"ifname": link["ifname"], "address": info["local"], "prefixlen": info["prefixlen"]})
+    return addresses
+
+
+@lru_cache(maxsize=1)
+def local_addresses() -> tuple:
+    result = traced_run("command", "ip -j addr show up", shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        return ()
+    return tuple(parse_ip_addr(result.stdout))
+
+
+def _route_source(destination: str) -> str | None:
+    result = traced_run("command", f"ip -j route get {destination}", shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    routes = json.loads(result.stdout or "[]")
+    return routes[0].get("prefsrc") if routes else None
+
+
 def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Only consults local interfaces and the routing table, so it works without a default route.
+    addresses = [entry["address"] for entry in local_addresses()]
     try:
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-    finally:
-        s.close()
-    return ip
+        config = read_hosts_config()
+    except RuntimeError:
+        config = {}
+    hosts = [host for host in [config.get("server_ip")] + config.get("client_ips", []) if host]
+    for host in hosts:
+        if host in addresses:
+            return host
+    for host in hosts:
+        source = _route_source(host)
+        if source:
+            return source
+    return addresses[0] if addresses else "127.0.0.1"
 
 
 def run_command(command, check=True):
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    result = traced_run("command", command, shell=True, capture_output=True, text=True)
     print(f"Running command: {command}")
     if check and result.returncode != 0:
         raise RuntimeError(f"Command failed: {command}\n{result.stderr}")
     return result
-
-
-def is_host_available(host_ip: str):
-    try:
-        output = run_command(f"ping -w 1 {host_ip}", check=False)
-        if output.returncode == 0:
-            return True
-        else:
-            print(f"{host_ip} is not reachable")
-            return False
-    except Exception as e:
-        print(f"Error checking host availability: {e}")
-        return False
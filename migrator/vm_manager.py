@@ -1,49 +1,186 @@
-from migrator.utils import run_command, read_hosts_config, save_hosts_config
+from migrator.utils import run_command, read_hosts_config, add_vm_names, remove_vm_names
+from migrator import domain_xml
+from migrator.config_store import get_store
+from migrator.image_store import ImageStore, DEFAULT_BUDGET_GB
+from migrator.ssh_pool import ssh_pool
+from migrator.tracing import span
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import time
 import typer
 from pathlib import Path
-import json
-from urllib.parse import urlparse
 
 
 def delete_nfs_vm(vm_name: str):
-    config = read_hosts_config()
-    if not config or "nfs_path" not in config or config["nfs_path"] == "":
-        print("No NFS configuration found. Please run the setup command first.")
-        raise typer.BadParameter()
-    nfs_path = Path(config["nfs_path"])
+    nfs_path = _nfs_path()
     vm_image = nfs_path / f"{vm_name}.img"
     if vm_image.exists():
         run_command(f"sudo virsh destroy {vm_name}")
         run_command(f"sudo virsh undefine {vm_name} --remove-all-storage")
+        domain_xml.forget_hash(vm_name)
         print(f"Deleted VM image: {vm_image}")
     else:
         print(f"VM {vm_image} does not seem exist. Nothing to delete.")
-    available_vms = config["vm_names"]
-    available_vms.remove(vm_name)
-    save_hosts_config(vm_names=available_vms)
+    remove_vm_names([vm_name])
 
 
-def create_vm_on_nfs(
-    vm_name: str, image_path: str, image_name: str, disk_size: int, ram_size: int
-):
+def _nfs_path() -> Path:
     config = read_hosts_config()
     if not config or "nfs_path" not in config or config["nfs_path"] == "":
         print("No NFS configuration found. Please run the setup command first.")
         raise typer.BadParameter()
-    nfs_path = Path(config["nfs_path"])
-    image_path = get_path_to_image(image_path, image_name, nfs_path)
+    return Path(config["nfs_path"])
+
+
+def _templates_store(nfs_path: Path):
+    return get_store(str(nfs_path / "images" / "templates.json"))
+
+
+def load_templates(nfs_path: Path) -> dict:
+    store = _templates_store(nfs_path)
+    if not store.json_path.exists():
+        return {}
+    return store.read()
+
+
+def template_path(nfs_path: Path, template: str) -> Path:
+    return nfs_path / "images" / f"{template}.qcow2"
+
+
+def create_template(vm_name: str, template: str, os_variant: str = "generic"):
+    nfs_path = _nfs_path()
+    source = nfs_path / f"{vm_name}.img"
+    if not source.exists():
+        print(f"VM image {source} does not exist.")
+        raise typer.BadParameter(f"Unknown VM {vm_name}")
+    base = template_path(nfs_path, template)
+    # Every overlay built from the template uses it as its backing file.
+    if base.exists():
+        print(f"Template {template} already exists at {base}.")
+        raise typer.BadParameter(f"Template {template} already exists")
+    base.parent.mkdir(parents=True, exist_ok=True)
+    with span("template", template=template):
+        run_command(f"qemu-img convert -O qcow2 {source} {base}", check=True)
+    _templates_store(nfs_path).update(
+        {template: {"base": str(base.relative_to(nfs_path)), "os_variant": os_variant, "source_vm": vm_name}}
+    )
+    print(f"Created template {template} from {vm_name}: {base}")
+
+
+def create_overlay(base: Path, overlay: Path):
+    with span("overlay", base=str(base)):
+        run_command(f"qemu-img create -f qcow2 -F qcow2 -b {base} {overlay}", check=True)
+
+
+def _resolve_template(nfs_path: Path, template: str, os_variant: str = None):
+    base = template_path(nfs_path, template)
+    if not base.exists():
+        print(f"Template {template} not found at {base}. Run create-template first.")
+        raise typer.BadParameter(f"Unknown template {template}")
+    if os_variant is None:
+        os_variant = load_templates(nfs_path).get(template, {}).get("os_variant", "generic")
+    return base, os_variant
+
+
+def _domain_defined(vm_name: str) -> bool:
+    return run_command(f"sudo virsh dominfo {vm_name}", check=False).returncode == 0
+
+
+def _provision_overlay_vm(vm_name: str, base: Path, os_variant: str, ram_size: int, nfs_path: Path):
+    overlay = nfs_path / f"{vm_name}.img"
+    if overlay.exists():
+        print(f"VM image {overlay} already exists.")
+        raise typer.BadParameter(f"VM {vm_name} already exists")
+    # The rollback destroys and undefines the domain, so it must not be someone else's.
+    if _domain_defined(vm_name):
+        print(f"Domain {vm_name} is already defined.")
+        raise typer.BadParameter(f"VM {vm_name} already exists")
+    create_overlay(base, overlay)
+    try:
+        _import_vm(vm_name, os_variant, ram_size, overlay)
+    except Exception:
+        _rollback_vm(vm_name, overlay)
+        raise
+
+
+def _rollback_vm(vm_name: str, overlay: Path):
+    run_command(f"sudo virsh destroy {vm_name}", check=False)
+    run_command(f"sudo virsh undefine {vm_name}", check=False)
+    domain_xml.forget_hash(vm_name)
+    overlay.unlink(missing_ok=True)
+
+
+def create_vm_from_template(vm_name: str, template: str, ram_size: int, os_variant: str = None):
+    nfs_path = _nfs_path()
+    base, os_variant = _resolve_template(nfs_path, template, os_variant)
+    _provision_overlay_vm(vm_name, base, os_variant, ram_size, nfs_path)
+    add_vm_names([vm_name])
+
+
+def expand_vm_names(pattern: str, count: int, start: int = 1) -> list[str]:
+    if "{n" not in pattern:
+        pattern += "-{n}"
+    return [pattern.format(n=index) for index in range(start, start + count)]
+
+
+def create_vms_from_template(
+    vm_names: list[str], template: str, ram_size: int, os_variant: str = None, max_workers: int = 8
+) -> dict:
+    vm_names = list(dict.fromkeys(vm_names))
+    nfs_path = _nfs_path()
+    base, os_variant = _resolve_template(nfs_path, template, os_variant)
+
+    def provision(vm_name: str) -> float:
+        start = time.monotonic()
+        _provision_overlay_vm(vm_name, base, os_variant, ram_size, nfs_path)
+        return time.monotonic() - start
+
+    start = time.monotonic()
+    created, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(vm_names)))) as executor:
+        futures = {executor.submit(provision, vm_name): vm_name for vm_name in vm_names}
+        for future in as_completed(futures):
+            vm_name = futures[future]
+            try:
+                created[vm_name] = future.result()
+            except Exception as e:
+                failed[vm_name] = str(e).splitlines()[0] if str(e) else type(e).__name__
+    total = time.monotonic() - start
+
+    if created:
+        add_vm_names([vm_name for vm_name in vm_names if vm_name in created])
+    for vm_name in vm_names:
+        if vm_name in created:
+            print(f"{vm_name:<32} created in {created[vm_name]:.2f}s")
+        else:
+            print(f"{vm_name:<32} FAILED: {failed[vm_name]}")
+    print(f"Created {len(created)}/{len(vm_names)} VM(s) from {template} in {total:.2f}s")
+    return {"created": created, "failed": failed, "seconds": total}
+
+
+def _import_vm(vm_name: str, os_variant: str, ram_size: int, disk_path: Path):
+    virt_command = f"sudo virt-install --name {vm_name} --os-variant {os_variant} --ram {ram_size} --disk {disk_path},device=disk,bus=virtio,format=qcow2 --graphics vnc,listen=0.0.0.0 --noautoconsole --hvm --import"
+    domain_xml.forget_hash(vm_name)
+    with span("define", vm=vm_name):
+        run_command(virt_command, check=True)
+
+
+def create_vm_on_nfs(
+    vm_name: str, image_path: str, image_name: str, disk_size: int, ram_size: int, sha256: str = None
+):
+    nfs_path = _nfs_path()
+    image_path = get_path_to_image(image_path, image_name, nfs_path, sha256)
     run_command(f"qemu-img create -f raw {nfs_path/vm_name}.img {disk_size}G")
 
     _create_vm(
         vm_name,
         image_name,
-        nfs_path / image_path,
+        image_path,
         disk_size,
         ram_size,
         nfs_path / f"{vm_name}.img",
     )
-    save_hosts_config(vm_names=config["vm_names"] + [vm_name])
+    add_vm_names([vm_name])
 
 
 def _create_vm(
@@ -54,35 +191,18 @@ def _create_vm(
     ram_size: int,
     disk_path: str,
 ):
-    virt_command = f"sudo virt-install --name {vm_name} --os-type linux --os-variant {image_name} --ram {ram_size} --disk {disk_path},device=disk,bus=virtio,size={disk_size},format=qcow2 --graphics vnc,listen=0.0.0.0 --noautoconsole --hvm --cdrom {image_path} --boot cdrom,hd"
+    virt_command = f"sudo virt-install --name {vm_name} --os-type linux --os-variant {image_name} --ram {ram_size} --disk {disk_path},device=disk,bus=virtio,size={disk_size},format=raw --graphics vnc,listen=0.0.0.0 --noautoconsole --hvm --cdrom {image_path} --boot cdrom,hd"
+    domain_xml.forget_hash(vm_name)
     run_command(virt_command, check=True)
 
 
-def run_wget(url: str, dest_dir: str):
-    filename = os.path.basename(urlparse(url).path)
-    run_command(f"wget {url} -O {Path(dest_dir)/filename}", check=True)
-    return filename
-
-
-def get_path_to_image(image_path, image_name, nfs_path):
-    if not os.path.isfile(image_path):
-        if not os.path.isfile(f"{nfs_path}/images/config.json"):
-            Path(f"{nfs_path}/images").mkdir(parents=True, exist_ok=True)
-            images_config = {}
-        else:
-            with open(f"{nfs_path}/images/config.json", "r") as f:
-                images_config = json.load(f)
-        if image_name in images_config:
-            image_path = images_config[image_name]["image_path"]
-        else:
-            image_url = image_path
-            image_path = (
-                f"{nfs_path}/images/{run_wget(image_url, f'{nfs_path}/images/')}"
-            )
-            images_config[image_name] = {
-                "image_path": image_path.removeprefix(str(nfs_path)),
-                "image_url": image_url,
-            }
-            with open(f"{nfs_path}/images/config.json", "w") as f:
-                json.dump(images_config, f, indent=4)
-    return image_path
+def get_path_to_image(image_path, image_name, nfs_path, sha256=None):
+    if os.path.isfile(image_path):
+        return Path(image_path)
+    config = read_hosts_config()
+    budget = config.get("image_cache_gb", DEFAULT_BUDGET_GB)
+    hosts = [host for host in [config.get("server_ip")] + config.get("client_ips", []) if host]
+    try:
+        return ImageStore(nfs_path, budget, hosts).fetch(image_path, image_name, sha256)
+    finally:
+        ssh_pool.close_all()
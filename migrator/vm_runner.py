@@ -3,16 +3,24 @@ from migrator.utils import (
     save_hosts_config,
     read_hosts_config,
     get_local_ip,
-    is_host_available,
 )
+from migrator.health import host_reachable
+from migrator.ssh_pool import ssh_pool
+from migrator.image_index import lookup_image, remember_image
+from migrator.transfer import transfer_image, delta_sync_image, final_sync_image, stage_signature
+from migrator.transport import SSHShell, parallel_transfer
+from migrator.live_migration import LOCAL_MIGRATE_PORT, NFS_MIGRATE_PORT, run_live_migration
+from migrator.tracing import traced, traced_run
+from migrator import domain_xml, network, placement, registry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
-import subprocess
 import time
 import getpass
 import logging
-import tempfile
-import filecmp
+import math
+import shlex
 import os
+import paramiko
 
 
 logging.basicConfig(
@@ -26,6 +34,13 @@ class VMStatus(Enum):
     ERROR_RETRY = 2 
 
 
+SHUTDOWN_POLL_START = 0.02
+SHUTDOWN_POLL_MAX = 2.0
+SHUTDOWN_EVENT_WAIT = 2
+SHUTDOWN_RELEASE_GRACE = 10
+DEFAULT_LANES = 2
+
+
 #TODO remove ssh login use ssh keys
 
 
@@ -53,110 +68,106 @@ def get_field_from_config(field_name: str):
         return config[field_name]
 
 
-def look_for_vm_image(host_ip: str, img_name: str, ssh_user: str, password: str):
+@traced("find")
+def look_for_vm_image(host_ip: str, img_name: str, ssh_user: str, password: str, full_search: bool = False):
     logging.info(f"Searching for {img_name} on remote host {host_ip}...")
-    find_command = [
-        "sshpass", "-p", password, "ssh", f"{ssh_user}@{host_ip}",
-        f"sudo -S find / -type f -name {img_name} 2>/dev/null"
-    ]
-    find_result = subprocess.run(find_command, input=password + "\n", capture_output=True, text=True)
+    indexed_path = lookup_image(host_ip, img_name, ssh_user, password)
+    if indexed_path is not None:
+        return indexed_path
+    if not full_search:
+        raise FileNotFoundError(
+            f"VM image '{img_name}' is not in the image index for {host_ip}. Retry with --full-search to scan the whole filesystem."
+        )
+
+    logging.info(f"Falling back to a full filesystem search for {img_name} on {host_ip}...")
+    find_result = ssh_pool.run(
+        host_ip, ssh_user, password,
+        f"find / \\( -path /proc -o -path /sys -o -fstype nfs -o -fstype nfs4 \\) -prune -o -type f -name {img_name} -print 2>/dev/null", sudo=True
+    )
     if find_result.returncode != 0 and ("permission denied" in find_result.stderr.lower() or "authentication failed" in find_result.stderr.lower()):
         raise RuntimeError(f"SSH authentication failed: {find_result.stderr.strip()}")
     if not find_result.stdout.strip():
         raise FileNotFoundError(f"Could not find VM image named '{img_name}' on {host_ip}.")
 
-    return find_result.stdout.strip().splitlines()[0]
+    found_path = find_result.stdout.strip().splitlines()[0]
+    remember_image(host_ip, img_name, found_path)
+    return found_path
 
 
+@traced("dumpxml")
 def copy_vm_xml_config(host_ip: str, vm_name: str, ssh_user: str, password: str):
-    logging.info(f"Fetching VM xml config from {host_ip}...")                 
+    logging.info(f"Fetching VM xml config from {host_ip}...")
 
     xml_path = f"{get_field_from_config('xml_folder')}/{vm_name}.xml"
 
-    virsh_dump_remote_cmd = f'sshpass -p {password} ssh {ssh_user}@{host_ip} "virsh -c qemu:///system dumpxml {vm_name} > {xml_path}"'
-    virsh_dump_remote_result = subprocess.run(virsh_dump_remote_cmd, shell=True, capture_output=True, text=True)
+    virsh_dump_remote_result = ssh_pool.run(
+        host_ip, ssh_user, password, f"virsh -c qemu:///system dumpxml --inactive {vm_name}"
+    )
+    if virsh_dump_remote_result.returncode != 0:
+        raise RuntimeError(f"Failed to export VM xml config:\n{virsh_dump_remote_result.stderr}")
 
-    xml_scp_command = [
-        "sshpass", "-p", password,
-        "scp", f"{ssh_user}@{host_ip}:{xml_path}", xml_path
-    ]
-    xml_scp_result = subprocess.run(xml_scp_command, input=password + "\n", capture_output=True, text=True)
+    with open(xml_path, "w") as f:
+        f.write(virsh_dump_remote_result.stdout)
+    logging.info(f"VM config created and copied to {xml_path}")
 
-    if virsh_dump_remote_result.returncode == 0 and xml_scp_result.returncode == 0:
-        logging.info(f"VM config created and copied to {xml_path}")
-    elif xml_scp_result.returncode != 0:
-        raise RuntimeError(f"Failed to copy xml config:\n{xml_scp_result.stderr}")
-    elif virsh_dump_remote_result.returncode != 0:
-        raise RuntimeError(f"Failed to export VM xml config:\n{virsh_dump_remote_result.stderr}")
-    
     return xml_path
 
 
+@traced("start")
 def start_vm(vm_name: str):
     logging.info("Starting VM locally...")
     start_cmd = ["virsh", "start", vm_name]
-    start_result = subprocess.run(start_cmd, capture_output=True, text=True)
+    start_result = traced_run("virsh", start_cmd, capture_output=True, text=True)
     if start_result.returncode != 0:
         raise RuntimeError(f"Failed to start VM:\n{start_result.stderr}")
     else:
         logging.info(f"VM '{vm_name}' started successfully.")
 
 
-def is_vm_defined(vm_name: str) -> bool:
-    try:
-        result = subprocess.run(
-            ["virsh", "dominfo", vm_name],
-            capture_output=True,
-            text=True
-        )
-        return result.returncode == 0
-    except Exception as e:
-        raise RuntimeError(f"Failed to check VM definition: {e}")
+def _local_domain_xml(vm_name: str) -> str | None:
+    result = traced_run("virsh", ["virsh", "dumpxml", vm_name], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout
 
 
+@traced("define")
 def define_vm(vm_name: str, xml_path: str):
-    needs_defining = True
-
-    if is_vm_defined(vm_name=vm_name):
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_current:
-            tmp_current_path = tmp_current.name
-            virsh_dump_local_cmd = f"virsh dumpxml {vm_name}"
-            virsh_dump_local_result = subprocess.run(virsh_dump_local_cmd, shell=True, stdout=tmp_current, stderr=subprocess.PIPE, text=True)
-            if virsh_dump_local_result.returncode != 0:
-                logging.warning(f"Failed to dump current local VM definition: {virsh_dump_local_result.stderr.strip()}")
-                tmp_current_path = None
-
-        if tmp_current_path and os.path.exists(xml_path):
-            if filecmp.cmp(tmp_current_path, xml_path, shallow=False):
-                logging.info(f"No changes detected in VM xml for {vm_name}, skipping redefine.")
-                needs_defining = False
+    start = time.monotonic()
+    with open(xml_path, "r") as f:
+        wanted_hash = domain_xml.domain_hash(f.read())
+
+    # Always compare with libvirt's copy; "virsh edit" changes a definition in place under the same UUID.
+    current_xml = _local_domain_xml(vm_name)
+    if current_xml is not None:
+        if domain_xml.domain_hash(current_xml) == wanted_hash:
+            cached = domain_xml.cached_hash(vm_name)
+            if cached and cached["hash"] == wanted_hash:
+                saved = cached.get("define_seconds", 0.0) - (time.monotonic() - start)
+                logging.info(f"Domain xml of {vm_name} matches the cached definition, skipping redefine (saved ~{max(saved, 0.0):.3f}s).")
             else:
-                logging.info(f"Changes detected in VM xml for {vm_name}, proceeding with redefine.")
-                virsh_undefine_cmd = f"virsh undefine {vm_name}"
-                virsh_undefine_result = subprocess.run(virsh_undefine_cmd, shell=True, capture_output=True, text=True)
-                if virsh_undefine_result.returncode != 0:
-                    raise RuntimeError(f"Failed to undefine VM locally: {virsh_undefine_result.stderr}")            
+                domain_xml.remember_hash(vm_name, wanted_hash)
+                logging.info(f"No changes detected in VM xml for {vm_name}, skipping redefine.")
+            return
+        logging.info(f"Changes detected in VM xml for {vm_name}, proceeding with redefine.")
+        virsh_undefine_result = traced_run("virsh", ["virsh", "undefine", vm_name], capture_output=True, text=True)
+        if virsh_undefine_result.returncode != 0:
+            raise RuntimeError(f"Failed to undefine VM locally: {virsh_undefine_result.stderr}")
 
-    if needs_defining:
-        virsh_define_cmd = f"virsh define {xml_path}"
-        virsh_define_result = subprocess.run(virsh_define_cmd, shell=True, capture_output=True, text=True)
-        if virsh_define_result.returncode != 0:
-            raise RuntimeError(f"Failed to define VM locally: {virsh_define_result.stderr}")
+    virsh_define_result = traced_run("virsh", ["virsh", "define", xml_path], capture_output=True, text=True)
+    if virsh_define_result.returncode != 0:
+        domain_xml.forget_hash(vm_name)
+        raise RuntimeError(f"Failed to define VM locally: {virsh_define_result.stderr}")
 
-        logging.info(f"Successfully defined {vm_name} locally.")
+    domain_xml.remember_hash(vm_name, wanted_hash, time.monotonic() - start)
+    logging.info(f"Successfully defined {vm_name} locally.")
 
 
+@traced("probe")
 def remote_image_in_use(host_ip: str, user: str, image_path: str, password: str) -> VMStatus:
     logging.info(f"Checking if image: {image_path} is in use on host: {host_ip}...")
     try:
-        fuser_command = ["sshpass", "-p", password, "ssh", f"{user}@{host_ip}", f"sudo -S fuser {image_path}"]
-        fuser_result = subprocess.run(
-            fuser_command,
-            input=password + "\n",
-            capture_output=True,
-            text=True,
-            timeout=10,
-        )
+        fuser_result = ssh_pool.run(host_ip, user, password, f"fuser {image_path}", sudo=True, timeout=10)
         if fuser_result.returncode == 0:
             return VMStatus.STILL_RUNNING
         elif fuser_result.returncode != 0:
@@ -168,39 +179,167 @@ def remote_image_in_use(host_ip: str, user: str, image_path: str, password: str)
         return VMStatus.ERROR_RETRY
 
 
-def shutdown_remote_vm(host_ip: str, user: str, image_path: str, password: str) -> VMStatus:
-    vm_name = Path(image_path).stem
+def _remote_domain_state(host_ip: str, user: str, password: str, vm_name: str) -> str:
+    return ssh_pool.run(host_ip, user, password, f"virsh domstate {vm_name}", sudo=True, timeout=10).stdout.strip()
+
+
+def wait_for_domain_shutdown(host_ip: str, user: str, password: str, vm_name: str, deadline: float) -> bool:
+    delay = SHUTDOWN_POLL_START
+    use_events = True
+    while time.monotonic() < deadline:
+        if _remote_domain_state(host_ip, user, password, vm_name) == "shut off":
+            return True
+        remaining = deadline - time.monotonic()
+        if use_events:
+            event_timeout = max(1, min(SHUTDOWN_EVENT_WAIT, math.ceil(remaining)))
+            event_result = ssh_pool.run(
+                host_ip, user, password,
+                f"virsh event --domain {vm_name} --event lifecycle --timeout {event_timeout}",
+                sudo=True, timeout=event_timeout + 10,
+            )
+            if event_result.returncode == 0:
+                continue
+            logging.info("virsh event is not available, falling back to polling domain state.")
+            use_events = False
+        time.sleep(min(delay, max(remaining, 0)))
+        delay = min(delay * 2, SHUTDOWN_POLL_MAX)
+    return False
+
+
+def wait_for_image_release(host_ip: str, user: str, password: str, image_path: str, deadline: float) -> bool:
+    delay = SHUTDOWN_POLL_START
+    while True:
+        if remote_image_in_use(host_ip, user, image_path, password) == VMStatus.SUCCESS:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        logging.info("Still in use... waiting")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, SHUTDOWN_POLL_MAX)
+
+
+@traced("shutdown")
+def shutdown_remote_vm(host_ip: str, user: str, image_path: str, password: str, vm_name: str) -> VMStatus:
+    config = read_hosts_config()
+    shutdown_timeout = float(config.get("shutdown_timeout", 60))
+    escalate = bool(config.get("shutdown_escalate", False))
     logging.info(f"Attempting to shut down VM '{vm_name}' on host {host_ip} via SSH...")
     try:
-        virsh_shutdown_command = ["sshpass", "-p", password, "ssh", f"{user}@{host_ip}", f"sudo -S virsh shutdown {vm_name}"]
-        virsh_shutdown_result = subprocess.run(
-            virsh_shutdown_command,
-            input=password + "\n",
-            capture_output=True,
-            text=True,
-            timeout=10,
-        )
+        shutdown_requested = time.monotonic()
+        deadline = shutdown_requested + shutdown_timeout
+        virsh_shutdown_result = ssh_pool.run(host_ip, user, password, f"virsh shutdown {vm_name}", sudo=True, timeout=10)
         if virsh_shutdown_result.returncode == 1:
             if "permission denied" in virsh_shutdown_result.stderr.lower() or "authentication failed" in virsh_shutdown_result.stderr.lower():
                 raise RuntimeError("SSH authentication failed")
             return VMStatus.ERROR_RETRY
 
         logging.info("Waiting for VM to shut down...")
-        for _ in range(12):
-            time.sleep(5)
-            if remote_image_in_use(host_ip, user, image_path, password) == VMStatus.SUCCESS:
-                logging.info("Image is not in use on any remote hosts.")
-                return VMStatus.SUCCESS
-            logging.info("Still in use... waiting")
-        raise RuntimeError("Image still in use after shutdown attempt.")
+        if not wait_for_domain_shutdown(host_ip, user, password, vm_name, deadline):
+            if not escalate:
+                raise RuntimeError(f"VM did not shut down within {shutdown_timeout:.0f}s.")
+            logging.warning(f"VM did not shut down within {shutdown_timeout:.0f}s, destroying it.")
+            destroy_result = ssh_pool.run(host_ip, user, password, f"virsh destroy {vm_name}", sudo=True, timeout=30)
+            if destroy_result.returncode != 0:
+                raise RuntimeError(f"Failed to destroy VM: {destroy_result.stderr.strip()}")
+            deadline = time.monotonic() + SHUTDOWN_RELEASE_GRACE
+
+        if not wait_for_image_release(host_ip, user, password, image_path, max(deadline, time.monotonic() + SHUTDOWN_RELEASE_GRACE)):
+            raise RuntimeError("Image still in use after shutdown attempt.")
+        logging.info("Image is not in use on any remote hosts.")
+        logging.info(f"Image released {time.monotonic() - shutdown_requested:.3f}s after shutdown request.")
+        return VMStatus.SUCCESS
     except Exception as e:
         logging.error(f"Unexpected error occurred: {e}")
         return VMStatus.ERROR_RETRY
 
 
+def load_credentials():
+    ssh_user = read_hosts_config().get("ssh_user")
+    password = os.environ.get("MIGRATOR_SSH_PASSWORD")
+    if not ssh_user or password is None:
+        raise RuntimeError(
+            "Non-interactive mode needs 'ssh_user' in config.json and the MIGRATOR_SSH_PASSWORD environment variable."
+        )
+    return ssh_user, password
+
+
+def prompt_credentials(host_ip: str, ssh_user: str = None, password: str = None):
+    if ssh_user is None:
+        ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
+    if password is None:
+        password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
+    return ssh_user, password
+
+
+def find_image_owner(host_ips: list[str], image_path: str, ssh_user: str, password: str, max_workers: int = 16):
+    if not host_ips:
+        return None
+    start = time.monotonic()
+    owner = None
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(host_ips)))
+    futures = {
+        executor.submit(remote_image_in_use, host_ip, ssh_user, image_path, password): host_ip
+        for host_ip in host_ips
+    }
+    try:
+        for future in as_completed(futures):
+            host_ip = futures[future]
+            status = future.result()
+            if status == VMStatus.STILL_RUNNING:
+                owner = host_ip
+                break
+            if status == VMStatus.ERROR_RETRY:
+                logging.warning(f"Could not probe {host_ip}, skipping it.")
+    finally:
+        # Return as soon as the owner is known; probes still in flight close their own clients
+        # when the caller closes the pool.
+        executor.shutdown(wait=False, cancel_futures=True)
+    logging.info(f"Probed {len(host_ips)} host(s) in {time.monotonic() - start:.3f}s")
+    return owner
+
+
+def registered_owner(vm_name: str, host_ips: list[str]) -> str | None:
+    entry = registry.lookup(vm_name)
+    if entry is None or entry["state"] != "running" or entry["host"] not in host_ips:
+        return None
+    return entry["host"]
+
+
+def locate_owner(vm_name: str, host_ips: list[str], image_path: str, ssh_user: str, password: str):
+    owner = registered_owner(vm_name, host_ips)
+    if owner is not None:
+        if remote_image_in_use(owner, ssh_user, image_path, password) == VMStatus.STILL_RUNNING:
+            logging.info(f"Registry places {vm_name} on {owner}")
+            return owner
+        logging.info(f"Registry entry for {vm_name} on {owner} is stale, probing all hosts")
+    owner = find_image_owner(host_ips, image_path, ssh_user, password)
+    if owner is not None:
+        registry.record(vm_name, owner, "running")
+    return owner
+
+
+def run_vm_nfs_parallel(vm_name: str, img_name: str, full_image_path: str, host_ips: list[str]):
+    ssh_user, password = load_credentials()
+    try:
+        host_ip = locate_owner(vm_name, host_ips, full_image_path, ssh_user, password)
+        if host_ip is None:
+            logging.info(f"Image {img_name} is not in use on any remote host.")
+        else:
+            logging.info(f"Image {img_name} is in use on {host_ip}")
+            if shutdown_remote_vm(host_ip, ssh_user, full_image_path, password, vm_name) == VMStatus.ERROR_RETRY:
+                raise RuntimeError("Couldn't shut down remote VM.")
 
-def run_vm_nfs(img_name: str):
-    log_info_before(vm_name=vm_name)
+            registry.record(vm_name, host_ip, "shut off")
+
+            xml_path = copy_vm_xml_config(host_ip=host_ip, vm_name=vm_name, ssh_user=ssh_user, password=password)
+            define_vm(vm_name=vm_name, xml_path=xml_path)
+    finally:
+        ssh_pool.log_timings()
+        ssh_pool.close_all()
+
+
+def run_vm_nfs(img_name: str, non_interactive: bool = False):
     mount_path = get_field_from_config("nfs_path")
     full_image_path = Path(mount_path) / img_name
 
@@ -208,140 +347,278 @@ def run_vm_nfs(img_name: str):
         raise FileNotFoundError(f"Image not found: {full_image_path}")
 
     vm_name = full_image_path.stem
+    log_info_before(vm_name=vm_name)
     full_image_path = str(full_image_path)
     local_ip = get_local_ip()
 
     host_ips = get_field_from_config("client_ips")
-    for host_ip in host_ips:
-        if host_ip == local_ip:
-            logging.info(f"Skipping local host: {host_ip}")
-            continue
-        logging.info(f"Checking if {img_name} is in use on {host_ip}...")
-        image_in_use_result = VMStatus.ERROR_RETRY
-        while image_in_use_result == VMStatus.ERROR_RETRY:
-            ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
-            password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
-            image_in_use_result = remote_image_in_use(host_ip, ssh_user, full_image_path, password)
-            if image_in_use_result == VMStatus.STILL_RUNNING:
-                logging.info(f"Image {img_name} is in use on {host_ip}")
-                if shutdown_remote_vm(host_ip, ssh_user, full_image_path, password) == VMStatus.ERROR_RETRY:
-                    raise RuntimeError("Couldn't shut down remote VM.")
-
-                xml_path = copy_vm_xml_config(host_ip=host_ip, vm_name=vm_name, ssh_user=ssh_user, password=password)
-                define_vm(vm_name=vm_name, xml_path=xml_path)
-                break
+    if non_interactive:
+        remote_ips = [host_ip for host_ip in host_ips if host_ip != local_ip]
+        run_vm_nfs_parallel(vm_name, img_name, full_image_path, remote_ips)
+        start_vm(vm_name=vm_name)
+        registry.record(vm_name, local_ip, "running", [full_image_path])
+        return
+
+    owner = registered_owner(vm_name, host_ips)
+    if owner is not None:
+        host_ips = [owner] + [host_ip for host_ip in host_ips if host_ip != owner]
+    try:
+        for host_ip in host_ips:
+            if host_ip == local_ip:
+                logging.info(f"Skipping local host: {host_ip}")
+                continue
+            logging.info(f"Checking if {img_name} is in use on {host_ip}...")
+            image_in_use_result = VMStatus.ERROR_RETRY
+            while image_in_use_result == VMStatus.ERROR_RETRY:
+                ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
+                password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
+                image_in_use_result = remote_image_in_use(host_ip, ssh_user, full_image_path, password)
+                if image_in_use_result == VMStatus.STILL_RUNNING:
+                    logging.info(f"Image {img_name} is in use on {host_ip}")
+                    if shutdown_remote_vm(host_ip, ssh_user, full_image_path, password, vm_name) == VMStatus.ERROR_RETRY:
+                        raise RuntimeError("Couldn't shut down remote VM.")
+                    registry.record(vm_name, host_ip, "shut off")
+
+                    xml_path = copy_vm_xml_config(host_ip=host_ip, vm_name=vm_name, ssh_user=ssh_user, password=password)
+                    define_vm(vm_name=vm_name, xml_path=xml_path)
+                    break
+    finally:
+        ssh_pool.log_timings()
+        ssh_pool.close_all()
 
     start_vm(vm_name=vm_name)
+    registry.record(vm_name, local_ip, "running", [full_image_path])
 
 
-def run_vm_scp(host_ip: str, img_name: str):
+@traced("copy")
+def copy_vm_image(
+    host_ip: str, ssh_user: str, password: str, remote_path: str, local_dest: Path, delta: bool,
+    streams: int = 1, codec: str = "none", staged_signature: str = None,
+):
+    logging.info(f"Starting transfer of image {remote_path}...")
+    try:
+        if staged_signature:
+            stats = final_sync_image(host_ip, ssh_user, password, remote_path, local_dest, staged_signature)
+        elif delta:
+            stats = delta_sync_image(host_ip, ssh_user, password, remote_path, local_dest)
+        elif streams != 1 or codec != "none":
+            stats = parallel_transfer(SSHShell(host_ip, ssh_user, password), remote_path, local_dest, streams, codec)
+        else:
+            stats = transfer_image(host_ip, ssh_user, password, remote_path, local_dest)
+    except (OSError, paramiko.SSHException) as e:
+        raise RuntimeError(f"Failed to copy VM image, rerun to resume the transfer:\n{e}")
+    logging.info(f"VM image copied to {local_dest}")
+    return stats
+
+
+def _remote_allocations(host_ip: str, ssh_user: str, password: str, paths: list[str]) -> dict:
+    quoted = " ".join(shlex.quote(path) for path in paths)
+    result = ssh_pool.run(host_ip, ssh_user, password, f"stat -c '%b %B %n' {quoted}", sudo=True)
+    sizes = {}
+    for line in result.stdout.splitlines():
+        blocks, block_size, path = line.split(" ", 2)
+        sizes[path] = int(blocks) * int(block_size)
+    return sizes
+
+
+def plan_local_paths(files: list[dict], local_dest_dir: Path) -> dict:
+    mapping = {}
+    used = set()
+    for file in files:
+        name = Path(file["path"]).name
+        if name in used:
+            name = f"{file['target']}-{name}"
+        used.add(name)
+        mapping[file["path"]] = local_dest_dir / name
+    return mapping
+
+
+def copy_vm_files(
+    host_ip: str, ssh_user: str, password: str, files: list[dict], mapping: dict, delta: bool,
+    streams: int = 1, codec: str = "none", lanes: int = DEFAULT_LANES, only_existing_delta: bool = False,
+    staged: dict = None,
+) -> dict:
+    sizes = _remote_allocations(host_ip, ssh_user, password, [file["path"] for file in files])
+    # Largest first keeps the biggest disk off the tail of the schedule; small files fill free lanes.
+    ordered = sorted(files, key=lambda file: sizes.get(file["path"], 0), reverse=True)
+
+    def copy(file: dict) -> float:
+        local_dest = mapping[file["path"]]
+        use_delta = local_dest.exists() if only_existing_delta else delta
+        start = time.monotonic()
+        copy_vm_image(
+            host_ip, ssh_user, password, file["path"], local_dest, use_delta, streams, codec,
+            (staged or {}).get(file["path"]),
+        )
+        return time.monotonic() - start
+
+    start = time.monotonic()
+    durations = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(lanes, len(ordered)))) as executor:
+        futures = {executor.submit(copy, file): file for file in ordered}
+        for future in as_completed(futures):
+            durations[futures[future]["path"]] = future.result()
+    wall = time.monotonic() - start
+
+    for file in ordered:
+        seconds = durations[file["path"]]
+        size = sizes.get(file["path"], 0)
+        logging.info(
+            f"{file['target'] or file['kind']} {file['path']}: {size / 1024**2:.1f} MiB in {seconds:.2f}s "
+            f"({size / 1024**2 / max(seconds, 1e-6):.1f} MiB/s)"
+        )
+    critical = max(durations, key=durations.get)
+    logging.info(
+        f"Copied {len(files)} file(s) in {wall:.2f}s over {min(lanes, len(files))} lane(s); critical path "
+        f"{Path(critical).name} took {durations[critical]:.2f}s, serial sum {sum(durations.values()):.2f}s"
+    )
+    return {"seconds": wall, "files": durations, "critical_path": critical}
+
+
+def stage_vm_files(host_ip: str, ssh_user: str, password: str, files: list[dict], mapping: dict, lanes: int) -> dict:
+    def stage(file: dict) -> str:
+        try:
+            return stage_signature(host_ip, ssh_user, password, mapping[file["path"]])
+        except (OSError, paramiko.SSHException) as e:
+            raise RuntimeError(f"Failed to stage the signature of {file['path']}:\n{e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(lanes, len(files)))) as executor:
+        return dict(zip([file["path"] for file in files], executor.map(stage, files)))
+
+
+def run_vm_scp(
+    host_ip: str, img_name: str, full_search: bool = False, delta: bool = False, precopy: bool = False,
+    streams: int = 1, codec: str = "none", lanes: int = DEFAULT_LANES, ssh_user: str = None, password: str = None,
+):
     vm_name = img_name.rsplit(".", 1)[0]
     log_info_before(vm_name=vm_name, host_ip=host_ip)
     local_dest_dir = Path(get_field_from_config("local_vm_path"))
-
     local_dest_dir.mkdir(parents=True, exist_ok=True)
-    local_dest = local_dest_dir / img_name
-
-    ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
-    password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
-
-    remote_path = look_for_vm_image(host_ip=host_ip, img_name=img_name, ssh_user=ssh_user, password=password)
-
-    image_in_use_result = remote_image_in_use(host_ip, ssh_user, remote_path, password)
-    if image_in_use_result == VMStatus.STILL_RUNNING:
-        logging.info(f"Image {img_name} is in use on {host_ip}")
-        if shutdown_remote_vm(host_ip, ssh_user, remote_path, password) == VMStatus.ERROR_RETRY:
-            raise RuntimeError("Couldn't shut down remote VM.")
-    logging.info(f"Starting SCP of image {remote_path}...")
-
-    vm_scp_command = [
-        "sshpass", "-p", password,
-        "scp",
-        f"{ssh_user}@{host_ip}:{remote_path}",
-        str(local_dest)
-    ]
-    vm_scp_result = subprocess.run(vm_scp_command, input=password + "\n", capture_output=True, text=True)
-
-    if vm_scp_result.returncode == 0:
-        logging.info(f"VM image copied to {local_dest}")
-    else:
-        raise RuntimeError(f"Failed to copy VM image:\n{vm_scp_result.stderr}")
 
+    ssh_user, password = prompt_credentials(host_ip, ssh_user, password)
 
-    xml_path = copy_vm_xml_config(host_ip=host_ip, vm_name=vm_name, ssh_user=ssh_user, password=password)
+    migration_start = time.monotonic()
+    downtime_start = None
+    staged = None
+    try:
+        data_ip = network.transfer_address(host_ip, ssh_user, password)
+        xml_path = copy_vm_xml_config(host_ip=host_ip, vm_name=vm_name, ssh_user=ssh_user, password=password)
+        with open(xml_path, "r") as f:
+            xml_text = f.read()
+        files = domain_xml.domain_files(xml_text)
+        if not any(file["kind"] == "disk" for file in files):
+            remote_path = look_for_vm_image(
+                host_ip=host_ip, img_name=img_name, ssh_user=ssh_user, password=password, full_search=full_search
+            )
+            files.insert(0, {"kind": "disk", "path": remote_path, "target": None})
+        primary_disk = next(file["path"] for file in files if file["kind"] == "disk")
+        mapping = plan_local_paths(files, local_dest_dir)
+
+        if precopy:
+            logging.info("Pre-copy phase: syncing disks while the source VM is still running...")
+            copy_vm_files(
+                data_ip, ssh_user, password, files, mapping, delta=False,
+                streams=streams, codec=codec, lanes=lanes, only_existing_delta=True,
+            )
+            # Hash the copies while the VM still runs; the final pass then only diffs on the source.
+            staged = stage_vm_files(data_ip, ssh_user, password, files, mapping, lanes)
+
+        image_in_use_result = remote_image_in_use(host_ip, ssh_user, primary_disk, password)
+        if image_in_use_result == VMStatus.STILL_RUNNING:
+            logging.info(f"Image {primary_disk} is in use on {host_ip}")
+            downtime_start = time.monotonic()
+            if shutdown_remote_vm(host_ip, ssh_user, primary_disk, password, vm_name) == VMStatus.ERROR_RETRY:
+                raise RuntimeError("Couldn't shut down remote VM.")
+
+        if precopy:
+            logging.info("Final phase: transferring blocks dirtied since the pre-copy pass...")
+        final = copy_vm_files(
+            data_ip, ssh_user, password, files, mapping, delta=delta,
+            streams=streams, codec=codec, lanes=lanes, staged=staged,
+        )
+    finally:
+        ssh_pool.log_timings()
+        ssh_pool.close_all()
 
+    with open(xml_path, "w") as f:
+        f.write(domain_xml.rewrite_paths(xml_text, mapping))
     define_vm(vm_name=vm_name, xml_path=xml_path)
 
     start_vm(vm_name=vm_name)
-
-
-def migrate_live_local(vm_name: str, host_ip: str):
+    registry.record(vm_name, host_ip, "shut off")
+    registry.record(vm_name, get_local_ip(), "running", [str(path) for path in mapping.values()])
+
+    migration_end = time.monotonic()
+    downtime = None
+    if downtime_start is not None:
+        downtime = migration_end - downtime_start
+        logging.info(f"VM downtime: {downtime:.2f}s, of which {final['seconds']:.2f}s final copy")
+    logging.info(f"Total migration time: {migration_end - migration_start:.2f}s")
+    return {"vm": vm_name, "seconds": migration_end - migration_start, "downtime_seconds": downtime}
+
+
+def migrate_live_local(
+    vm_name: str, host_ip: str, profile: str = "default", channels: int = 4,
+    max_downtime: int = None, bandwidth: int = None, ssh_user: str = None, password: str = None,
+    target_ip: str = None,
+):
     log_info_before(vm_name=vm_name, host_ip=host_ip)
-    if not is_host_available(host_ip):
+    if not host_reachable(host_ip, required=("ssh",)):
         raise RuntimeError(f"Host {host_ip} is not reachable")
 
-    ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
-    password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
-    current_ip = get_local_ip()
-
-    virsh_command = [
-        "ssh",
-        f"{ssh_user}@{host_ip}",
-        "sudo",
-        "-S",
-        "virsh", "migrate",
-        "--live", "--persistent", "--unsafe", "--verbose",
-        "--copy-storage-all",
-        f"{vm_name}",
-        f"qemu+ssh://{ssh_user}@{current_ip}/system",
-        "--migrateuri", f"tcp://{ssh_user}@{current_ip}:49153"
-    ]
-
-    virsh_result = subprocess.run(
-        virsh_command,
-        input=password + "\n",
-        capture_output=True,
-        text=True,
-    )
-
-    if virsh_result.returncode == 0:
-        logging.info(f"Machine migrated successfully.\n{virsh_result}")
-    else:
-        raise RuntimeError(f"Failed to copy VM image:\n{virsh_result.stderr}")
-
+    ssh_user, password = prompt_credentials(host_ip, ssh_user, password)
+    if target_ip == "auto":
+        target_ip = placement.place_vm(vm_name, host_ip, ssh_user, password)
+    elif target_ip and not host_reachable(target_ip, required=("ssh",)):
+        raise RuntimeError(f"Target {target_ip} is not reachable")
+    current_ip = target_ip or get_local_ip()
+    migrate_ip = network.migration_address(host_ip, ssh_user, password, target_ip)
 
-def migrate_live_nfs(vm_name: str, host_ip: str):
+    try:
+        summary = run_live_migration(
+            vm_name, host_ip, ssh_user, password,
+            dest_uri=f"qemu+ssh://{ssh_user}@{current_ip}/system",
+            migrate_uri=f"tcp://{ssh_user}@{migrate_ip}:{LOCAL_MIGRATE_PORT}",
+            base_flags=["--live", "--persistent", "--unsafe", "--copy-storage-all"],
+            profile=profile, channels=channels, max_downtime=max_downtime, bandwidth=bandwidth,
+        )
+    finally:
+        ssh_pool.close_all()
+    registry.record(vm_name, host_ip, "shut off")
+    registry.record(vm_name, current_ip, "running")
+    return summary
+
+
+def migrate_live_nfs(
+    vm_name: str, host_ip: str, profile: str = "default", channels: int = 4,
+    max_downtime: int = None, bandwidth: int = None, ssh_user: str = None, password: str = None,
+    target_ip: str = None,
+):
     log_info_before(vm_name=vm_name, host_ip=host_ip)
-    if not is_host_available(host_ip):
+    if not host_reachable(host_ip, required=("ssh",)):
         raise RuntimeError(f"Host {host_ip} is not reachable")
     config = read_hosts_config()
     if not os.path.exists(Path(config["nfs_path"]) / f"{vm_name}.img"):
         raise RuntimeError(f"Remote NFS path {config['nfs_path']}/{f'{vm_name}.img'} does not exist")
 
-    ssh_user = input(f"Enter SSH username for {host_ip}: ").strip()
-    password = getpass.getpass(f"Sudo password for {ssh_user}@{host_ip}: ")
-    current_ip = get_local_ip()
-
-    virsh_command = [
-        "ssh",
-        f"{ssh_user}@{host_ip}",
-        "sudo",
-        "-S",
-        "virsh", "migrate",
-        "--live", "--persistent", "--unsafe", "--verbose",
-        f"{vm_name}",
-        f"qemu+ssh://{ssh_user}@{current_ip}/system",
-        "--migrateuri", f"tcp://{ssh_user}@{current_ip}:49152"
-    ]
-
-    virsh_result = subprocess.run(
-        virsh_command,
-        input=password + "\n",
-        capture_output=True,
-        text=True,
-    )
+    ssh_user, password = prompt_credentials(host_ip, ssh_user, password)
+    if target_ip == "auto":
+        target_ip = placement.place_vm(vm_name, host_ip, ssh_user, password)
+    elif target_ip and not host_reachable(target_ip, required=("ssh",)):
+        raise RuntimeError(f"Target {target_ip} is not reachable")
+    current_ip = target_ip or get_local_ip()
+    migrate_ip = network.migration_address(host_ip, ssh_user, password, target_ip)
 
-    if virsh_result.returncode == 0:
-        logging.info(f"Machine migrated successfully.\n{virsh_result}")
-    else:
-        raise RuntimeError(f"Failed to copy VM image:\n{virsh_result.stderr}")
+    try:
+        summary = run_live_migration(
+            vm_name, host_ip, ssh_user, password,
+            dest_uri=f"qemu+ssh://{ssh_user}@{current_ip}/system",
+            migrate_uri=f"tcp://{ssh_user}@{migrate_ip}:{NFS_MIGRATE_PORT}",
+            base_flags=["--live", "--persistent", "--unsafe"],
+            profile=profile, channels=channels, max_downtime=max_downtime, bandwidth=bandwidth,
+        )
+    finally:
+        ssh_pool.close_all()
+    registry.record(vm_name, host_ip, "shut off")
+    registry.record(vm_name, current_ip, "running")
+    return summary